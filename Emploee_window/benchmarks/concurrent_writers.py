@@ -0,0 +1,117 @@
+# concurrent_writers.py — параллельные записи одного профиля: потерянные обновления с If-Match и без
+# Запуск: python benchmarks/concurrent_writers.py --writers 8 --writes 25
+# Каждый писатель делает read-modify-write: читает профиль, дописывает свой токен в resume_text и сохраняет PATCH.
+#   if_match — с If-Match; на 412 берёт актуальный профиль из ответа и повторяет (ни одно обновление не теряется);
+#   blind    — без If-Match (как раньше): параллельные записи затирают друг друга, считаем потери;
+#   skills   — одновременная замена списка навыков без If-Match: итог — ровно один из присланных наборов.
+# Бэкенд — отдельный процесс uvicorn на временной базе (как в load_test.py). Ненулевой код выхода — если If-Match что-то потерял
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from load_test import COMPONENTS, start_server  # noqa: E402
+
+
+def seed(db_path: str) -> int:
+    os.environ.update({"DB_PATH": db_path, "JOBS_ENABLED": "0", "SCIBOX_API_KEY": "", "LOG_LEVEL": "WARNING"})
+    sys.path.insert(0, COMPONENTS)
+    import backend
+
+    db = backend.SessionLocal()
+    try:
+        user = backend.User(email="writers@example.com", full_name="Concurrent Writers", resume_text="")
+        db.add(user)
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+        backend.engine.dispose()                    # файл базы отдаём процессу сервера
+
+
+def run_writers(base: str, user_id: int, mode: str, writers: int, writes: int) -> dict:
+    stats = {"ok": 0, "conflicts": 0, "errors": {}}
+    lock = threading.Lock()
+
+    def count(key: str, status: int = 0) -> None:
+        with lock:
+            if key == "errors":
+                stats["errors"][str(status)] = stats["errors"].get(str(status), 0) + 1
+            else:
+                stats[key] += 1
+
+    def writer(i: int) -> None:
+        session = requests.Session()
+        for k in range(writes):
+            token = f"[w{i}-{k}]"
+            if mode == "skills":
+                r = session.patch(f"{base}/users/{user_id}", json={"skills": [{"name": f"Навык {i}-a"}, {"name": f"Навык {i}-b"}]})
+                count("ok") if r.status_code == 200 else count("errors", r.status_code)
+                continue
+            r = session.get(f"{base}/users/{user_id}")
+            current, etag = r.json(), r.headers.get("ETag")
+            while True:
+                headers = {"If-Match": etag} if mode == "if_match" else {}
+                r = session.patch(f"{base}/users/{user_id}", json={"resume_text": (current["resume_text"] or "") + token},
+                                  headers=headers)
+                if r.status_code == 412:               # профиль изменили — повторяем поверх актуального состояния
+                    count("conflicts")
+                    current, etag = r.json()["current"], r.headers.get("ETag")
+                    continue
+                count("ok") if r.status_code == 200 else count("errors", r.status_code)
+                break
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    final = requests.get(f"{base}/users/{user_id}").json()
+    out = {"mode": mode, "writes": writers * writes, "seconds": round(elapsed, 2),
+           "writes_per_sec": round(writers * writes / elapsed, 1), **stats, "version": final["version"]}
+    if mode == "skills":
+        names = sorted(s["name"] for s in final["skills"])
+        out["consistent"] = any(names == [f"Навык {i}-a", f"Навык {i}-b"] for i in range(writers))
+    else:
+        present = sum(f"[w{i}-{k}]" in (final["resume_text"] or "") for i in range(writers) for k in range(writes))
+        out["lost_updates"] = writers * writes - present
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Потерянные обновления профиля при параллельных записях")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=25, help="записей на писателя")
+    parser.add_argument("--modes", default="if_match,blind,skills")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="concurrent-writers-")
+    db_path = os.path.join(workdir, "app.db")
+    user_id = seed(db_path)
+    proc, base = start_server(workdir, db_path, "http://127.0.0.1:9", jobs=False)
+    try:
+        results = []
+        for mode in args.modes.split(","):
+            requests.patch(f"{base}/users/{user_id}", json={"resume_text": "-"})  # каждый режим — с чистого резюме
+            results.append(run_writers(base, user_id, mode, args.writers, args.writes))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    print(json.dumps({"writers": args.writers, "writes_per_writer": args.writes, "results": results}, ensure_ascii=False, indent=2))
+    failed = [r["mode"] for r in results
+              if (r["mode"] == "if_match" and (r["lost_updates"] or r["errors"])) or (r["mode"] == "skills" and not r["consistent"])]
+    if failed:
+        raise SystemExit(f"Нарушена согласованность: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
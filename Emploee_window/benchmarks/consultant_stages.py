@@ -0,0 +1,81 @@
+# consultant_stages.py — какой этап консультанта (load_profile / personalize / llm / save) доминирует с ростом профиля
+# Запуск: python benchmarks/consultant_stages.py --sizes 10,100,500 --repeat 10 --llm-ms 0
+# Время этапов берётся из заголовка Server-Timing (X-Debug-Timing: 1). --llm-ms > 0 подменяет вызов Scibox
+# задержкой фиксированной длины, чтобы сравнивать этапы без сети; 0 — LLM не вызывается (запасной ответ)
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+COMPONENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "components")
+
+
+def seed_profile(backend, n: int) -> int:
+    """Профиль размера n: n навыков, n/5 проектов, резюме ~n*50 символов, n/2 реплик истории чата"""
+    db = backend.SessionLocal()
+    try:
+        user = backend.User(email=f"stages{n}@example.com", full_name=f"Stages {n}", department="IT", position="Dev",
+                            resume_text="Проекты и достижения. " * (n * 2))
+        db.add(user)
+        db.flush()
+        backend.upsert_skills(db, user, [backend.SkillIn(name=f"Навык {i}", level="Middle") for i in range(n)])
+        backend.upsert_projects(db, user, [backend.ProjectIn(title=f"Проект {i}", role="Dev", result_kpi="KPI" if i % 2 else None)
+                                           for i in range(max(1, n // 5))])
+        backend.record_microsteps(db, user.id, [date.today() - timedelta(days=i) for i in range(n)])
+        for i in range(n // 2):
+            db.add(backend.ChatMessage(user_id=user.id, role="user" if i % 2 == 0 else "assistant", content=f"Реплика {i} " * 20))
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def parse_server_timing(header: str) -> dict:
+    out = {}
+    for part in header.split(","):
+        fields = [f.strip() for f in part.split(";")]
+        dur = next((f[4:] for f in fields[1:] if f.startswith("dur=")), "0")
+        out[fields[0]] = float(dur)
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Разбивка времени консультанта по этапам")
+    parser.add_argument("--sizes", default="10,100,500", help="размеры профилей через запятую")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--llm-ms", type=float, default=0.0, help="имитация задержки Scibox, мс (0 — без LLM)")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="consultant-stages-"))
+    os.environ.setdefault("JOBS_ENABLED", "0")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    os.environ["SCIBOX_API_KEY"] = ""
+    sys.path.insert(0, os.path.abspath(COMPONENTS))
+    import backend
+    from fastapi.testclient import TestClient
+
+    if args.llm_ms > 0:                              # без сети: фиксированная задержка вместо Scibox
+        backend.llm_gateway.available = lambda: True
+        backend.llm_gateway.complete = lambda *a, **k: (time.sleep(args.llm_ms / 1000), "Ответ консультанта")[1]
+
+    client = TestClient(backend.app)
+    results = {}
+    for n in (int(x) for x in args.sizes.split(",")):
+        user_id = seed_profile(backend, n)
+        samples = []
+        for _ in range(args.repeat):
+            r = client.post("/ai/consultant/chat", json={"user_id": user_id, "message": "Что изучить дальше?"},
+                            headers={"X-Debug-Timing": "1"})
+            samples.append(parse_server_timing(r.headers["server-timing"]))
+        stages = {k: round(statistics.median(s[k] for s in samples), 2) for k in samples[0]}
+        stage_only = {k: v for k, v in stages.items() if k not in ("db", "total")}
+        results[n] = {"median_ms": stages, "dominant": max(stage_only, key=stage_only.get)}
+    print(json.dumps({"llm_ms": args.llm_ms, "repeat": args.repeat, "profiles": results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# dashboard_payload.py — размер и время ответа /users/{id}/dashboard для «тяжёлого» профиля
+# Запуск: python benchmarks/dashboard_payload.py --resume-kb 20 --achievements 200 --repeat 50
+# БД создаётся во временном каталоге (backend кладёт storage/app.db относительно текущего каталога)
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+COMPONENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "components")
+
+VARIANTS = {                                        # что сравниваем: полный кабинет и выборки полей
+    "full": {},
+    "sidebar": {"fields": "total_xp,recent_achievements", "limit": 5},
+    "achievements_page": {"fields": "total_xp,achievements"},
+}
+
+
+def seed_heavy_profile(backend, resume_kb: int, extra_achievements: int) -> int:
+    """Профиль «как у активного сотрудника»: длинное резюме, много навыков/проектов/эндорсментов и ачивок"""
+    db = backend.SessionLocal()
+    try:
+        user = backend.User(email="heavy@example.com", full_name="Heavy Profile", phone="+7 (900) 000-00-00",
+                            department="IT", position="Senior Developer", grade="Senior", experience_years=12,
+                            resume_text=("Опыт, проекты, достижения. " * 40 * resume_kb)[:resume_kb * 1024],
+                            profile_photo_url="https://example.com/p.png")
+        db.add(user)
+        db.flush()
+        backend.upsert_skills(db, user, [backend.SkillIn(name=f"Навык {i}", level="Middle") for i in range(60)])
+        backend.upsert_projects(db, user, [backend.ProjectIn(title=f"Проект {i}", role="Lead", description="Описание " * 30,
+                                                             result_kpi="KPI +15%") for i in range(30)])
+        backend.upsert_certificates(db, user, [backend.CertificateIn(name=f"Сертификат {i}", issued_by="Vendor") for i in range(20)])
+        backend.record_endorsements(db, "HR", [(user.id, f"Навык {i}") for i in range(40)])
+        backend.record_microsteps(db, user.id, [date.today() - timedelta(days=i) for i in range(400)])
+        start = datetime.utcnow() - timedelta(days=extra_achievements)
+        for i in range(extra_achievements):        # исторические уровни (например, из прошлых версий каталога)
+            db.add(backend.UserAchievement(user_id=user.id, code=f"legacy_{i}", level="бронза", xp=10,
+                                           obtained_at=start + timedelta(days=i)))
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def measure(client, user_id: int, params: dict, repeat: int) -> dict:
+    plain = client.get(f"/users/{user_id}/dashboard", params=params, headers={"Accept-Encoding": "identity"})
+    gz = client.get(f"/users/{user_id}/dashboard", params=params, headers={"Accept-Encoding": "gzip"})
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        client.get(f"/users/{user_id}/dashboard", params=params, headers={"Accept-Encoding": "gzip"})
+        timings.append((time.perf_counter() - t0) * 1000)
+    return {
+        "status": plain.status_code,
+        "bytes": len(plain.content),
+        "gzip_bytes": int(gz.headers.get("content-length", len(gz.content))),
+        "gzip": gz.headers.get("content-encoding") == "gzip",
+        "p50_ms": round(statistics.median(timings), 2),
+        "max_ms": round(max(timings), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Размер ответа кабинета: полный vs ?fields=")
+    parser.add_argument("--resume-kb", type=int, default=20, help="размер резюме, КБ")
+    parser.add_argument("--achievements", type=int, default=200, help="дополнительных исторических ачивок")
+    parser.add_argument("--repeat", type=int, default=30, help="запросов на вариант для замера времени")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dashboard-bench-")
+    os.chdir(workdir)
+    os.environ.setdefault("JOBS_ENABLED", "0")     # фоновый воркер и Scibox в замере не нужны
+    os.environ["SCIBOX_API_KEY"] = ""
+    sys.path.insert(0, os.path.abspath(COMPONENTS))
+    import backend
+    from fastapi.testclient import TestClient
+
+    user_id = seed_heavy_profile(backend, args.resume_kb, args.achievements)
+    client = TestClient(backend.app)
+    results = {name: measure(client, user_id, params, args.repeat) for name, params in VARIANTS.items()}
+    print(json.dumps({"workdir": workdir, "resume_kb": args.resume_kb, "extra_achievements": args.achievements,
+                      "results": results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# fake_scibox.py — локальный OpenAI-совместимый сервер вместо Scibox для бенчмарков и ручных проверок
+# Запуск: python benchmarks/fake_scibox.py --port 8765 --latency 0.5
+# Бэкенд направляем на него: SCIBOX_API_KEY=fake SCIBOX_BASE_URL=http://127.0.0.1:8765/v1
+import argparse
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict
+
+
+class FakeSciboxState:
+    """Настройки и счётчики фейкового сервера (общие для всех потоков-обработчиков)"""
+
+    def __init__(self, latency: float, per_token_latency: float):
+        self.latency = latency                      # базовая задержка ответа (сек)
+        self.per_token_latency = per_token_latency  # добавка за каждый токен ответа (сек)
+        self.lock = threading.Lock()
+        self.requests = 0                           # всего запросов chat.completions
+        self.in_flight = 0                          # обрабатываются прямо сейчас
+        self.max_in_flight = 0                      # пик параллельных запросов
+        self.prompts = []                           # последняя реплика каждого запроса в порядке поступления
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"requests": self.requests, "in_flight": self.in_flight, "max_in_flight": self.max_in_flight}
+
+
+def _make_handler(state: FakeSciboxState):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, code: int, payload: Dict[str, Any]) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+            elif self.path.rstrip("/") == "/stats":
+                self._send_json(200, state.snapshot())
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            req = json.loads(self.rfile.read(length) or b"{}")
+            with state.lock:
+                state.requests += 1
+                state.prompts.append((req.get("messages") or [{}])[-1].get("content"))
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                messages = req.get("messages", [])
+                prompt_chars = sum(len(m.get("content") or "") for m in messages)
+                completion_tokens = min(int(req.get("max_tokens") or 64), 64)
+                time.sleep(state.latency + state.per_token_latency * completion_tokens)
+                content = f"Фейковый ответ: {len(messages)} сообщ., {prompt_chars} символов промпта."
+                self._send_json(200, {
+                    "id": f"chatcmpl-fake-{state.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": req.get("model", "fake-model"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_chars // 4 + completion_tokens},
+                })
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def log_message(self, *args):  # не шумим в консоль на каждый запрос
+            pass
+
+    return Handler
+
+
+def start_fake_scibox(port: int = 0, latency: float = 0.2, per_token_latency: float = 0.0):
+    """Поднимает сервер в фоновом потоке. Возвращает (server, state); base URL — http://127.0.0.1:<port>/v1"""
+    state = FakeSciboxState(latency, per_token_latency)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Фейковый OpenAI-совместимый сервер вместо Scibox")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="базовая задержка ответа, сек")
+    parser.add_argument("--per-token-latency", type=float, default=0.0, help="задержка на токен ответа, сек")
+    args = parser.parse_args()
+    srv, _ = start_fake_scibox(args.port, args.latency, args.per_token_latency)
+    print(f"Fake Scibox: http://127.0.0.1:{srv.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
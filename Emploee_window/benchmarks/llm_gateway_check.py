@@ -0,0 +1,132 @@
+# llm_gateway_check.py — проверка LLM-шлюза против fake_scibox: приоритеты, склейка одинаковых запросов, таймаут очереди
+# Запуск: python benchmarks/llm_gateway_check.py --latency 0.3
+# Каждая проверка — отдельный LLMGateway с нужным лимитом параллелизма. Порядок, в котором запросы дошли до сервера,
+# берётся из журнала fake_scibox. Ненулевой код выхода — если хоть одна проверка не прошла
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COMPONENTS = os.path.abspath(os.path.join(HERE, "..", "components"))
+sys.path.insert(0, HERE)
+from fake_scibox import start_fake_scibox  # noqa: E402
+
+
+def ask(gateway, text: str, priority: int, out: dict) -> None:  # один вызов шлюза; результат или ошибка — в out[text]
+    try:
+        out[text] = gateway.complete("gateway_check", [{"role": "user", "content": text}], priority=priority)
+    except Exception as e:
+        out[text] = type(e).__name__
+
+
+def check_priority(backend, state, latency: float) -> dict:
+    """Слот один и занят; фоновые пришли раньше интерактивного, но интерактивный уходит к серверу первым"""
+    gateway = backend.LLMGateway(1, 30)
+    gateway.available()                             # клиент создаём заранее: его инициализация не должна влиять на порядок
+    out, threads = {}, []
+    start = len(state.prompts)
+    for text, priority in (("blocker", backend.PRIORITY_BACKGROUND), ("bg-1", backend.PRIORITY_BACKGROUND),
+                           ("bg-2", backend.PRIORITY_BACKGROUND), ("chat-1", backend.PRIORITY_INTERACTIVE)):
+        t = threading.Thread(target=ask, args=(gateway, text, priority, out))
+        t.start()
+        threads.append(t)
+        time.sleep(latency / 6)                     # фиксируем порядок прихода в очередь
+    for t in threads:
+        t.join()
+    order = state.prompts[start:]
+    return {"ok": order == ["blocker", "chat-1", "bg-1", "bg-2"], "upstream_order": order}
+
+
+def check_coalescing(backend, state, callers: int) -> dict:
+    """Одинаковые запросы, пришедшие одновременно, уходят к серверу одним вызовом"""
+    gateway = backend.LLMGateway(4, 30)
+    barrier = threading.Barrier(callers)
+    results = []
+
+    def call() -> None:
+        barrier.wait()
+        results.append(gateway.complete("gateway_check", [{"role": "user", "content": "same"}]))
+
+    start = state.requests
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    upstream, coalesced = state.requests - start, gateway.stats()["coalesced"]
+    return {"ok": upstream == 1 and coalesced == callers - 1 and len(set(results)) == 1 and len(results) == callers,
+            "callers": callers, "upstream_calls": upstream, "coalesced": coalesced}
+
+
+def check_queue_timeout(backend, latency: float) -> dict:
+    """Запрос, не дождавшийся слота за LLM_QUEUE_TIMEOUT, получает LLMQueueTimeout и уходит из очереди"""
+    gateway = backend.LLMGateway(1, latency / 3)
+    out = {}
+    blocker = threading.Thread(target=ask, args=(gateway, "blocker-t", backend.PRIORITY_BACKGROUND, out))
+    blocker.start()
+    time.sleep(latency / 6)
+    ask(gateway, "late", backend.PRIORITY_INTERACTIVE, out)
+    blocker.join()
+    stats = gateway.stats()
+    return {"ok": out["late"] == "LLMQueueTimeout" and stats["queue_timeouts"] == 1 and stats["queued"] == 0
+            and out["blocker-t"] != "LLMQueueTimeout", "late": out["late"], "queue_timeouts": stats["queue_timeouts"]}
+
+
+def check_not_configured(backend) -> dict:
+    """Без ключа шлюз один раз предупреждает и дальше отвечает «недоступен» без повторных попыток"""
+    warnings = []
+
+    class Collect(logging.Handler):
+        def emit(self, record: logging.LogRecord) -> None:
+            warnings.append(record.getMessage())
+
+    handler = Collect(level=logging.WARNING)
+    backend.logger.addHandler(handler)
+    key, backend.SCIBOX_API_KEY = backend.SCIBOX_API_KEY, ""
+    try:
+        gateway = backend.LLMGateway(1, 1)
+        threads = [threading.Thread(target=gateway.available) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        available = gateway.available()
+    finally:
+        backend.SCIBOX_API_KEY = key
+        backend.logger.removeHandler(handler)
+    return {"ok": not available and len(warnings) == 1, "warnings": len(warnings)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Проверка приоритетов, склейки и таймаута очереди LLM-шлюза")
+    parser.add_argument("--latency", type=float, default=0.3, help="задержка ответа fake_scibox, сек")
+    parser.add_argument("--callers", type=int, default=5, help="одновременных одинаковых запросов для проверки склейки")
+    args = parser.parse_args()
+
+    server, state = start_fake_scibox(0, args.latency)
+    os.chdir(tempfile.mkdtemp(prefix="llm-gateway-check-"))
+    os.environ.update({"JOBS_ENABLED": "0", "LOG_LEVEL": "WARNING", "SCIBOX_API_KEY": "fake",
+                       "SCIBOX_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}/v1"})
+    sys.path.insert(0, COMPONENTS)
+    import backend
+
+    try:
+        results = {"priority": check_priority(backend, state, args.latency),
+                   "coalescing": check_coalescing(backend, state, args.callers),
+                   "queue_timeout": check_queue_timeout(backend, args.latency),
+                   "not_configured": check_not_configured(backend)}
+    finally:
+        server.shutdown()
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    failed = [name for name, r in results.items() if not r["ok"]]
+    if failed:
+        raise SystemExit(f"Проверки LLM-шлюза не прошли: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+# load_test.py — нагрузочный прогон API: синтетические профили, фейковый Scibox, несколько уровней параллелизма
+# Запуск: python benchmarks/load_test.py --users 200 --concurrency 1,8,32 --requests 400 --llm-latency 0.3 --out run.json
+#         python benchmarks/load_test.py ... --compare prev.json   — сравнить с прошлым прогоном (например, другого коммита)
+# Бэкенд поднимается отдельным процессом uvicorn на базе во временном каталоге (DB_PATH), Scibox подменяется fake_scibox.
+# Результат — JSON: пропускная способность и перцентили латентности по эндпоинтам и уровням параллелизма
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COMPONENTS = os.path.abspath(os.path.join(HERE, "..", "components"))
+sys.path.insert(0, HERE)
+from fake_scibox import start_fake_scibox  # noqa: E402
+
+SCENARIOS = ("get_user", "put_user", "dashboard", "microstep", "chat")
+
+
+def seed(db_path: str, args) -> list:
+    """Синтетические профили заданного размера. Ачивки выдаёт настоящий движок + исторические уровни сверху"""
+    os.environ.update({"DB_PATH": db_path, "JOBS_ENABLED": "0", "SCIBOX_API_KEY": "", "LOG_LEVEL": "WARNING"})
+    sys.path.insert(0, COMPONENTS)
+    import backend
+
+    rng = random.Random(args.seed)
+    skill_pool = [f"Навык {i}" for i in range(max(args.skills * 3, 10))]
+    teams = [f"Команда {i}" for i in range(10)]
+    ids = []
+    db = backend.SessionLocal()
+    try:
+        for n in range(args.users):
+            user = backend.User(email=f"load{n}@example.com", full_name=f"Load User {n}", department=rng.choice(["IT", "HR", "Sales"]),
+                                position="Developer", grade=rng.choice(["Junior", "Middle", "Senior"]), phone="+7 (900) 000-00-00",
+                                experience_years=rng.randint(0, 15), resume_text="Опыт и проекты. " * args.resume_words,
+                                profile_photo_url="https://example.com/p.png")
+            db.add(user)
+            db.flush()
+            skills = rng.sample(skill_pool, args.skills)
+            backend.upsert_skills(db, user, [backend.SkillIn(name=s, level="Middle") for s in skills])
+            backend.upsert_projects(db, user, [backend.ProjectIn(title=f"Проект {i}", role="Dev", result_kpi="KPI +10%")
+                                               for i in range(args.projects)])
+            backend.record_endorsements(db, rng.choice(teams), [(user.id, rng.choice(skills or skill_pool)) for _ in range(args.endorsements)])
+            backend.record_microsteps(db, user.id, [date.today() - timedelta(days=rng.randint(0, 3 * 365)) for _ in range(args.microsteps)])
+            backend.calculate_and_issue_achievements(db, user)
+            start = datetime.utcnow() - timedelta(days=args.achievements)
+            db.add_all(backend.UserAchievement(user_id=user.id, code=f"legacy_{i}", level="бронза", xp=10,
+                                               obtained_at=start + timedelta(days=i)) for i in range(args.achievements))
+            ids.append(user.id)
+            if n % 50 == 49:
+                db.commit()
+        db.commit()
+    finally:
+        db.close()
+        backend.engine.dispose()                    # файл базы отдаём процессу сервера
+    return ids
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir: str, db_path: str, llm_url: str, jobs: bool) -> (subprocess.Popen, str):
+    port = free_port()
+    env = {**os.environ, "DB_PATH": db_path, "SCIBOX_API_KEY": "fake", "SCIBOX_BASE_URL": llm_url,
+           "JOBS_ENABLED": "1" if jobs else "0", "LOG_LEVEL": "WARNING", "PYTHONPATH": COMPONENTS}
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "backend:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--log-level", "warning", "--no-access-log"], cwd=workdir, env=env)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base}/health", timeout=1).status_code == 200:
+                return proc, base
+        except requests.RequestException:
+            pass
+        if proc.poll() is not None:
+            raise SystemExit(f"Сервер завершился с кодом {proc.returncode}")
+        time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("Сервер не поднялся за 60 с")
+
+
+def make_request(scenario: str, session: requests.Session, base: str, user_id: int, rng: random.Random) -> requests.Response:
+    if scenario == "get_user":
+        return session.get(f"{base}/users/{user_id}")
+    if scenario == "put_user":
+        return session.put(f"{base}/users/{user_id}", json={"position": f"Developer {rng.randint(1, 9)}",
+                                                             "resume_text": "Обновлённое резюме. " * rng.randint(10, 50)})
+    if scenario == "dashboard":
+        return session.get(f"{base}/users/{user_id}/dashboard")
+    if scenario == "microstep":
+        return session.post(f"{base}/users/{user_id}/microstep",
+                            json={"done_on": (date.today() - timedelta(days=rng.randint(0, 3 * 365))).isoformat()})
+    if scenario == "chat":
+        return session.post(f"{base}/ai/consultant/chat", json={"user_id": user_id, "message": "Что изучить дальше?"})
+    raise ValueError(scenario)
+
+
+def percentile(sorted_values: list, q: float) -> float:  # nearest-rank, как в backend._percentile
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))]
+
+
+def run_level(scenario: str, base: str, user_ids: list, concurrency: int, total: int, seed_: int) -> dict:
+    latencies, statuses, lock = [], {}, threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(idx: int, count: int) -> None:
+        rng = random.Random(seed_ * 1000 + idx)
+        session = requests.Session()
+        local, local_status = [], {}
+        barrier.wait()
+        for _ in range(count):
+            t0 = time.perf_counter()
+            try:
+                code = make_request(scenario, session, base, rng.choice(user_ids), rng).status_code
+            except requests.RequestException as e:
+                code = type(e).__name__
+            local.append((time.perf_counter() - t0) * 1000)
+            local_status[str(code)] = local_status.get(str(code), 0) + 1
+        with lock:
+            latencies.extend(local)
+            for k, v in local_status.items():
+                statuses[k] = statuses.get(k, 0) + v
+
+    shares = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(shares)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    errors = sum(v for k, v in statuses.items() if not (k.isdigit() and int(k) < 400))
+    return {"requests": len(latencies), "errors": errors, "status": statuses, "seconds": round(elapsed, 3),
+            "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "mean_ms": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 2), "p90_ms": round(percentile(latencies, 90), 2),
+            "p99_ms": round(percentile(latencies, 99), 2), "max_ms": round(latencies[-1], 2) if latencies else 0.0}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> dict:
+    """Изменения rps и p99 относительно прошлого прогона; регрессия — хуже порога (в процентах)"""
+    out, regressions = {}, []
+    for scenario, levels in current["results"].items():
+        for level, cur in levels.items():
+            old = baseline.get("results", {}).get(scenario, {}).get(level)
+            if not old:
+                continue
+            rps = round((cur["rps"] - old["rps"]) / old["rps"] * 100, 1) if old["rps"] else 0.0
+            p99 = round((cur["p99_ms"] - old["p99_ms"]) / old["p99_ms"] * 100, 1) if old["p99_ms"] else 0.0
+            out.setdefault(scenario, {})[level] = {"rps_change_pct": rps, "p99_change_pct": p99}
+            if rps < -threshold or p99 > threshold:
+                regressions.append(f"{scenario}@{level}: rps {rps:+.1f}%, p99 {p99:+.1f}%")
+    return {"baseline_commit": baseline.get("meta", {}).get("commit"), "changes": out, "regressions": regressions}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон API бэкенда")
+    parser.add_argument("--users", type=int, default=200, help="синтетических пользователей")
+    parser.add_argument("--skills", type=int, default=20, help="навыков на пользователя")
+    parser.add_argument("--projects", type=int, default=5, help="проектов на пользователя")
+    parser.add_argument("--endorsements", type=int, default=20, help="эндорсментов на пользователя")
+    parser.add_argument("--microsteps", type=int, default=100, help="дней с микрошагами на пользователя")
+    parser.add_argument("--achievements", type=int, default=20, help="исторических уровней ачивок сверх выданных движком")
+    parser.add_argument("--resume-words", type=int, default=300, help="размер резюме (повторов фразы)")
+    parser.add_argument("--concurrency", default="1,8,32", help="уровни параллелизма через запятую")
+    parser.add_argument("--requests", type=int, default=400, help="запросов на уровень")
+    parser.add_argument("--chat-requests", type=int, default=100, help="запросов на уровень для чата (он упирается в LLM)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"сценарии: {', '.join(SCENARIOS)}")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="задержка фейкового Scibox, сек")
+    parser.add_argument("--jobs", action="store_true", help="запускать фоновый воркер в сервере (пересчёты после PUT)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=None, help="каталог для базы (по умолчанию временный)")
+    parser.add_argument("--out", default=None, help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--compare", default=None, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=10.0, help="порог регрессии, %%")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="load-test-")
+    db_path = os.path.join(workdir, "app.db")
+    t0 = time.perf_counter()
+    user_ids = seed(db_path, args)
+    seed_seconds = time.perf_counter() - t0
+
+    llm_server, llm_state = start_fake_scibox(0, args.llm_latency)
+    proc, base = start_server(workdir, db_path, f"http://127.0.0.1:{llm_server.server_address[1]}/v1", args.jobs)
+    results = {}
+    try:
+        for scenario in args.scenarios.split(","):
+            total = args.chat_requests if scenario == "chat" else args.requests
+            run_level(scenario, base, user_ids, 1, min(10, total), args.seed)  # прогрев соединений и кешей
+            for c in (int(x) for x in args.concurrency.split(",")):
+                results.setdefault(scenario, {})[str(c)] = run_level(scenario, base, user_ids, c, total, args.seed)
+                print(f"{scenario} c={c}: {results[scenario][str(c)]['rps']} rps, p99 {results[scenario][str(c)]['p99_ms']} ms",
+                      file=sys.stderr)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        llm_server.shutdown()
+
+    report = {"meta": {"commit": git_commit(), "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+                       "python": platform.python_version(), "cpu_count": os.cpu_count(), "workdir": workdir,
+                       "seed_seconds": round(seed_seconds, 1),
+                       "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "workdir")}},
+              "results": results, "fake_scibox": llm_state.snapshot()}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f), args.threshold)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
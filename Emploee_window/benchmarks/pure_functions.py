@@ -0,0 +1,160 @@
+# pure_functions.py — микробенчмарки «горячих» функций backend.py и achievements.py с golden-проверкой
+# Запуск: python benchmarks/pure_functions.py --sizes 10,100,1000,10000
+#         python benchmarks/pure_functions.py --update-golden   — перезаписать эталон (только если поведение меняется намеренно)
+# Перед замером результаты на фиксированных входах сравниваются с golden/pure_functions.json:
+# оптимизированная версия обязана давать тот же результат, что и исходная. Функция без эталона — тоже ошибка.
+# Функции achievements.py (фронт) импортируются вместе с gradio (он в requirements.txt).
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import timeit
+from datetime import date, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(HERE, ".."))
+COMPONENTS = os.path.join(ROOT, "components")
+GOLDEN = os.path.join(HERE, "golden", "pure_functions.json")
+ANCHOR = date(2024, 6, 5)                                            # «сегодня» для эталона: недели ISO не зависят от дня запуска
+
+
+def steps_input(rng: random.Random, n: int, span_days: int) -> list:   # даты микрошагов относительно ANCHOR
+    return [ANCHOR - timedelta(days=rng.randint(0, span_days)) for _ in range(n)]
+
+
+def catalog_input(n_codes: int) -> dict:                             # каталог в формате /achievements/catalog
+    return {f"code_{i}": {"title": f"Ачивка {i}", "level_labels": [[f"уровень {j}", 10 * (j + 1)] for j in range(4)]}
+            for i in range(n_codes)}
+
+
+def seed_user(backend, db, rng: random.Random, n: int):
+    """Пользователь размера n: навыки, сигналы, эндорсменты, проекты, сертификаты, микрошаги"""
+    user = backend.User(email=f"pf{n}-{rng.random()}@example.com", full_name="Pure Functions",
+                        position=rng.choice([None, "Dev"]), department=rng.choice([None, "IT"]), grade=rng.choice([None, "M"]),
+                        profile_photo_url=rng.choice(["", "p.png"]), resume_text=rng.choice(["", "резюме"]))
+    db.add(user)
+    db.flush()
+    backend.upsert_skills(db, user, [backend.SkillIn(name=f"Навык {i}") for i in range(n)] +
+                          [backend.SkillIn(name=m) for m in rng.sample(["lang:EN=B2", "lang:DE=C1", "availability:2024-01",
+                                                                          "mentor_sessions:3", "compliance:step1"], 3)])
+    backend.record_endorsements(db, "team", [(user.id, rng.choice(["Python", "soft:talk", "SQL"])) for _ in range(n // 2)])
+    backend.upsert_projects(db, user, [backend.ProjectIn(title=f"P{i}", result_kpi=rng.choice(["", "KPI"])) for i in range(n // 5)])
+    backend.upsert_certificates(db, user, [backend.CertificateIn(name=f"C{i}") for i in range(n // 10)])
+    backend.record_microsteps(db, user.id, steps_input(rng, n, 400))
+    db.flush()
+    return user
+
+
+def golden_cases(backend, front) -> dict:
+    """Результаты на фиксированных (seeded) входах — то, что сверяется с эталоном"""
+    rng = random.Random(20240601)
+    out = {
+        "compute_weekly_streak": [backend.compute_weekly_streak(steps_input(rng, n, span), ANCHOR)
+                                  for n in (0, 1, 2, 5, 30, 200, 1000) for span in (0, 6, 13, 60, 800)],
+        "_score_course": [backend._score_course(frozenset(rng.sample(range(100), k)), tuple(sorted(rng.sample(range(100), m))))
+                          for k in (0, 5, 50) for m in (0, 3, 20)],
+        "mandatory_profile_fields_filled": [
+            backend.mandatory_profile_fields_filled(backend.User(email=rng.choice(["", "a@b.io"]), full_name=rng.choice(["", " ", "A"]),
+                                                                 position=rng.choice([None, "", "Dev"]), department=rng.choice([None, "IT"]),
+                                                                 grade=rng.choice([None, " ", "M"])))
+            for _ in range(40)],
+    }
+    db = backend.SessionLocal()
+    try:
+        achievements = []
+        for n in (0, 5, 30, 120):
+            for _ in range(3):
+                user = seed_user(backend, db, rng, n)
+                total = backend.calculate_and_issue_achievements(db, user)
+                issued = sorted([a.code, a.level, a.xp] for a in db.query(backend.UserAchievement).filter_by(user_id=user.id))
+                achievements.append({"total_xp": total, "issued": issued})
+        out["calculate_and_issue_achievements"] = achievements
+    finally:
+        db.rollback()
+        db.close()
+    catalog = catalog_input(12)
+    levels = front._iter_catalog_levels(catalog)
+    achieved = [{"code": c, "level": lvl} for c, _, lvl, _ in rng.sample(levels, 20)] + [{"code": "unknown", "level": "x"}]
+    out["_level_stats"] = [front._level_stats(xp) for xp in (0, 1, 999, 1000, 1001, 5500, 123456)]
+    out["_iter_catalog_levels"] = [list(r) for r in levels]
+    done, locked = front._split_done_vs_locked(levels, achieved)
+    out["_split_done_vs_locked"] = {"done": [list(r) for r in done], "locked": [list(r) for r in locked]}
+    return json.loads(json.dumps(out, ensure_ascii=False))         # кортежи -> списки, как в файле эталона
+
+
+def per_call_us(fn, repeat: int = 5) -> float:                    # лучшее время одного вызова, мкс
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return round(min(timer.repeat(repeat=repeat, number=number)) / number * 1e6, 2)
+
+
+def bench(backend, front, sizes: list) -> dict:
+    rng = random.Random(1)
+    results = {}
+
+    def put(name: str, n: int, fn) -> None:
+        results.setdefault(name, {})[str(n)] = per_call_us(fn)
+
+    for n in sizes:
+        steps = steps_input(rng, n, max(7, n))                    # ~ по шагу в день: n дней истории
+        put("compute_weekly_streak", n, lambda: backend.compute_weekly_streak(steps, ANCHOR))
+        profile_ids = frozenset(rng.sample(range(n * 4), n))
+        course_ids = tuple(sorted(rng.sample(range(n * 4), n)))
+        put("_score_course", n, lambda: backend._score_course(profile_ids, course_ids))
+        users = [backend.User(email="a@b.io", full_name="A", position="Dev", department=None, grade="M") for _ in range(n)]
+        put("mandatory_profile_fields_filled", n, lambda: [backend.mandatory_profile_fields_filled(u) for u in users])
+        catalog = catalog_input(n)
+        levels = front._iter_catalog_levels(catalog)
+        achieved = [{"code": c, "level": lvl} for c, _, lvl, _ in levels[::2]]
+        xps = [rng.randint(0, 100000) for _ in range(n)]
+        put("_level_stats", n, lambda: [front._level_stats(x) for x in xps])
+        put("_iter_catalog_levels", n, lambda: front._iter_catalog_levels(catalog))
+        put("_split_done_vs_locked", n, lambda: front._split_done_vs_locked(levels, achieved))
+    db = backend.SessionLocal()
+    try:
+        for n in sizes[:3]:                                       # с БД: типичный повторный вызов (новых уровней уже нет)
+            user = seed_user(backend, db, rng, n)
+            backend.calculate_and_issue_achievements(db, user)
+            put("calculate_and_issue_achievements", n, lambda: backend.calculate_and_issue_achievements(db, user))
+    finally:
+        db.rollback()
+        db.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Микробенчмарки чистых функций с golden-проверкой")
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="размеры входа через запятую")
+    parser.add_argument("--update-golden", action="store_true", help="перезаписать эталон текущими результатами")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="pure-functions-"))
+    os.environ.update({"JOBS_ENABLED": "0", "SCIBOX_API_KEY": "", "LOG_LEVEL": "WARNING"})
+    sys.path[:0] = [COMPONENTS, ROOT]
+    import backend
+    from components import achievements as front
+
+    current = golden_cases(backend, front)
+    if args.update_golden:
+        os.makedirs(os.path.dirname(GOLDEN), exist_ok=True)
+        with open(GOLDEN, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=1)
+            f.write("\n")
+    with open(GOLDEN, encoding="utf-8") as f:
+        golden = json.load(f)
+    missing = sorted(current.keys() ^ golden.keys())             # функция без эталона (или эталон без функции) не проверена
+    if missing:
+        raise SystemExit(f"Нет эталона для: {', '.join(missing)} (перезапишите его через --update-golden)")
+    mismatched = [name for name, value in current.items() if golden[name] != value]
+    if mismatched:
+        raise SystemExit(f"Результат отличается от эталона: {', '.join(mismatched)}")
+
+    sizes = [int(x) for x in args.sizes.split(",")]
+    print(json.dumps({"golden": {name: "ok" for name in current}, "us_per_call": bench(backend, front, sizes)},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# serialization.py — микробенчмарк сериализации ответа кабинета для профиля с большим числом ачивок
+# Запуск: python benchmarks/serialization.py --achievements 500 --repeat 200
+# Сравнивает: модели pydantic (обычный режим), старый путь FastAPI (jsonable_encoder + json),
+# проекцию в словари + orjson / TypeAdapter (режим FAST_JSON). Проверяет, что JSON во всех режимах совпадает.
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+COMPONENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "components")
+
+
+def seed(backend, n_achievements: int) -> int:
+    db = backend.SessionLocal()
+    try:
+        user = backend.User(email="ser@example.com", full_name="Serialization Bench", department="IT", position="Dev",
+                            grade="M", phone="+7", resume_text="Резюме " * 500, profile_photo_url="p.png")
+        db.add(user)
+        db.flush()
+        backend.upsert_skills(db, user, [backend.SkillIn(name=f"Навык {i}", level="Middle") for i in range(40)])
+        start = datetime.utcnow() - timedelta(days=n_achievements)
+        codes = list(backend.ACHIEVEMENTS_CATALOG)
+        for i in range(n_achievements):
+            db.add(backend.UserAchievement(user_id=user.id, code=codes[i % len(codes)], level=f"уровень {i}",
+                                           xp=10 + i % 50, obtained_at=start + timedelta(days=i)))
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def bench(fn, repeat: int) -> dict:
+    fn()                                            # прогрев
+    t = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        t.append((time.perf_counter() - t0) * 1e6)
+    return {"p50_us": round(statistics.median(t), 1), "mean_us": round(statistics.fmean(t), 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сериализация кабинета: модели vs проекции")
+    parser.add_argument("--achievements", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="serialization-bench-"))
+    os.environ.setdefault("JOBS_ENABLED", "0")
+    os.environ["SCIBOX_API_KEY"] = ""
+    sys.path.insert(0, os.path.abspath(COMPONENTS))
+    import backend
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.testclient import TestClient
+
+    user_id = seed(backend, args.achievements)
+    db = backend.SessionLocal()
+    user = db.get(backend.User, user_id)
+    achievements = list(user.achievements)          # коллекции загружаем заранее: меряем только сериализацию
+    _ = list(user.skills)
+
+    def models_pydantic() -> bytes:                 # обычный режим: модели + model_dump_json
+        resp = backend.DashboardResponse(user=user, total_xp=0,
+                                         achievements=[backend.AchievementPublic(**backend.achievement_dict(a)) for a in achievements])
+        return resp.model_dump_json(exclude_unset=True).encode()
+
+    def models_fastapi_legacy() -> bytes:           # как сериализовали FastAPI < 0.130: модель -> jsonable_encoder -> json.dumps
+        resp = backend.DashboardResponse(user=user, total_xp=0,
+                                         achievements=[backend.AchievementPublic(**backend.achievement_dict(a)) for a in achievements])
+        return json.dumps(jsonable_encoder(resp, exclude_unset=True), ensure_ascii=False).encode()
+
+    def projection_fast() -> bytes:                 # FAST_JSON: словари + orjson (или TypeAdapter)
+        return backend.json_bytes({"user": backend.user_public_dict(user), "total_xp": 0,
+                                   "achievements": [backend.achievement_dict(a) for a in achievements]})
+
+    def projection_typeadapter() -> bytes:          # FAST_JSON без orjson
+        return backend._any_json.dump_json({"user": backend.user_public_dict(user), "total_xp": 0,
+                                            "achievements": [backend.achievement_dict(a) for a in achievements]})
+
+    variants = {"models_pydantic": models_pydantic, "models_fastapi_legacy": models_fastapi_legacy,
+                "projection_fast": projection_fast, "projection_typeadapter": projection_typeadapter}
+    reference = json.loads(models_pydantic())
+    for name, fn in variants.items():               # golden-проверка: одинаковый JSON во всех вариантах
+        assert json.loads(fn()) == reference, f"{name}: JSON отличается от модели"
+
+    client = TestClient(backend.app)                # то же, но через HTTP-эндпоинты в обоих режимах
+    endpoints = {"user": f"/users/{user_id}", "dashboard": f"/users/{user_id}/dashboard?fields=user,total_xp,achievements",
+                 "catalog": "/achievements/catalog"}
+    http = {}
+    for mode in (False, True):
+        backend.FAST_JSON = mode
+        for key, url in endpoints.items():
+            body = client.get(url).json()
+            http.setdefault(key, {})["same_json"] = http.get(key, {}).get("body", body) == body
+            http[key]["body"] = body
+            http[key]["fast" if mode else "models"] = bench(lambda: client.get(url), max(20, args.repeat // 5))
+    for v in http.values():
+        v.pop("body")
+    db.close()
+
+    print(json.dumps({"achievements": args.achievements, "orjson": backend.orjson is not None,
+                      "serialize_only": {name: bench(fn, args.repeat) for name, fn in variants.items()},
+                      "http": http}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
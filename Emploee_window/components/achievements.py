@@ -1,8 +1,13 @@
 
+import os
+import time
 import gradio as gr
 from datetime import datetime
 from typing import Dict, Any, List, Tuple, Optional, Set
-from components.api_client import get_dashboard_data, add_microstep, get_achievements_catalog
+from components.api_client import get_dashboard_data, add_microstep, get_achievements_catalog, stream_user_events
+
+SIDEBAR_STREAM_TTL = float(os.getenv("SIDEBAR_STREAM_TTL", "600"))  # сек: столько живёт поток сайдбара, дальше его перезапускает таймер вкладки
+SIDEBAR_STREAMS = int(os.getenv("SIDEBAR_STREAMS", "64"))           # одновременных потоков сайдбара (вкладок) на процесс Gradio
 
 
 # ====================== Утилиты уровней/XP ======================
@@ -26,22 +31,6 @@ def _level_stats(total_xp: int) -> Dict[str, int]:
     }
 
 
-def _parse_dt(s: Any) -> Any:
-    try:
-        if isinstance(s, str):
-            # ISO8601
-            return datetime.fromisoformat(s.replace("Z", "+00:00"))
-    except Exception:
-        pass
-    return s
-
-
-def _latest(achievements: List[Dict[str, Any]], n: int = 5) -> List[Dict[str, Any]]:
-    arr = achievements or []
-    arr = sorted(arr, key=lambda a: _parse_dt(a.get("obtained_at")), reverse=True)
-    return arr[:n]
-
-
 def _format_recent_md(recent: List[Dict[str, Any]]) -> str:
     if not recent:
         return "*Пока нет достижений*"
@@ -63,9 +52,9 @@ def _format_recent_md(recent: List[Dict[str, Any]]) -> str:
 
 # ====================== Компонент справа (сайдбар) ======================
 def achievements_component(user_id: int):
-    data = get_dashboard_data(user_id) or {}
+    data = get_dashboard_data(user_id, fields="total_xp,recent_achievements", limit=5) or {}
     total_xp = int(data.get("total_xp", 0) or 0)
-    ach = data.get("achievements", []) or []
+    ach = data.get("recent_achievements", []) or []  # уже отсортированы сервером по obtained_at
 
     stats = _level_stats(total_xp)
 
@@ -89,59 +78,63 @@ def achievements_component(user_id: int):
 
         # Последние достижения
         gr.Markdown("### Последние достижения")
-        recent_md = gr.Markdown(_format_recent_md(_latest(ach, 5)))
+        recent_md = gr.Markdown(_format_recent_md(ach))
+
+        outputs = [xp_md, level_md, xp_next_md, prog_html, recent_md]
 
-        def _refresh():
-            d = get_dashboard_data(user_id) or {}
-            total = int(d.get("total_xp", 0) or 0)
+        def _render(total: int, recent: List[Dict[str, Any]]):
             st = _level_stats(total)
-            a = d.get("achievements", []) or []
             return (
                 f"**XP:** {total}",
                 f"**Уровень:** {st['level']}",
                 f"**До след. уровня:** {st['xp_to_next']} XP",
                 f'<div class="t1-progress-container"><div class="t1-progress-bar" style="width: {st["percent_to_next"]}%"></div></div>',
-                _format_recent_md(_latest(a, 5)),
+                _format_recent_md(recent),
             )
 
+        def _stream():
+            # Подписка на события бэкенда: snapshot при подключении, дальше — только дельты (новая ачивка, новый XP).
+            # Поток конечен: через SIDEBAR_STREAM_TTL он завершается, а открытая вкладка запускает новый по таймеру —
+            # закрытая вкладка больше не держит ни слот очереди Gradio, ни SSE-соединение с бэкендом
+            total, recent = total_xp, ach
+            deadline = time.monotonic() + SIDEBAR_STREAM_TTL
+            while time.monotonic() < deadline:
+                for ev in stream_user_events(user_id, deadline):
+                    kind = ev.get("type")
+                    if kind == "snapshot":
+                        total, recent = int(ev.get("total_xp", 0) or 0), ev.get("recent", []) or []
+                    elif kind == "xp":
+                        total = int(ev.get("total_xp", total) or 0)
+                    elif kind == "achievement":
+                        recent = [ev] + recent[:4]
+                    else:
+                        continue
+                    yield _render(total, recent)
+                if time.monotonic() < deadline:
+                    time.sleep(3)  # поток оборвался — переподключаемся
+
         def _do_daily():
-            add_microstep(user_id)
-            return _refresh()
+            add_microstep(user_id)  # новый XP придёт событием в _stream
 
         daily_btn.click(
             fn=_do_daily,
             inputs=[],
-            outputs=[xp_md, level_md, xp_next_md, prog_html, recent_md],
+            outputs=[],
             show_progress=True
         )
 
+    return _stream, outputs
+
 
 # ====================== Полная страница достижений (центр) ======================
 def _iter_catalog_levels(catalog: Dict[str, Dict[str, Any]]) -> List[Tuple[str, str, str, int]]:
-    """Разворачивает каталог в список кортежей: (code, title, level_label, xp)"""
+    """Разворачивает каталог в список кортежей: (code, title, level_label, xp).
+    Метки уровней приходят готовыми из бэкенда (level_labels), правила меток здесь не дублируются"""
     rows: List[Tuple[str, str, str, int]] = []
     for code, meta in (catalog or {}).items():
         title = meta.get("title", code)
-        if "levels" in meta:
-            for lvl in meta["levels"]:
-                # варианты: ("бронза", 30, 0.40) или ("B2", 80)
-                if isinstance(lvl, (list, tuple)) and len(lvl) >= 2:
-                    level_label = str(lvl[0])
-                    xp = int(lvl[1])
-                    rows.append((code, title, level_label, xp))
-        if "thresholds" in meta:
-            for t, xp in meta["thresholds"]:
-                t = int(t)
-                if code == "availability":
-                    level_label = f"{t}m+"
-                elif code == "compliance":
-                    level_label = f"step{t}"
-                else:
-                    level_label = f"{t}+"
-                rows.append((code, title, level_label, int(xp)))
-        if "absolute" in meta:
-            abs_level, abs_xp = meta["absolute"]
-            rows.append((code, title, str(abs_level), int(abs_xp)))
+        for level_label, xp in meta.get("level_labels", []):
+            rows.append((code, title, str(level_label), int(xp)))
     return rows
 
 
@@ -153,7 +146,7 @@ def _split_done_vs_locked(all_levels: List[Tuple[str, str, str, int]], achieved:
 
 
 def achievements_page(user_id: int):
-    data = get_dashboard_data(user_id) or {}
+    data = get_dashboard_data(user_id, fields="total_xp,achievements") or {}
     total_xp = int(data.get("total_xp", 0) or 0)
     ach = data.get("achievements", []) or []
     catalog = get_achievements_catalog() or {}
@@ -1,8 +1,32 @@
 import gradio as gr
-from components.api_client import ai_chat
+from components.api_client import ai_chat, get_chat_history
+
+WELCOME_MESSAGE = {"role": "assistant", "content": "👋 Здравствуйте! Я ваш ИИ-помощник по карьере. Задайте мне вопрос"}
+HISTORY_PAGE_SIZE = 20
+
+
+def _page_to_messages(page):
+    return [{"role": m["role"], "content": m["content"]} for m in (page or {}).get("messages", [])]
 
 
 def ai_consultant_component(user_id: int):
+    # Восстанавливаем последнюю страницу истории при каждой загрузке страницы
+    def initial_messages():
+        return [WELCOME_MESSAGE] + _page_to_messages(get_chat_history(user_id, limit=HISTORY_PAGE_SIZE))
+
+    # Подгружаем более старую страницу истории (курсор хранится в cursor_state)
+    def load_earlier(messages, cursor):
+        if cursor is None:  # история уже загружена полностью
+            return messages, cursor
+        if cursor == 0:  # курсор ещё не известен — берём его из последней страницы
+            cursor = (get_chat_history(user_id, limit=HISTORY_PAGE_SIZE) or {}).get("next_before_id")
+            if cursor is None:
+                return messages, None
+        page = get_chat_history(user_id, before_id=cursor, limit=HISTORY_PAGE_SIZE) or {}
+        older = _page_to_messages(page)
+        rest = [m for m in (messages or []) if m.get("content") != WELCOME_MESSAGE["content"]]
+        return [WELCOME_MESSAGE] + older + rest, page.get("next_before_id")
+
     # Функция для обработки сообщений
     
     def respond(message, messages):
@@ -34,12 +58,10 @@ def ai_consultant_component(user_id: int):
         with gr.Column(elem_classes="t1-chat-container") as chat_container:
             chat_container.elem_id = "chat-container"
 
-            # Начинаем с приветственного сообщения
+            # Начинаем с приветственного сообщения и сохранённой истории
             chatbot = gr.Chatbot(type='messages', 
                 label="",
-                value=[
-                    {"role": "assistant", "content": "👋 Здравствуйте! Я ваш ИИ-помощник по карьере. Задайте мне вопрос"}
-                ],
+                value=initial_messages,
                 height=250,
                 show_label=False,
                 elem_classes="t1-chat-messages"
@@ -55,6 +77,10 @@ def ai_consultant_component(user_id: int):
                 )
                 send_btn = gr.Button("➤", elem_classes="t1-button", size="sm")
 
+            earlier_btn = gr.Button("⬆ Показать ранее", elem_classes="t1-button-secondary", size="sm")
+            cursor_state = gr.State(0)
+
         # Обработчики событий
         msg.submit(respond, [msg, chatbot], [msg, chatbot])
-        send_btn.click(respond, [msg, chatbot], [msg, chatbot])
\ No newline at end of file
+        send_btn.click(respond, [msg, chatbot], [msg, chatbot])
+        earlier_btn.click(load_earlier, [chatbot, cursor_state], [chatbot, cursor_state])
\ No newline at end of file
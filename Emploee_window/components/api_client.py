@@ -1,6 +1,10 @@
 # api_client.py
+import json
+import os
+import tempfile
+import time
 import requests
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, Tuple
 
 BASE_URL = "http://127.0.0.1:8000"
 PROXIES = {"http": None, "https": None}
@@ -38,9 +42,29 @@ def update_user_data(user_id: int, user_data: dict) -> bool:
         return False
 
 
-def get_dashboard_data(user_id: int) -> Optional[Dict[str, Any]]:
+def patch_user_data(user_id: int, changes: dict, version: Optional[int] = None) -> Tuple[int, Optional[Dict[str, Any]]]:
+    """PATCH только изменённых полей. С version запрос уходит с If-Match (ETag профиля — его версия).
+    Возвращает (код, тело): 200 — сохранённый профиль, 412 — {"current": актуальный профиль}; (0, None) — нет связи"""
+    headers = {"If-Match": f'"v{version}"'} if version is not None else {}
     try:
-        response = requests.get(f"{BASE_URL}/users/{user_id}/dashboard", timeout=5, proxies=PROXIES)
+        response = requests.patch(f"{BASE_URL}/users/{user_id}", json=changes, headers=headers, timeout=5, proxies=PROXIES)
+        if response.status_code in (200, 412):
+            return response.status_code, response.json()
+        print(f"Ошибка API (patch): {response.status_code} - {response.text}")
+        return response.status_code, None
+    except requests.exceptions.RequestException as e:
+        print(f"Ошибка соединения: {e}")
+        return 0, None
+
+
+def get_dashboard_data(user_id: int, fields: Optional[str] = None, limit: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    try:
+        params: Dict[str, Any] = {}
+        if fields:
+            params["fields"] = fields  # только нужные поля, например "total_xp,recent_achievements"
+        if limit:
+            params["limit"] = limit
+        response = requests.get(f"{BASE_URL}/users/{user_id}/dashboard", params=params, timeout=5, proxies=PROXIES)
         if response.status_code == 200:
             return response.json()
         print(f"Ошибка API: {response.status_code} - {response.text}")
@@ -74,6 +98,20 @@ def ai_chat(user_id: int, message: str) -> Dict[str, Any]:
         }
 
 
+def get_chat_history(user_id: int, before_id: Optional[int] = None, limit: int = 20) -> Optional[Dict[str, Any]]:
+    try:
+        params = {"limit": limit}
+        if before_id is not None:
+            params["before_id"] = before_id
+        response = requests.get(f"{BASE_URL}/users/{user_id}/chat/history", params=params, timeout=5, proxies=PROXIES)
+        if response.status_code == 200:
+            return response.json()
+        print(f"Ошибка API (history): {response.status_code} - {response.text}")
+    except requests.exceptions.RequestException as e:
+        print(f"Ошибка соединения (history): {e}")
+    return None
+
+
 def add_microstep(user_id: int) -> bool:
     try:
         response = requests.post(
@@ -85,6 +123,30 @@ def add_microstep(user_id: int) -> bool:
     except requests.exceptions.RequestException as e:
         print(f"Ошибка соединения: {e}")
         return False
+
+
+def stream_user_events(user_id: int, deadline: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """SSE-поток событий пользователя: сначала snapshot, затем achievement/xp. Завершается при обрыве соединения
+    или после deadline (time.monotonic()); проверяется на каждой строке, пинги сервера приходят регулярно"""
+    try:
+        with requests.get(f"{BASE_URL}/users/{user_id}/events", stream=True, timeout=(5, 60), proxies=PROXIES) as response:
+            if response.status_code != 200:
+                print(f"Ошибка API (events): {response.status_code}")
+                return
+            data_lines = []
+            for line in response.iter_lines(decode_unicode=True):
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                if line:
+                    if line.startswith("data:"):
+                        data_lines.append(line[5:].lstrip())
+                elif data_lines:                          # пустая строка — конец события
+                    yield json.loads("\n".join(data_lines))
+                    data_lines = []
+    except requests.exceptions.RequestException as e:
+        print(f"Ошибка соединения (events): {e}")
+
+
 def get_achievements_catalog() -> Optional[Dict[str, Any]]:
     try:
         response = requests.get(f"{BASE_URL}/achievements/catalog", timeout=5, proxies=PROXIES)
@@ -94,3 +156,25 @@ def get_achievements_catalog() -> Optional[Dict[str, Any]]:
     except requests.exceptions.RequestException as e:
         print(f"Ошибка соединения (catalog): {e}")
     return None
+
+
+_resume_etags: Dict[int, str] = {}  # user_id -> ETag последнего скачанного PDF
+
+
+def export_resume_pdf(user_id: int) -> Optional[str]:
+    """Скачивает PDF-резюме во временный файл и возвращает путь. Неизменное резюме повторно не качается (304)"""
+    path = os.path.join(tempfile.gettempdir(), f"resume-{user_id}.pdf")
+    headers = {"If-None-Match": _resume_etags[user_id]} if user_id in _resume_etags and os.path.exists(path) else {}
+    try:
+        response = requests.get(f"{BASE_URL}/users/{user_id}/resume.pdf", headers=headers, timeout=60, proxies=PROXIES)
+        if response.status_code == 304:
+            return path
+        if response.status_code == 200:
+            with open(path, "wb") as f:
+                f.write(response.content)
+            _resume_etags[user_id] = response.headers.get("ETag", "")
+            return path
+        print(f"Ошибка API (resume.pdf): {response.status_code} - {response.text}")
+    except requests.exceptions.RequestException as e:
+        print(f"Ошибка соединения (resume.pdf): {e}")
+    return None
@@ -1,16 +1,57 @@
 # ============================== ИМПОРТЫ БИБЛИОТЕК ==============================
-from fastapi import FastAPI, HTTPException, Depends, Body  # веб-фреймворк и утилиты для ошибок/зависимостей/тел
+from fastapi import FastAPI, HTTPException, Depends, Body, Query, Request  # веб-фреймворк и утилиты для ошибок/зависимостей/тел/query-параметров
+from fastapi.responses import StreamingResponse, Response   # SSE-поток событий пользователя; готовые JSON-байты
+from fastapi.middleware.gzip import GZipMiddleware          # сжатие крупных ответов (кабинет, пакетные выборки)
+from starlette.concurrency import run_in_threadpool          # синхронные запросы к БД из async-эндпоинтов
 from fastapi.middleware.cors import CORSMiddleware          # middleware для CORS, чтобы фронт (в т.ч. Gradio) звал API
-from pydantic import BaseModel, EmailStr, Field             # модели валидации входа/выхода и тип для email
-from typing import List, Optional, Dict, Any, Generator, TypedDict  # типы для аннотаций, Generator для dependency, TypedDict для стейта
+from pydantic import BaseModel, EmailStr, Field, TypeAdapter  # модели валидации входа/выхода и тип для email; сериализатор без моделей
+from typing import List, Optional, Dict, Any, Generator, TypedDict, Callable, Tuple, Iterable  # типы для аннотаций, Generator для dependency, TypedDict для стейта
 from sqlalchemy import (                                     # ядро SQLAlchemy (DDL/DML)
     create_engine, Column, Integer, String, Date, DateTime,
-    Float, ForeignKey, UniqueConstraint, Text
+    Float, ForeignKey, UniqueConstraint, Text, Index, func, case, inspect, text, or_, event, update
 )
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship, Session, Mapped, mapped_column  # ORM: фабрика сессий, базовый класс, relationship
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert  # INSERT ... ON CONFLICT для SQLite
+from sqlalchemy.exc import IntegrityError                    # синоним таксономии уже занят (гонка админских правок)
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, Session, Mapped, mapped_column, selectinload  # ORM: фабрика сессий, базовый класс, relationship
 from datetime import datetime, date, timedelta                # работа с датой/временем
 from dotenv import load_dotenv                               # загрузка .env параметров
 import os                                                    # доступ к переменным окружения/файлам
+import re                                                    # регулярки (оценка токенов)
+import math                                                  # округления (перцентили)
+import time                                                  # замеры латентности
+import threading                                             # семафор/блокировки LLM-шлюза
+import heapq                                                 # очередь ожидания по приоритетам
+import itertools                                             # счётчик порядка постановки в очередь
+import hashlib                                               # ключи коалесинга запросов
+import json                                                  # сериализация промптов/полезной нагрузки
+import gzip                                                  # выгрузка для аналитики в jsonl.gz (EXPORT_FORMAT=jsonl.gz)
+import uuid                                                  # уникальный суффикс запуска выгрузки
+import tempfile                                              # zip с резюме подразделения: в памяти до порога, дальше на диске
+import zipfile                                               # архив PDF-резюме
+from urllib.parse import quote                               # имя файла в Content-Disposition (RFC 5987)
+import asyncio                                               # очереди подписчиков SSE
+import contextvars                                           # счётчики БД текущего HTTP-запроса; текущий спан трассировки
+import contextlib                                            # спаны трассировки как контекст-менеджеры
+import logging                                               # структурированные логи вместо print
+from bisect import bisect_left, bisect_right, insort         # пороги ачивок; поиск навыков по префиксу
+from concurrent.futures import Future, ProcessPoolExecutor   # общий результат для склеенных запросов; пул процессов рендера PDF
+from concurrent.futures.process import BrokenProcessPool     # процесс пула рендера упал — пул пересоздаём
+import multiprocessing                                       # контекст запуска пула процессов (spawn)
+import sys                                                   # аргументы командной строки
+try:                                                         # orjson — необязательная зависимость быстрого JSON
+    import orjson
+except ImportError:
+    orjson = None
+try:                                                         # numpy — колоночный расчёт HR-аналитики (в requirements); без него — чистый Python
+    import numpy as np
+except ImportError:
+    np = None
+try:                                                         # pyarrow — выгрузка в Parquet/Arrow; без него работает только EXPORT_FORMAT=jsonl.gz
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+from resume_pdf import PDF_TEMPLATE_VERSION, init_worker, pdf_font_path, pdf_renderer_error, render_resume_pdf  # рендер PDF (и в пуле процессов)
 from openai import OpenAI                                    # клиент OpenAI-совместимого API (Scibox)
 from langgraph.graph import StateGraph, END                  # LangGraph: построение графа состояний для ИИ-консультанта
 
@@ -20,9 +61,56 @@ from langgraph.graph import StateGraph, END                  # LangGraph: пос
 load_dotenv()                                                # подгружаем переменные окружения из .env если есть
 SCIBOX_API_KEY = os.getenv("SCIBOX_API_KEY", "").strip()
 SCIBOX_BASE_URL = os.getenv("SCIBOX_BASE_URL", "http://176.119.5.23:4000/v1")  # URL Scibox по умолчанию
-
-print(f"SCIBOX_API_KEY: {'установлен' if SCIBOX_API_KEY else 'не установлен'}")
-print(f"SCIBOX_BASE_URL: {SCIBOX_BASE_URL}")
+SCIBOX_MODEL = os.getenv("SCIBOX_MODEL", "Qwen2.5-72B-Instruct-AWQ")             # модель Scibox для всех вызовов
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "1500"))       # бюджет токенов на промпт консультанта
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))                  # одновременных запросов к Scibox, не больше
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))                   # сколько ждать слота в очереди (сек)
+LLM_TIPS_TTL_HOURS = float(os.getenv("LLM_TIPS_TTL_HOURS", "24"))                 # через сколько часов советы считаются устаревшими
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "1") == "1"                              # запускать ли фоновый воркер вместе с API
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))                  # как часто воркер проверяет очередь (сек)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))                        # попыток на задачу до статуса failed
+RECALC_CHUNK_SIZE = int(os.getenv("RECALC_CHUNK_SIZE", "500"))                    # пользователей на один шаг пакетного пересчёта
+ENDORSEMENT_DEDUP_HOURS = float(os.getenv("ENDORSEMENT_DEDUP_HOURS", "24"))        # повтор от той же команды за это окно не засчитывается
+FAST_JSON = os.getenv("FAST_JSON", "0") == "1"                                     # горячие эндпоинты отдают JSON из проекций строк, минуя модели ответа
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()                               # DEBUG / INFO / WARNING / ERROR
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")                                       # json — строка JSON на событие; text — для чтения глазами
+
+# ============================== ЛОГИРОВАНИЕ ====================================
+class StructuredFormatter(logging.Formatter):
+    """Запись лога: время, уровень, логгер, сообщение и поля из extra={"fields": {...}} —
+    одной строкой JSON либо текстом с парами key=value"""
+    def __init__(self, as_json: bool):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record: logging.LogRecord) -> str:
+        ts = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z"
+        fields: Dict[str, Any] = getattr(record, "fields", None) or {}
+        if self.as_json:
+            payload = {"ts": ts, "level": record.levelname, "logger": record.name, "msg": record.getMessage(), **fields}
+            if record.exc_info:
+                payload["exc"] = self.formatException(record.exc_info)
+            return json.dumps(payload, ensure_ascii=False, default=str)
+        line = f"{ts} {record.levelname} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+def _setup_logging() -> logging.Logger:
+    log = logging.getLogger("career_backend")
+    if not log.handlers:                                     # повторный импорт не дублирует обработчик
+        handler = logging.StreamHandler()
+        handler.setFormatter(StructuredFormatter(as_json=LOG_FORMAT == "json"))
+        log.addHandler(handler)
+        log.propagate = False                                # не дублируем в корневой логгер uvicorn
+    log.setLevel(LOG_LEVEL)
+    return log
+
+logger = _setup_logging()
+logger.info("Scibox: ключ %s, base URL %s", "установлен" if SCIBOX_API_KEY else "не установлен", SCIBOX_BASE_URL)
 # ============================== ИНИЦИАЛИЗАЦИЯ ПРИЛОЖЕНИЯ =======================
 app = FastAPI(title="Career Backend", version="1.2.2")       # создаём экземпляр FastAPI с метаданными
 
@@ -34,14 +122,280 @@ app.add_middleware(
     allow_methods=["*"],                                     # разрешаем любые HTTP-методы
     allow_headers=["*"],                                     # разрешаем любые заголовки
 )
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))  # мелкие ответы не сжимаем
 
 # ============================== НАСТРОЙКА БАЗЫ ДАННЫХ ==========================
-DB_PATH = os.path.join("storage", "app.db")                  # путь к файлу SQLite в каталоге storage
-os.makedirs("storage", exist_ok=True)                        # создаём каталог storage, если его нет
+DB_PATH = os.getenv("DB_PATH", os.path.join("storage", "app.db"))  # путь к файлу SQLite (по умолчанию storage/app.db)
+os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)  # создаём каталог для базы, если его нет
 engine = create_engine(f"sqlite:///{DB_PATH}", echo=False, future=True)  # создаём SQLAlchemy-движок SQLite
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)  # фабрика сессий (ручной commit)
 Base = declarative_base()                                     # базовый класс для ORM-моделей
 
+# ============================== МЕТРИКИ (PROMETHEUS) ===========================
+# Небольшой реестр без внешних зависимостей: счётчики, gauge и гистограммы с метками,
+# отдаются в текстовом формате Prometheus 0.0.4 на GET /metrics
+METRICS_REGISTRY: List["_Metric"] = []                        # все метрики процесса в порядке объявления
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # секунды
+DB_QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)     # секунды на SQL-запрос
+DB_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)                                 # SQL-запросов на HTTP-запрос
+
+def _label_value(v: Any) -> str:                              # экранирование значения метки
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _metric_value(v: float) -> str:                           # целые без «.0», остальное как есть
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help_, tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        METRICS_REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        return "{" + ",".join(f'{k}="{_label_value(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+    def _samples(self, key: Tuple[str, ...], value: Any) -> List[str]:
+        return [f"{self.name}{self._labels(key)} {_metric_value(value)}"]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v) if isinstance(v, list) else v) for k, v in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0.0                            # без меток — ряд виден сразу с нулём
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)                # первая граница le >= value (len — только +Inf)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]  # по корзинам, сумма, число
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self, key: Tuple[str, ...], value: Any) -> List[str]:
+        counts, total, n = list(value[0]), value[1], value[2]
+        lines, acc = [], 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts):  # в формате корзины накопительные
+            acc += c
+            le = "+Inf" if bound == float("inf") else _metric_value(bound)
+            lines.append(f"{self.name}_bucket{self._labels(key, (('le', le),))} {acc}")
+        lines.append(f"{self.name}_sum{self._labels(key)} {_metric_value(total)}")
+        lines.append(f"{self.name}_count{self._labels(key)} {n}")
+        return lines
+
+def render_metrics() -> str:                                  # весь реестр в текстовом формате Prometheus
+    return "\n".join(line for m in METRICS_REGISTRY for line in m.render()) + "\n"
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP-запросы по методу, шаблону маршрута и статусу", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Латентность HTTP-запросов (без SSE-потоков)", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP-запросы в обработке прямо сейчас (включая открытые SSE)")
+HTTP_DB_QUERIES = Histogram("http_request_db_queries", "Число SQL-запросов на один HTTP-запрос", ("route",), buckets=DB_COUNT_BUCKETS)
+HTTP_DB_SECONDS = Histogram("http_request_db_seconds", "Суммарное время SQL на один HTTP-запрос", ("route",), buckets=DB_QUERY_BUCKETS + (2.5, 5.0))
+DB_QUERIES = Counter("db_queries_total", "Выполненные SQL-запросы: из HTTP-запросов и фоновых задач", ("source",))
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Длительность одного SQL-запроса", buckets=DB_QUERY_BUCKETS)
+LLM_REQUESTS = Counter("llm_requests_total", "Вызовы Scibox по эндпоинту и статусу", ("endpoint", "status"))
+LLM_LATENCY = Histogram("llm_request_duration_seconds", "Длительность вызова Scibox", ("endpoint",))
+LLM_TOKENS = Counter("llm_tokens_total", "Токены Scibox: prompt / completion", ("endpoint", "kind"))
+LLM_QUEUE_WAIT = Histogram("llm_queue_wait_seconds", "Ожидание слота LLM-шлюза по классу приоритета", ("priority",))
+
+_request_db_stats: "contextvars.ContextVar[Optional[Dict[str, float]]]" = contextvars.ContextVar("request_db_stats", default=None)
+
+@event.listens_for(engine, "before_cursor_execute")
+def _db_query_started(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info["query_started_at"] = time.perf_counter()
+
+@event.listens_for(engine, "after_cursor_execute")
+def _db_query_finished(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = time.perf_counter() - conn.info.pop("query_started_at", time.perf_counter())
+    stats = _request_db_stats.get()                          # контекст копируется в threadpool синхронных эндпоинтов
+    DB_QUERIES.inc(source="http" if stats is not None else "background")
+    DB_QUERY_SECONDS.observe(elapsed)
+    if stats is not None:
+        stats["queries"] += 1
+        stats["seconds"] += elapsed
+
+class MetricsMiddleware:
+    """ASGI-мидлварь: латентность по шаблону маршрута (/users/{user_id}, а не /users/42),
+    запросы в обработке, число и время SQL-запросов на HTTP-запрос. SSE-потоки в гистограмму латентности не попадают"""
+    def __init__(self, app_):
+        self.app = app_
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = {"queries": 0, "seconds": 0.0}
+        token = _request_db_stats.set(stats)
+        resp = {"status": 500, "stream": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                resp["status"] = message["status"]
+                resp["stream"] = any(k == b"content-type" and v.startswith(b"text/event-stream")
+                                     for k, v in message.get("headers", []))
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            _request_db_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", None) or "unmatched"  # 404 не плодят ряды по сырым путям
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(method=method, route=route, status=resp["status"])
+            if not resp["stream"]:
+                HTTP_LATENCY.observe(elapsed, method=method, route=route)
+            HTTP_DB_QUERIES.observe(stats["queries"], route=route)
+            HTTP_DB_SECONDS.observe(stats["seconds"], route=route)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("%s %s %s", method, route, resp["status"],
+                             extra={"fields": {"path": scope.get("path"), "ms": round(elapsed * 1000, 2),
+                                               "db_queries": stats["queries"], "db_ms": round(stats["seconds"] * 1000, 2)}})
+
+app.add_middleware(MetricsMiddleware)                         # внешняя мидлварь: в замер входит и сжатие ответа
+
+# ============================== ТРАССИРОВКА ====================================
+# Спаны в модели OpenTelemetry (trace_id/span_id/parent, атрибуты, статус). Если установлен opentelemetry-api,
+# спаны дублируются в глобальный трейсер (экспортёры настраиваются SDK). Встроенный экспорт — JSON-строка на спан
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")          # none | console (stderr) | file
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(os.path.dirname(DB_PATH) or ".", "traces.jsonl"))  # куда писать при TRACE_EXPORTER=file (рядом с базой)
+DEBUG_TIMING = os.getenv("DEBUG_TIMING", "0") == "1"          # Server-Timing в каждом ответе (иначе по заголовку X-Debug-Timing: 1)
+
+try:                                                          # OpenTelemetry необязателен
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+class TraceSpan:
+    __slots__ = ("name", "trace_id", "span_id", "parent_span_id", "start_ns", "duration_ms", "attributes", "status", "children", "_otel")
+
+    def __init__(self, name: str, parent: Optional["TraceSpan"]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.duration_ms = 0.0
+        self.attributes: Dict[str, Any] = {}
+        self.status = "ok"
+        self.children: List["TraceSpan"] = []                 # завершённые дочерние спаны (для Server-Timing)
+        self._otel = None
+
+    def set_attributes(self, **attrs: Any) -> None:
+        self.attributes.update(attrs)
+        if self._otel is not None:                            # в OTel — только примитивные типы
+            self._otel.set_attributes({k: v for k, v in attrs.items() if isinstance(v, (str, bool, int, float))})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_span_id": self.parent_span_id,
+                "start_time_unix_nano": self.start_ns, "duration_ms": self.duration_ms, "status": self.status,
+                "attributes": self.attributes}
+
+_current_span: "contextvars.ContextVar[Optional[TraceSpan]]" = contextvars.ContextVar("current_span", default=None)
+_trace_export_lock = threading.Lock()
+
+def _export_span(span: TraceSpan) -> None:
+    if TRACE_EXPORTER not in ("console", "file"):
+        return
+    line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+    with _trace_export_lock:                                  # строки спанов из разных потоков не перемешиваются
+        if TRACE_EXPORTER == "file":
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line)
+        else:
+            sys.stderr.write(line)
+
+@contextlib.contextmanager
+def trace_span(name: str, **attrs: Any) -> Generator[TraceSpan, None, None]:
+    """Спан с замером времени и числа/времени SQL-запросов внутри него (атрибуты db.queries, db.ms)"""
+    parent = _current_span.get()
+    span = TraceSpan(name, parent)
+    span.attributes.update(attrs)
+    stats = _request_db_stats.get()
+    db_token = None
+    if stats is None:                                         # вне HTTP-запроса считаем SQL сами
+        stats = {"queries": 0, "seconds": 0.0}
+        db_token = _request_db_stats.set(stats)
+    q0, s0 = stats["queries"], stats["seconds"]
+    otel_cm = otel_trace.get_tracer("career_backend").start_as_current_span(name, attributes=span.attributes) if otel_trace else None
+    span._otel = otel_cm.__enter__() if otel_cm is not None else None
+    token = _current_span.set(span)
+    started = time.perf_counter()
+    exc_info: Tuple[Any, Any, Any] = (None, None, None)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = "error"
+        span.attributes["error"] = f"{type(e).__name__}: {e}"
+        exc_info = sys.exc_info()
+        raise
+    finally:
+        span.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+        span.set_attributes(**{"db.queries": stats["queries"] - q0, "db.ms": round((stats["seconds"] - s0) * 1000, 3)})
+        _current_span.reset(token)
+        if db_token is not None:
+            _request_db_stats.reset(db_token)
+        if otel_cm is not None:
+            otel_cm.__exit__(*exc_info)
+        if parent is not None:
+            parent.children.append(span)
+        _export_span(span)
+
+def trace_attrs(**attrs: Any) -> None:                        # атрибуты текущему спану (вне трассировки — ничего)
+    span = _current_span.get()
+    if span is not None:
+        span.set_attributes(**attrs)
+
+def server_timing(span: TraceSpan) -> str:                    # заголовок Server-Timing: этапы, SQL и итог
+    parts = [f"{c.name.rsplit('.', 1)[-1]};dur={c.duration_ms:.1f}" for c in span.children]
+    parts.append(f'db;dur={span.attributes.get("db.ms", 0):.1f};desc="{span.attributes.get("db.queries", 0)} queries"')
+    parts.append(f"total;dur={span.duration_ms:.1f}")
+    return ", ".join(parts)
+
 # ============================== ORM-МОДЕЛИ ДАННЫХ (Typed ORM 2.0) ==============================
 class User(Base):
     __tablename__ = "users"                                  # имя таблицы в БД
@@ -61,6 +415,7 @@ class User(Base):
     updated_at: Mapped[datetime] = mapped_column(                                          # колонка последнего обновления
         DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
     )
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")  # версия профиля (ETag); растёт с каждым изменением: PUT/PATCH, разбор резюме, правка таксономии
 
     # связи (Typed) — коллекции дочерних сущностей. cascade удаляет их вместе с пользователем
     skills: Mapped[list["Skill"]] = relationship(back_populates="user", cascade="all, delete-orphan")             # 1:N навыки
@@ -70,6 +425,9 @@ class User(Base):
     achievements: Mapped[list["UserAchievement"]] = relationship(back_populates="user", cascade="all, delete-orphan")  # 1:N ачивки
     microsteps: Mapped[list["Microstep"]] = relationship(back_populates="user", cascade="all, delete-orphan")     # 1:N микрошаги (для стриков)
     chat_messages: Mapped[list["ChatMessage"]] = relationship(back_populates="user", cascade="all, delete-orphan") # 1:N история чата ИИ
+    signals: Mapped[list["ProfileSignal"]] = relationship(back_populates="user", cascade="all, delete-orphan")    # 1:N типизированные сигналы (языки, доступность, менторство, комплаенс)
+    endorsement_counters: Mapped[list["EndorsementCounter"]] = relationship(cascade="all, delete-orphan")        # 1:N счётчики подтверждений по навыкам
+    work_periods: Mapped[list["WorkPeriod"]] = relationship(back_populates="user", cascade="all, delete-orphan")  # 1:N периоды работы из резюме
 
 class Skill(Base):
     __tablename__ = "skills"                                 # имя таблицы
@@ -78,9 +436,24 @@ class Skill(Base):
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)            # внешний ключ на users.id
     name: Mapped[str] = mapped_column(String, nullable=False, index=True)                   # название/метка навыка; индекс для быстрых выборок
     level: Mapped[Optional[str]] = mapped_column(String, nullable=True)                     # уровень владения (например, Junior/Middle/Senior)
+    skill_id: Mapped[Optional[int]] = mapped_column(ForeignKey("skill_taxonomy.id"), nullable=True, index=True)  # канонический навык из таксономии
 
     user: Mapped["User"] = relationship(back_populates="skills")                             # обратная связь к владельцу навыка
 
+class ProfileSignal(Base):
+    __tablename__ = "profile_signals"                       # типизированные сигналы профиля (раньше — строки-маркеры в skills.name)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # PK сигнала
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)            # FK на пользователя
+    kind: Mapped[str] = mapped_column(String, nullable=False)                               # 'language' / 'availability' / 'mentor_sessions' / 'compliance_step'
+    key: Mapped[str] = mapped_column(String, nullable=False, default="")                    # язык ('EN'), месяц доступности, номер шага
+    level: Mapped[Optional[str]] = mapped_column(String, nullable=True)                     # уровень языка ('B2')
+    value: Mapped[int] = mapped_column(Integer, nullable=False, default=0)                  # число сессий менторства / номер шага комплаенса
+
+    user: Mapped["User"] = relationship(back_populates="signals")                           # обратная связь к пользователю
+
+    __table_args__ = (Index("ix_signals_user_kind", "user_id", "kind"),)                   # агрегаты по пользователю и виду сигнала
+
 class Project(Base):
     __tablename__ = "projects"                              # имя таблицы
 
@@ -104,6 +477,32 @@ class Endorsement(Base):
 
     user: Mapped["User"] = relationship(back_populates="endorsements")                      # обратная связь к пользователю
 
+    __table_args__ = (Index("ix_endorse_user_team_at", "user_id", "from_team", "endorsed_at"),)  # проверка повторов от команды за окно
+
+class EndorsementCounter(Base):
+    __tablename__ = "endorsement_counters"                  # сколько раз подтверждён каждый навык пользователя (ведётся при записи)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # PK счётчика
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)            # FK на владельца
+    skill_id: Mapped[Optional[int]] = mapped_column(ForeignKey("skill_taxonomy.id"), nullable=True, index=True)  # навык таксономии (NULL — вне её)
+    skill_key: Mapped[str] = mapped_column(String, nullable=False)                          # навык таксономии — ключ канона, иначе нормализованное имя ('soft:коммуникации')
+    skill_name: Mapped[str] = mapped_column(String, nullable=False)                         # каноническое написание (вне таксономии — из первого подтверждения)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)                  # число засчитанных подтверждений
+    last_endorsed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)   # последнее подтверждение
+
+    __table_args__ = (UniqueConstraint("user_id", "skill_key", name="uq_endorse_counter"),)  # один счётчик на навык пользователя (синонимы — в канон)
+
+class EndorsementWindow(Base):
+    __tablename__ = "endorsement_windows"                   # окно дедупликации: до какого момента повтор от команды не засчитывается
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # PK окна
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)            # кого подтверждали
+    from_team: Mapped[str] = mapped_column(String, nullable=False, default="")              # какая команда
+    skill_key: Mapped[str] = mapped_column(String, nullable=False)                          # навык (тот же ключ, что у счётчика)
+    window_until: Mapped[datetime] = mapped_column(DateTime, nullable=False)                # до этого момента повтор отбрасывается
+
+    __table_args__ = (UniqueConstraint("user_id", "from_team", "skill_key", name="uq_endorse_window"),)  # захват окна — атомарный upsert
+
 class Certificate(Base):
     __tablename__ = "certificates"                          # имя таблицы
 
@@ -112,9 +511,13 @@ class Certificate(Base):
     name: Mapped[str] = mapped_column(String, nullable=False)                               # название сертификата
     issued_by: Mapped[Optional[str]] = mapped_column(String, nullable=True)                 # кем выдан (организация)
     valid_until: Mapped[Optional[date]] = mapped_column(Date, nullable=True)                # срок действия (может отсутствовать)
+    source: Mapped[Optional[str]] = mapped_column(String, nullable=True)                    # 'resume' — извлечён из текста резюме; None — введён вручную
 
     user: Mapped["User"] = relationship(back_populates="certificates")                      # обратная связь к пользователю
 
+    __table_args__ = (Index("ix_cert_valid_until", "valid_until"),                          # «истекают в ближайшие N дней» — диапазон по дате
+                      Index("ix_cert_user_valid_until", "user_id", "valid_until"))          # действующие сертификаты пользователя — COUNT по индексу
+
 class UserAchievement(Base):
     __tablename__ = "user_achievements"                    # имя таблицы
 
@@ -127,7 +530,8 @@ class UserAchievement(Base):
 
     user: Mapped["User"] = relationship(back_populates="achievements")                      # обратная связь к пользователю
 
-    __table_args__ = (UniqueConstraint("user_id", "code", "level", name="uq_user_ach_level"),)  # уникальность уровня ачивки на пользователя
+    __table_args__ = (UniqueConstraint("user_id", "code", "level", name="uq_user_ach_level"),  # уникальность уровня ачивки на пользователя
+                      Index("ix_user_ach_user_obtained", "user_id", "obtained_at"))             # последние ачивки пользователя без сортировки всех
 
 class Microstep(Base):
     __tablename__ = "microsteps"                            # имя таблицы
@@ -151,10 +555,414 @@ class ChatMessage(Base):
 
     user: Mapped["User"] = relationship(back_populates="chat_messages")                     # обратная связь к пользователю
 
+    __table_args__ = (Index("ix_chat_user_id_id", "user_id", "id"),)                       # выборка истории пользователя по id (keyset-пагинация)
+
+class ChatSummary(Base):
+    __tablename__ = "chat_summaries"                        # имя таблицы (рядом с chat_messages)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # PK сводки
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, unique=True)  # одна скользящая сводка на пользователя
+    summary: Mapped[str] = mapped_column(Text, nullable=False, default="")                  # сжатое содержание старой части диалога
+    last_message_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)        # id последнего сообщения, вошедшего в сводку
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # когда сводка обновлялась
+
+
+class LlmCall(Base):
+    __tablename__ = "llm_calls"                             # журнал вызовов LLM (стоимость и латентность)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # PK вызова
+    endpoint: Mapped[str] = mapped_column(String, nullable=False, index=True)               # кто вызывал: 'dashboard_tips', 'consultant_chat', ...
+    model: Mapped[str] = mapped_column(String, nullable=False)                              # модель
+    prompt_tokens: Mapped[int] = mapped_column(Integer, nullable=False, default=0)          # токены промпта
+    completion_tokens: Mapped[int] = mapped_column(Integer, nullable=False, default=0)      # токены ответа
+    usage_source: Mapped[str] = mapped_column(String, nullable=False, default="api")        # 'api' — usage от сервера, 'estimate' — наша оценка
+    latency_ms: Mapped[float] = mapped_column(Float, nullable=False)                        # длительность вызова (мс)
+    status: Mapped[str] = mapped_column(String, nullable=False, default="ok")               # 'ok' или 'error'
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)  # когда был вызов (UTC)
+
+
+class BackgroundJob(Base):
+    __tablename__ = "background_jobs"                       # персистентная очередь фоновых задач
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # PK задачи
+    kind: Mapped[str] = mapped_column(String, nullable=False)                               # тип задачи (ключ в JOB_HANDLERS)
+    dedup_key: Mapped[Optional[str]] = mapped_column(String, nullable=True, index=True)     # одинаковые активные задачи не дублируются
+    status: Mapped[str] = mapped_column(String, nullable=False, default="queued")           # queued / running / done / failed
+    payload: Mapped[str] = mapped_column(Text, nullable=False, default="{}")                # параметры задачи (JSON)
+    result: Mapped[Optional[str]] = mapped_column(Text, nullable=True)                      # итог задачи (JSON)
+    progress: Mapped[Optional[str]] = mapped_column(Text, nullable=True)                    # прогресс/курсор для продолжения после рестарта (JSON)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)               # сколько раз запускали
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)                  # текст последней ошибки
+    run_after: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)          # не запускать раньше (ретраи с задержкой)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)         # когда поставлена
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # последнее изменение
+
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)           # выборка готовых к запуску задач
+
+class LlmTip(Base):
+    __tablename__ = "llm_tips"                              # предрасчитанные советы LLM для кабинета
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # PK записи
+    signature: Mapped[str] = mapped_column(String, nullable=False, unique=True)             # сигнатура промпта (роль/отдел/число навыков/проектов)
+    prompt: Mapped[str] = mapped_column(Text, nullable=False)                               # промпт, по которому получены советы
+    tips: Mapped[Optional[str]] = mapped_column(Text, nullable=True)                        # текст советов
+    generated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)  # когда сгенерированы (для обновления по расписанию)
+
+class WorkPeriod(Base):
+    __tablename__ = "work_periods"                          # периоды работы, извлечённые из текста резюме
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # PK периода
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)  # FK на пользователя
+    company: Mapped[str] = mapped_column(String, nullable=False, default="")                # место работы
+    started_on: Mapped[Optional[date]] = mapped_column(Date, nullable=True)                 # начало (None — даты не указаны)
+    ended_on: Mapped[Optional[date]] = mapped_column(Date, nullable=True)                   # конец (None — по настоящее время)
+    description: Mapped[Optional[str]] = mapped_column(Text, nullable=True)                 # обязанности
+
+    user: Mapped["User"] = relationship(back_populates="work_periods")                      # обратная связь к пользователю
+
+class CertificateExpiryDigest(Base):
+    __tablename__ = "certificate_expiry_digests"            # ежедневный список «скоро истекают» по подразделениям
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # PK записи
+    as_of: Mapped[date] = mapped_column(Date, nullable=False)                               # на какую дату собран список
+    department: Mapped[str] = mapped_column(String, nullable=False)                         # подразделение
+    within_days: Mapped[int] = mapped_column(Integer, nullable=False)                       # горизонт (дней до истечения)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)                  # число сертификатов в списке
+    items: Mapped[str] = mapped_column(Text, nullable=False, default="[]")                  # JSON-список сертификатов
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)         # когда собран
+
+    __table_args__ = (UniqueConstraint("as_of", "department", name="uq_cert_digest_day_dept"),)  # один список на день и подразделение
+
+class TaxonomySkill(Base):
+    __tablename__ = "skill_taxonomy"                        # канонические навыки (одна строка на навык)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # целочисленный id навыка для сопоставлений
+    name: Mapped[str] = mapped_column(String, nullable=False, unique=True)                  # каноническое написание ('Python')
+
+class SkillAlias(Base):
+    __tablename__ = "skill_aliases"                         # синонимы навыков -> канонический id
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)                              # PK синонима
+    alias_key: Mapped[str] = mapped_column(String, nullable=False, unique=True)             # нормализованное написание ('python3')
+    skill_id: Mapped[int] = mapped_column(ForeignKey("skill_taxonomy.id"), nullable=False, index=True)  # на какой навык указывает
+
 
 # ============================== СОЗДАЁМ ТАБЛИЦЫ ================================
 Base.metadata.create_all(bind=engine)                         # создаём физические таблицы в SQLite, если их нет
 
+def _migrate_schema() -> None:
+    """Лёгкая миграция без Alembic: create_all не трогает существующие таблицы,
+    поэтому докидываем в них недостающие колонки (nullable или с server_default) и индексы"""
+    insp = inspect(engine)                                    # инспектор схемы реальной БД
+    with engine.begin() as conn:                              # одна транзакция на всю миграцию
+        for table in Base.metadata.sorted_tables:             # обходим все ORM-таблицы
+            existing = {c["name"] for c in insp.get_columns(table.name)}  # колонки, которые уже есть в БД
+            for col in table.columns:                         # ищем новые колонки
+                if col.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=engine.dialect)}"
+                if col.server_default is not None:            # значение по умолчанию для уже существующих строк
+                    ddl += f" DEFAULT {col.server_default.arg}"
+                conn.execute(text(ddl))
+            for idx in table.indexes:                         # индексы, добавленные в модели позже создания таблицы
+                idx.create(conn, checkfirst=True)
+
+_migrate_schema()                                             # приводим старые БД к текущей схеме
+
+# ============================== МАРКЕРЫ НАВЫКОВ -> СИГНАЛЫ ПРОФИЛЯ ============
+SIGNAL_PREFIXES = ("lang:", "availability:", "mentor_sessions:", "compliance:step")  # старые строковые кодировки в Skill.name
+
+def parse_skill_marker(name: str) -> Optional[Dict[str, Any]]:  # 'lang:EN=B2' -> {'kind': 'language', 'key': 'EN', 'level': 'B2'}; обычный навык -> None
+    low = name.strip().lower()
+    rest = name.strip().split(":", 1)[1] if ":" in name else ""
+    if low.startswith("lang:"):
+        lang, _, lvl = rest.rpartition("=")                   # уровень справа от последнего "="
+        return {"kind": "language", "key": lang.strip().upper(), "level": lvl.strip().upper(), "value": 0}
+    if low.startswith("availability:"):
+        return {"kind": "availability", "key": rest.strip(), "level": None, "value": 0}
+    if low.startswith("mentor_sessions:"):
+        try:
+            sessions = int(rest.split(":")[0])
+        except ValueError:                                    # кривой формат учитываем как 0 сессий
+            sessions = 0
+        return {"kind": "mentor_sessions", "key": "", "level": None, "value": sessions}
+    if low.startswith("compliance:step"):
+        step = rest[len("step"):].strip()
+        return {"kind": "compliance_step", "key": step, "level": None, "value": int(step) if step.isdigit() else 0}
+    return None
+
+def _migrate_skill_markers() -> None:
+    """Разовая миграция: строки-маркеры из skills переносим в profile_signals и удаляем из навыков.
+    Повторный запуск ничего не делает — маркеров в skills уже нет"""
+    db = SessionLocal()
+    try:
+        lname = func.lower(Skill.name)
+        markers = db.query(Skill).filter(or_(*[lname.like(p + "%") for p in SIGNAL_PREFIXES])).all()
+        for sk in markers:
+            db.add(ProfileSignal(user_id=sk.user_id, **parse_skill_marker(sk.name)))
+            db.delete(sk)
+        db.commit()
+        if markers:
+            logger.info("Миграция: %d маркеров навыков перенесено в profile_signals", len(markers))
+    finally:
+        db.close()
+
+_migrate_skill_markers()
+
+# ============================== ТАКСОНОМИЯ НАВЫКОВ =============================
+# Свободный текст навыков ('python3', 'Питон', 'PYTHON') сводим к каноническому id при записи;
+# сопоставления (курсы, поиск людей по навыку) дальше идут по целым числам, а не по строкам.
+# Канон пополняется только из SKILL_SYNONYMS и админкой: неизвестный навык хранится как ввёл сотрудник
+# (skill_id = NULL) и ждёт решения в /admin/skills/unresolved — опечатки и мусор в таксономию не попадают.
+SKILL_SYNONYMS: Dict[str, List[str]] = {                      # стартовый словарь: канон -> синонимы (покрывает навыки COURSE_CATALOG)
+    "Python": ["python3", "py", "питон", "пайтон"],
+    "Алгоритмы": ["algorithms", "алгоритмы и структуры данных"],
+    "ML": ["machine learning", "машинное обучение", "мл"],
+    "Данные": ["data", "анализ данных", "data analysis"],
+    "SQL": ["postgresql", "postgres"],
+    "JavaScript": ["js", "ecmascript"],
+    "Управление проектами": ["project management", "проектное управление", "pm"],
+    "Коммуникации": ["communication", "communications", "коммуникация"],
+    "Soft Skills": ["soft-skills", "софт скиллы", "гибкие навыки"],
+    "Продажи": ["sales"],
+    "Переговоры": ["negotiations", "negotiation"],
+    "Риски": ["risk management", "управление рисками"],
+    "Стейкхолдеры": ["stakeholders", "stakeholder management", "работа со стейкхолдерами"],
+}
+
+def normalize_skill_key(name: str) -> str:                    # ключ сравнения: регистр, ё/е, пробелы и дефисы
+    key = name.strip().casefold().replace("ё", "е")
+    key = re.sub(r"[\s_\-]+", " ", key)                      # 'Soft-Skills' / 'soft_skills' -> 'soft skills'
+    key = re.sub(r"\s*:\s*", ":", key)                        # 'Soft: Talk' -> 'soft:talk'
+    return key.strip(" .,;:")                                 # хвостовую пунктуацию не учитываем ('.net' и 'c#' сохраняются)
+
+class SkillTaxonomy:
+    """Кэш таксономии в памяти процесса: ключ синонима -> id, id -> каноническое имя.
+    Новый навык (админка) заводится в транзакции вызывающего, а в общий кэш попадает
+    только после её коммита — откат запроса не оставит в кэше несуществующий id"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._by_key: Optional[Dict[str, int]] = None         # загружаем лениво при первом обращении
+        self._names: Dict[int, str] = {}
+        self._prefix: List[Tuple[str, int]] = []              # отсортированные (ключ, id) для поиска по префиксу
+
+    def _load(self) -> None:
+        db = SessionLocal()
+        try:
+            by_key = {a.alias_key: a.skill_id for a in db.query(SkillAlias).all()}
+            names = {t.id: t.name for t in db.query(TaxonomySkill).all()}
+        finally:
+            db.close()
+        for sid, nm in names.items():                         # каноническое имя всегда ведёт на себя
+            by_key.setdefault(normalize_skill_key(nm), sid)
+        self._by_key, self._names, self._prefix = by_key, names, sorted(by_key.items())
+
+    def _ensure(self) -> Dict[str, int]:
+        if self._by_key is None:
+            with self._lock:
+                if self._by_key is None:
+                    self._load()
+        return self._by_key
+
+    def reload(self) -> None:                                 # после правок таблиц таксономии
+        with self._lock:
+            self._load()
+
+    def lookup(self, name: str) -> Optional[int]:             # id навыка или None, если такого нет
+        return self._ensure().get(normalize_skill_key(name))
+
+    def add(self, db: Session, name: str, aliases: Iterable[str] = ()) -> int:
+        """Заводит канонический навык или дополняет синонимы существующего. Только для курируемых
+        путей (админка): синоним, уже ведущий на другой навык, — ValueError"""
+        if not normalize_skill_key(name):
+            raise ValueError("Empty skill name")
+        sid = self.lookup(name)
+        if sid is None:
+            tax = TaxonomySkill(name=name.strip())
+            db.add(tax)
+            db.flush()
+            sid = tax.id
+        canon = self._names.get(sid) or name.strip()
+        pending = db.info.setdefault("new_skills", {})        # заведённые в этой транзакции: ключ -> (id, имя)
+        for key in {normalize_skill_key(name), *map(normalize_skill_key, aliases)} - {""}:
+            owner = self._ensure().get(key, pending.get(key, (sid,))[0])
+            if owner != sid:
+                raise ValueError(f"Alias '{key}' already points to skill {owner}")
+            if key not in self._by_key and key not in pending:
+                db.add(SkillAlias(alias_key=key, skill_id=sid))
+            pending[key] = (sid, canon)                       # попадёт в кэш после коммита
+        db.flush()
+        return sid
+
+    def publish(self, pending: Dict[str, Tuple[int, str]]) -> None:  # после коммита: новые навыки видны всем запросам
+        self._ensure()
+        with self._lock:
+            for key, (sid, nm) in pending.items():
+                if key not in self._by_key:
+                    self._by_key[key] = sid
+                    insort(self._prefix, (key, sid))
+                self._names[sid] = nm
+
+    def name(self, skill_id: int, db: Optional[Session] = None) -> str:  # каноническое имя по id
+        self._ensure()
+        nm = self._names.get(skill_id)
+        if nm is None and db is not None:                     # навык заведён в ещё не закоммиченной транзакции
+            nm = next((n for sid, n in db.info.get("new_skills", {}).values() if sid == skill_id), None)
+        return nm or ""
+
+    def find_in_text(self, content: str, max_words: int = 4) -> List[int]:  # известные навыки, упомянутые в свободном тексте
+        by_key = self._ensure()
+        words = [w.rstrip(".") for w in re.findall(r"[\w#+.]+", content.casefold().replace("ё", "е"))]
+        found: List[int] = []
+        i = 0
+        while i < len(words):
+            for n in range(min(max_words, len(words) - i), 0, -1):  # самое длинное совпадение: 'машинное обучение', а не 'обучение'
+                sid = by_key.get(" ".join(words[i:i + n])) if n > 1 or len(words[i]) > 1 else None
+                if sid is not None:
+                    if sid not in found:
+                        found.append(sid)
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, str]]:  # канонические навыки по префиксу ключа
+        key = normalize_skill_key(query)
+        self._ensure()
+        found: Dict[int, str] = {}
+        for k, sid in self._prefix[bisect_left(self._prefix, (key, -1)):]:  # бинарный поиск начала диапазона
+            if not k.startswith(key) or len(found) >= limit:
+                break
+            found.setdefault(sid, self._names.get(sid, k))
+        return list(found.items())
+
+skill_taxonomy = SkillTaxonomy()                              # общий кэш на процесс
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish_new_skills(session: Session) -> None:            # транзакция с новыми навыками зафиксирована
+    if session.in_nested_transaction():                       # событие приходит и на отпускание savepoint — ждём внешний коммит
+        return
+    pending = session.info.pop("new_skills", None)
+    if pending:
+        skill_taxonomy.publish(pending)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_new_skills(session: Session) -> None:               # откат: заведённых навыков в БД нет
+    if session.in_nested_transaction():                       # откат savepoint не трогает остальные новые навыки
+        return
+    session.info.pop("new_skills", None)
+
+def _seed_skill_taxonomy() -> None:
+    """Заводит канон и синонимы из SKILL_SYNONYMS и проставляет skill_id старым навыкам.
+    Повторный запуск ничего не меняет"""
+    db = SessionLocal()
+    try:
+        known = {normalize_skill_key(t.name): t for t in db.query(TaxonomySkill).all()}
+        aliases = {a.alias_key for a in db.query(SkillAlias).all()}
+        for canon, syns in SKILL_SYNONYMS.items():
+            tax = known.get(normalize_skill_key(canon))
+            if tax is None:
+                tax = TaxonomySkill(name=canon)
+                db.add(tax)
+                db.flush()
+            for key in {normalize_skill_key(canon), *map(normalize_skill_key, syns)} - aliases:
+                db.add(SkillAlias(alias_key=key, skill_id=tax.id))
+                aliases.add(key)
+        db.commit()
+        skill_taxonomy.reload()
+        linked = 0
+        for sk in db.query(Skill).filter(Skill.skill_id.is_(None)):  # навыки, записанные до таксономии (или вне её)
+            sid = skill_taxonomy.lookup(sk.name)
+            if sid is not None:                               # неизвестные остаются как есть до решения админа
+                sk.skill_id, sk.name = sid, skill_taxonomy.name(sid)  # храним каноническое написание
+                linked += 1
+        db.commit()
+        if linked:
+            logger.info("Миграция: %d навыков привязано к таксономии", linked)
+    finally:
+        db.close()
+
+_seed_skill_taxonomy()
+
+def endorsement_skill(name: str) -> Tuple[Optional[int], str, str]:  # (skill_id, ключ счётчика, написание) для эндорсмента
+    sid = skill_taxonomy.lookup(name)
+    if sid is None:                                           # вне таксономии (и soft:-навыки) — по нормализованному имени
+        return None, normalize_skill_key(name), name.strip()
+    canon = skill_taxonomy.name(sid)
+    return sid, normalize_skill_key(canon), canon             # синонимы ('python3', 'Питон') сводятся к одному счётчику
+
+def _backfill_endorsement_counters() -> None:
+    """Разовая миграция: счётчики из уже накопленных эндорсментов (все строки, без ретро-дедупликации).
+    Запускается, только пока таблица счётчиков пуста"""
+    db = SessionLocal()
+    try:
+        if db.query(EndorsementCounter.id).first() or not db.query(Endorsement.id).first():
+            return
+        counters: Dict[tuple, EndorsementCounter] = {}
+        for uid, name, cnt, last in (db.query(Endorsement.user_id, Endorsement.skill_name, func.count(Endorsement.id),
+                                              func.max(Endorsement.endorsed_at))
+                                     .group_by(Endorsement.user_id, Endorsement.skill_name)):
+            sid, key, canon = endorsement_skill(name)
+            row = counters.get((uid, key))
+            if row is None:
+                row = counters[(uid, key)] = EndorsementCounter(user_id=uid, skill_id=sid, skill_key=key, skill_name=canon,
+                                                                count=0, last_endorsed_at=last)
+            row.count += cnt
+            row.last_endorsed_at = max(row.last_endorsed_at, last)
+        db.add_all(counters.values())
+        db.commit()
+        logger.info("Миграция: %d счётчиков эндорсментов", len(counters))
+    finally:
+        db.close()
+
+_backfill_endorsement_counters()
+
+def link_endorsement_counters(db: Session) -> int:
+    """Счётчики навыков, которых не было в таксономии, переводит на skill_id (после появления канона);
+    счётчики синонимов одного навыка сливаются. Возвращает число переведённых"""
+    linked = 0
+    for c in db.query(EndorsementCounter).filter(EndorsementCounter.skill_id.is_(None)).order_by(EndorsementCounter.id).all():
+        sid, key, canon = endorsement_skill(c.skill_name)
+        if sid is None:
+            continue
+        target = db.query(EndorsementCounter).filter_by(user_id=c.user_id, skill_key=key).first()
+        if target is None or target is c:
+            c.skill_id, c.skill_key, c.skill_name = sid, key, canon
+        else:
+            target.count += c.count
+            target.last_endorsed_at = max(target.last_endorsed_at, c.last_endorsed_at)
+            db.delete(c)
+        db.flush()
+        linked += 1
+    return linked
+
+def _migrate_endorsement_keys() -> None:
+    """Счётчики старых БД — на skill_id; окна дедупликации — из эндорсментов последних ENDORSEMENT_DEDUP_HOURS"""
+    db = SessionLocal()
+    try:
+        linked = link_endorsement_counters(db)
+        if not db.query(EndorsementWindow.id).first():
+            since = datetime.utcnow() - timedelta(hours=ENDORSEMENT_DEDUP_HOURS)
+            windows: Dict[tuple, datetime] = {}
+            for uid, team, name, last in (db.query(Endorsement.user_id, Endorsement.from_team, Endorsement.skill_name,
+                                                   func.max(Endorsement.endorsed_at))
+                                          .filter(Endorsement.endorsed_at >= since)
+                                          .group_by(Endorsement.user_id, Endorsement.from_team, Endorsement.skill_name)):
+                k = (uid, team or "", endorsement_skill(name)[1])
+                windows[k] = max(windows.get(k, last), last)
+            db.add_all(EndorsementWindow(user_id=uid, from_team=team, skill_key=key,
+                                         window_until=last + timedelta(hours=ENDORSEMENT_DEDUP_HOURS))
+                       for (uid, team, key), last in windows.items())
+        db.commit()
+        if linked:
+            logger.info("Миграция: %d счётчиков эндорсментов переведено на skill_id", linked)
+    finally:
+        db.close()
+
+_migrate_endorsement_keys()
+
 # ============================== ФУНКЦИЯ ВЫДАЧИ СЕССИИ ==========================
 def get_db() -> Generator[Session, None, None]:              # зависимость FastAPI: генератор сессии БД
     db = SessionLocal()                                      # открываем новую сессию
@@ -184,31 +992,21 @@ ACHIEVEMENTS_CATALOG: Dict[str, Dict[str, Any]] = {          # словарь п
 
 # ============================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ========================
 def mandatory_profile_fields_filled(u: User) -> float:       # доля заполненности ключевых полей профиля
-    required = [u.email, u.full_name]                        # минимально обязательные поля
-    optional_required = [u.position, u.department, u.grade]  # квази-обязательные поля из анкеты
-    total = len(required) + len(optional_required)           # общее количество учитываемых полей
-    filled = sum(1 for x in required + optional_required if x and str(x).strip())  # сколько реально заполнено
-    return filled / total if total else 0.0                  # возвращаем долю (0..1), защита от деления на ноль
+    fields = (u.email, u.full_name,                          # минимально обязательные поля
+              u.position, u.department, u.grade)             # квази-обязательные поля из анкеты
+    filled = sum(1 for x in fields if x and str(x).strip())  # сколько реально заполнено
+    return filled / len(fields)                              # возвращаем долю (0..1)
 
 def language_level_to_xp(level: str) -> int:                 # конвертируем уровень языка в XP
     mapping = {"A2": 20, "B1": 40, "B2": 80, "C1": 140, "C2": 200}  # соответствие уровней
     return mapping.get(level.upper(), 0)                     # неизвестный уровень даёт 0 XP
 
-def compute_weekly_streak(steps: List[date]) -> Dict[str, Any]:  # считаем недельный «стрик» по датам микрошагов
+def compute_weekly_streak(steps: List[date], today: Optional[date] = None) -> Dict[str, Any]:  # считаем недельный «стрик» по датам микрошагов
     if not steps:                                            # если шагов нет
         return {"completed_weeks": 0, "master_checkpoints": 0, "status": "пауза"}  # пустой результат
-    steps_sorted = sorted(set(steps))                        # сортируем и убираем дубликаты
-    start_week = steps_sorted[0] - timedelta(days=steps_sorted[0].weekday())  # понедельник первой недели
-    last_week = steps_sorted[-1] - timedelta(days=steps_sorted[-1].weekday()) # понедельник последней недели
-    weeks, cur = [], start_week                              # инициализируем список недель и указатель
-    while cur <= last_week:                                  # идём от первой недели к последней
-        weeks.append(cur)                                    # добавляем начало недели
-        cur += timedelta(weeks=1)                            # переходим к следующей неделе
-    completed_weeks = sum(                                   # считаем недели, где был хотя бы один микрошаг
-        1 for w in weeks if any(w <= d <= w + timedelta(days=6) for d in steps_sorted)
-    )
+    completed_weeks = len({d.toordinal() - d.weekday() for d in steps})  # недели с хотя бы одним микрошагом (по понедельнику недели)
     master_checkpoints = completed_weeks // 4                # каждый 4-й завершённый блок недель — чекпоинт
-    status = "активен" if (steps_sorted[-1] >= (date.today() - timedelta(days=7))) else "пауза"  # активность по последней неделе
+    status = "активен" if (max(steps) >= ((today or date.today()) - timedelta(days=7))) else "пауза"  # активность по последней неделе
     return {"completed_weeks": completed_weeks, "master_checkpoints": master_checkpoints, "status": status}  # отдаём метрики
 
 def xp_from_streak(streak: Dict[str, Any]) -> int:           # перевод метрик стрика в XP
@@ -218,29 +1016,550 @@ def xp_from_streak(streak: Dict[str, Any]) -> int:           # перевод м
 def scibox_client() -> Optional[OpenAI]:
     """Создаём клиента Scibox (если есть ключ) с улучшенным логированием"""
     if not SCIBOX_API_KEY:
-        print("Scibox API ключ не найден. Установите переменную окружения SCIBOX_API_KEY")
+        logger.warning("Scibox API ключ не найден. Установите переменную окружения SCIBOX_API_KEY")
         return None
 
     if not SCIBOX_BASE_URL:
-        print("Scibox base URL не найден. Установите переменную окружения SCIBOX_BASE_URL")
+        logger.warning("Scibox base URL не найден. Установите переменную окружения SCIBOX_BASE_URL")
         return None
 
     try:
-        print(f"Попытка подключения к Scibox: {SCIBOX_BASE_URL}")
+        logger.debug("Попытка подключения к Scibox: %s", SCIBOX_BASE_URL)
         client = OpenAI(api_key=SCIBOX_API_KEY, base_url=SCIBOX_BASE_URL)
 
         # Упрощенная проверка доступности API (без запроса списка моделей)
         # Просто создаем клиента - если параметры неверные, это вызовет исключение
-        print("Клиент Scibox успешно создан")
+        logger.info("Клиент Scibox успешно создан")
         return client
     except Exception as e:
-        print(f"Ошибка при создании Scibox клиента: {type(e).__name__}: {str(e)}")
+        logger.error("Ошибка при создании Scibox клиента: %s: %s", type(e).__name__, e)
         return None
 
+# ============================== ПРОМПТ-БЮДЖЕТ И УЧЁТ ВЫЗОВОВ LLM ===============
+_TOKEN_PIECE_RE = re.compile(r"\w+|[^\w\s]")                 # слова и отдельные знаки препинания
+
+def estimate_tokens(text_: str) -> int:
+    """Оценка числа токенов без токенизатора: латинские слова ~4 символа на токен,
+    кириллица ~3 символа на токен, каждый знак препинания — отдельный токен"""
+    total = 0
+    for piece in _TOKEN_PIECE_RE.findall(text_ or ""):
+        step = 4 if piece.isascii() else 3                    # кириллица режется BPE-токенайзерами мельче
+        total += -(-len(piece) // step)                       # деление с округлением вверх
+    return total
+
+class PromptBuilder:
+    """Сборка промпта под бюджет токенов. Обязательные фрагменты входят целиком,
+    списки добавляются поэлементно в порядке приоритета секций (элементы заранее
+    отсортированы по важности), текстовые секции обрезаются по остатку бюджета"""
+
+    def __init__(self, budget: int):
+        self.budget = budget                                  # лимит токенов на весь промпт
+        self._parts: List[Dict[str, Any]] = []                # фрагменты в порядке вывода
+        self.dropped: Dict[str, int] = {}                     # сколько элементов/символов выкинули по секциям
+        self.used_tokens = 0                                  # итоговая оценка размера промпта
+
+    def fixed(self, text_: str) -> "PromptBuilder":           # фрагмент, который нельзя сокращать
+        self._parts.append({"kind": "fixed", "text": text_})
+        return self
+
+    def items(self, name: str, template: str, items: List[str], priority: int, sep: str = ", ") -> "PromptBuilder":
+        self._parts.append({"kind": "items", "name": name, "template": template, "items": items, "priority": priority, "sep": sep})
+        return self
+
+    def text(self, name: str, template: str, body: str, priority: int) -> "PromptBuilder":
+        self._parts.append({"kind": "text", "name": name, "template": template, "body": body or "", "priority": priority})
+        return self
+
+    def build(self) -> str:
+        # Сначала считаем обязательную часть: фиксированные фрагменты и «пустые» шаблоны секций
+        used = sum(estimate_tokens(p["text"]) if p["kind"] == "fixed" else estimate_tokens(p["template"].format("—"))
+                   for p in self._parts)
+        rendered: Dict[int, str] = {}
+        for i, p in sorted(enumerate(self._parts), key=lambda x: x[1].get("priority", 0)):  # секции по приоритету
+            if p["kind"] == "fixed":
+                continue
+            if p["kind"] == "items":
+                taken: List[str] = []
+                for item in p["items"]:                       # берём элементы, пока влезают в бюджет
+                    cost = estimate_tokens(item + p["sep"])
+                    if used + cost > self.budget:
+                        break
+                    taken.append(item)
+                    used += cost
+                value = p["sep"].join(taken) or "—"
+                if len(taken) < len(p["items"]):              # помечаем, что список урезан
+                    self.dropped[p["name"]] = len(p["items"]) - len(taken)
+                    value += f" (и ещё {len(p['items']) - len(taken)})"
+            else:
+                body, left = p["body"], self.budget - used
+                while body and estimate_tokens(body) > left:  # режем текст с конца, пока не влезет
+                    body = body[:int(len(body) * 0.9)]
+                if len(body) < len(p["body"]):
+                    self.dropped[p["name"]] = len(p["body"]) - len(body)
+                used += estimate_tokens(body)
+                value = body or "—"
+            rendered[i] = p["template"].format(value)
+        self.used_tokens = used
+        return "".join(p["text"] if p["kind"] == "fixed" else rendered[i] for i, p in enumerate(self._parts))
+
+def record_llm_call(endpoint: str, prompt_tokens: int, completion_tokens: int, usage_source: str,
+                    latency_ms: float, status: str) -> None:  # пишем вызов в llm_calls отдельной сессией
+    db = SessionLocal()                                       # своя сессия: не вмешиваемся в транзакцию запроса
+    try:
+        db.add(LlmCall(endpoint=endpoint, model=SCIBOX_MODEL, prompt_tokens=prompt_tokens,
+                       completion_tokens=completion_tokens, usage_source=usage_source,
+                       latency_ms=latency_ms, status=status))
+        db.commit()
+    except Exception as e:                                    # учёт не должен ломать ответ пользователю
+        logger.warning("Не удалось записать вызов LLM: %s: %s", type(e).__name__, e)
+    finally:
+        db.close()
+
+def call_llm(client: OpenAI, endpoint: str, messages: List[Dict[str, str]], **params: Any) -> str:
+    """Вызов chat.completions с замером латентности и учётом токенов. Если сервер не вернул usage,
+    токены оцениваются estimate_tokens. Исключения пробрасываются вызывающему после записи в журнал"""
+    started = time.perf_counter()
+    prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+    completion_tokens, usage_source, status = 0, "estimate", "ok"
+    try:
+        resp = client.chat.completions.create(model=SCIBOX_MODEL, messages=messages, **params)
+        content = resp.choices[0].message.content or ""
+        usage = getattr(resp, "usage", None)
+        if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+            prompt_tokens, completion_tokens, usage_source = usage.prompt_tokens, usage.completion_tokens or 0, "api"
+        else:
+            completion_tokens = estimate_tokens(content)
+        return content
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        LLM_REQUESTS.inc(endpoint=endpoint, status=status)
+        LLM_LATENCY.observe(elapsed, endpoint=endpoint)
+        LLM_TOKENS.inc(prompt_tokens, endpoint=endpoint, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, endpoint=endpoint, kind="completion")
+        record_llm_call(endpoint, prompt_tokens, completion_tokens, usage_source, elapsed * 1000.0, status)
+
+def _percentile(sorted_values: List[float], q: float) -> float:  # перцентиль по отсортированному списку (nearest-rank)
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+@app.get("/llm/stats", response_model=Dict[str, Dict[str, Any]])  # агрегаты стоимости и латентности LLM по эндпоинтам
+def get_llm_stats(hours: int = Query(24, ge=1, le=24 * 90), db: Session = Depends(get_db)):
+    since = datetime.utcnow() - timedelta(hours=hours)        # окно статистики
+    rows = (db.query(LlmCall.endpoint, LlmCall.latency_ms, LlmCall.prompt_tokens, LlmCall.completion_tokens, LlmCall.status)
+            .filter(LlmCall.created_at >= since).all())
+    grouped: Dict[str, List[Any]] = {}
+    for r in rows:                                            # группируем вызовы по эндпоинту
+        grouped.setdefault(r.endpoint, []).append(r)
+    stats: Dict[str, Dict[str, Any]] = {}
+    for endpoint, items in grouped.items():
+        lat = sorted(r.latency_ms for r in items)
+        prompt_sum = sum(r.prompt_tokens for r in items)
+        completion_sum = sum(r.completion_tokens for r in items)
+        stats[endpoint] = {
+            "calls": len(items),
+            "errors": sum(1 for r in items if r.status != "ok"),
+            "prompt_tokens": prompt_sum,
+            "completion_tokens": completion_sum,
+            "avg_prompt_tokens": round(prompt_sum / len(items), 1),
+            "latency_ms_avg": round(sum(lat) / len(lat), 1),
+            "latency_ms_p50": round(_percentile(lat, 0.50), 1),
+            "latency_ms_p95": round(_percentile(lat, 0.95), 1),
+            "latency_ms_max": round(lat[-1], 1),
+        }
+    return stats
+
+# ============================== LLM-ШЛЮЗ ========================================
+PRIORITY_INTERACTIVE = 0                                      # чат консультанта: пользователь ждёт ответ
+PRIORITY_BACKGROUND = 1                                       # советы в кабинете и прочие фоновые запросы
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+class LLMQueueTimeout(Exception):                             # не дождались свободного слота к Scibox
+    pass
+
+class PrioritySemaphore:
+    """Семафор с приоритетами: свободный слот получает ожидающий с наименьшим
+    приоритетом, при равенстве — пришедший раньше (FIFO)"""
+
+    def __init__(self, limit: int):
+        self._limit = limit                                   # максимум одновременно выданных слотов
+        self._active = 0                                      # сколько слотов занято
+        self._waiting: List[Any] = []                         # куча (приоритет, порядковый номер)
+        self._seq = itertools.count()                         # порядковые номера для FIFO внутри приоритета
+        self._cond = threading.Condition()
+
+    def acquire(self, priority: int, timeout: Optional[float] = None) -> None:
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not (self._active < self._limit and self._waiting[0] == ticket):
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:            # таймаут: убираем себя из очереди
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise LLMQueueTimeout(f"LLM queue wait exceeded {timeout} s")
+                self._cond.wait(left)
+            heapq.heappop(self._waiting)
+            self._active += 1
+            self._cond.notify_all()                           # следующий в очереди может взять ещё свободный слот
+
+    def release(self) -> None:
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def queued(self) -> int:                                  # сколько запросов ждут слота
+        with self._cond:
+            return len(self._waiting)
+
+    def active(self) -> int:                                  # сколько запросов сейчас у Scibox
+        with self._cond:
+            return self._active
+
+class LLMGateway:
+    """Единая точка выхода к Scibox: ограничение параллелизма, приоритеты
+    (интерактивный чат обгоняет фоновые советы), метрики времени в очереди
+    и склейка одинаковых запросов, уже летящих к серверу, в один вызов"""
+
+    def __init__(self, max_concurrency: int, queue_timeout: float):
+        self._sem = PrioritySemaphore(max_concurrency)
+        self._queue_timeout = queue_timeout
+        self._client: Optional[OpenAI] = None                 # клиент создаётся один раз и переиспользуется
+        self._client_checked = False                          # «не настроен» тоже запоминаем: без повторов предупреждения
+        self._inflight: Dict[str, Future] = {}                # ключ запроса -> результат лидера
+        self._lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self._stats: Dict[str, Any] = {"upstream_calls": 0, "coalesced": 0, "errors": 0, "queue_timeouts": 0,
+                                       "queue": {name: {"requests": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+                                                 for name in PRIORITY_NAMES.values()}}
+
+    def client(self) -> Optional[OpenAI]:
+        with self._lock:
+            if not self._client_checked:
+                self._client, self._client_checked = scibox_client(), True
+            return self._client
+
+    def available(self) -> bool:                              # есть ли ключ/URL для Scibox
+        return self.client() is not None
+
+    @staticmethod
+    def _key(messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:  # одинаковые промпт+параметры -> один ключ
+        raw = json.dumps({"model": SCIBOX_MODEL, "messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def complete(self, endpoint: str, messages: List[Dict[str, str]], priority: int = PRIORITY_INTERACTIVE, **params: Any) -> str:
+        client = self.client()
+        if client is None:
+            raise RuntimeError("Scibox client is not configured")
+        key = self._key(messages, params)
+        with self._lock:                                      # либо становимся лидером, либо ждём чужой результат
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            return future.result()                            # исключение лидера пробросится и сюда
+        try:
+            started = time.perf_counter()
+            try:
+                self._sem.acquire(priority, timeout=self._queue_timeout)
+            except LLMQueueTimeout:
+                with self._lock:
+                    self._stats["queue_timeouts"] += 1
+                raise
+            waited_ms = (time.perf_counter() - started) * 1000.0
+            LLM_QUEUE_WAIT.observe(waited_ms / 1000.0, priority=PRIORITY_NAMES.get(priority, str(priority)))
+            with self._lock:                                  # метрики времени ожидания по классу приоритета
+                q = self._stats["queue"][PRIORITY_NAMES.get(priority, str(priority))]
+                q["requests"] += 1
+                q["wait_ms_total"] += waited_ms
+                q["wait_ms_max"] = max(q["wait_ms_max"], waited_ms)
+                self._stats["upstream_calls"] += 1
+            try:
+                result = call_llm(client, endpoint, messages, **params)
+            finally:
+                self._sem.release()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if not isinstance(e, LLMQueueTimeout):
+                with self._lock:
+                    self._stats["errors"] += 1
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:                        # снимок метрик шлюза
+        with self._lock:
+            snapshot = json.loads(json.dumps(self._stats))
+        for q in snapshot["queue"].values():
+            q["wait_ms_avg"] = round(q["wait_ms_total"] / q["requests"], 1) if q["requests"] else 0.0
+        snapshot.update({"max_concurrency": self.max_concurrency, "in_flight": self._sem.active(),
+                         "queued": self._sem.queued(), "coalescing_keys": len(self._inflight)})
+        return snapshot
+
+llm_gateway = LLMGateway(LLM_MAX_CONCURRENCY, LLM_QUEUE_TIMEOUT)  # общий шлюз процесса
+
+@app.get("/llm/gateway/stats", response_model=Dict[str, Any])  # состояние очереди и метрики LLM-шлюза
+def get_llm_gateway_stats() -> Dict[str, Any]:
+    return llm_gateway.stats()
+
+# ============================== СОБЫТИЯ ПОЛЬЗОВАТЕЛЯ (PUB/SUB) ==================
+USER_EVENTS_HEARTBEAT = float(os.getenv("USER_EVENTS_HEARTBEAT", "15"))          # пинг в SSE-потоке, чтобы прокси не рвали соединение (сек)
+USER_EVENTS_QUEUE = int(os.getenv("USER_EVENTS_QUEUE", "100"))                   # буфер событий на подписчика (медленный теряет старые)
+
+class UserEventBus:
+    """Внутрипроцессный pub/sub событий пользователя ('achievement', 'xp').
+    Подписчик — asyncio-очередь SSE-запроса; публиковать можно из любого потока (обработчики, фоновый воркер)"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._subs: Dict[int, set] = {}                       # user_id -> {(event loop, очередь)}
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:      # вызывать из корутины (нужен текущий event loop)
+        q: asyncio.Queue = asyncio.Queue(maxsize=USER_EVENTS_QUEUE)
+        with self._lock:
+            self._subs.setdefault(user_id, set()).add((asyncio.get_running_loop(), q))
+        return q
+
+    def unsubscribe(self, user_id: int, q: asyncio.Queue) -> None:
+        with self._lock:
+            subs = self._subs.get(user_id, set())
+            subs.difference_update({s for s in subs if s[1] is q})
+            if not subs:
+                self._subs.pop(user_id, None)
+
+    def publish(self, user_id: int, event: Dict[str, Any]) -> None:
+        with self._lock:
+            subs = list(self._subs.get(user_id, ()))
+        for loop, q in subs:
+            loop.call_soon_threadsafe(self._offer, q, event)  # очередь asyncio трогаем только из её цикла
+
+    @staticmethod
+    def _offer(q: asyncio.Queue, event: Dict[str, Any]) -> None:
+        if q.full():                                          # подписчик не успевает — выкидываем самое старое
+            q.get_nowait()
+        q.put_nowait(event)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"users": len(self._subs), "subscribers": sum(len(s) for s in self._subs.values())}
+
+user_events = UserEventBus()                                  # шина процесса
+
+def emit_user_event(db: Session, user_id: int, kind: str, **data: Any) -> None:  # событие уйдёт подписчикам после коммита db
+    db.info.setdefault("user_events", []).append((user_id, {"type": kind, **data}))
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish_user_events(session: Session) -> None:
+    if session.in_nested_transaction():                       # savepoint — ждём внешний коммит
+        return
+    for user_id, ev in session.info.pop("user_events", []):
+        user_events.publish(user_id, ev)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_user_events(session: Session) -> None:              # откат: ничего не произошло
+    if not session.in_nested_transaction():
+        session.info.pop("user_events", None)
+
+# ============================== ФОНОВЫЕ ЗАДАЧИ ==================================
+JOB_HANDLERS: Dict[str, Callable[[Session, Dict[str, Any]], Optional[Dict[str, Any]]]] = {}  # тип задачи -> обработчик
+JOB_SCHEDULES: List[Dict[str, Any]] = []                     # периодические действия воркера
+
+def job_handler(kind: str):                                   # декоратор регистрации обработчика задачи
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return register
+
+def scheduled(every_seconds: float):                          # декоратор периодического действия (fn(db) -> None)
+    def register(fn):
+        JOB_SCHEDULES.append({"fn": fn, "every": every_seconds, "next_at": 0.0})
+        return fn
+    return register
+
+def enqueue_job(db: Session, kind: str, payload: Dict[str, Any], dedup_key: Optional[str] = None) -> BackgroundJob:
+    """Ставит задачу в очередь. Если активная задача с тем же dedup_key уже есть — возвращает её"""
+    if dedup_key:
+        existing = (db.query(BackgroundJob)
+                    .filter(BackgroundJob.dedup_key == dedup_key, BackgroundJob.status.in_(("queued", "running")))
+                    .first())
+        if existing:
+            return existing
+    job = BackgroundJob(kind=kind, dedup_key=dedup_key, payload=json.dumps(payload, ensure_ascii=False, default=str))
+    db.add(job)
+    db.flush()                                                # нужен id задачи до коммита вызывающего
+    job_runner.wake()                                         # будим воркер, чтобы не ждать интервала опроса
+    return job
+
+class JobRunner:
+    """Фоновый воркер в отдельном потоке: забирает задачи из background_jobs,
+    выполняет обработчики из JOB_HANDLERS и крутит периодические действия JOB_SCHEDULES"""
+
+    def __init__(self, poll_interval: float):
+        self._poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self.recover()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+        self._thread.start()
+
+    def recover(self) -> None:                                # задачи, прерванные падением процесса, возвращаем в очередь
+        db = SessionLocal()
+        try:
+            db.query(BackgroundJob).filter(BackgroundJob.status == "running").update({"status": "queued"})
+            db.commit()
+        finally:
+            db.close()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._run_schedules()
+                while not self._stop.is_set() and self.run_next():  # выгребаем всё готовое
+                    pass
+            except Exception as e:                            # воркер не должен умирать из-за одной ошибки
+                logger.exception("Ошибка фонового воркера: %s: %s", type(e).__name__, e)
+            self._wake.wait(self._poll_interval)
+            self._wake.clear()
+
+    def _run_schedules(self) -> None:
+        now = time.monotonic()
+        for sch in JOB_SCHEDULES:
+            if now < sch["next_at"]:
+                continue
+            sch["next_at"] = now + sch["every"]
+            db = SessionLocal()
+            try:
+                sch["fn"](db)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.exception("Ошибка периодической задачи %s: %s: %s", sch["fn"].__name__, type(e).__name__, e)
+            finally:
+                db.close()
+
+    def run_next(self) -> bool:                               # выполнить одну готовую задачу; False — очередь пуста
+        return self._run_one(None)
+
+    def run_job(self, job_id: int) -> bool:                   # выполнить только эту задачу (CLI); False — она не в очереди
+        return self._run_one(job_id)
+
+    def _run_one(self, job_id: Optional[int]) -> bool:
+        db = SessionLocal()
+        try:
+            q = db.query(BackgroundJob).filter(BackgroundJob.status == "queued", BackgroundJob.run_after <= datetime.utcnow())
+            if job_id is not None:
+                q = q.filter(BackgroundJob.id == job_id)
+            job = q.order_by(BackgroundJob.id).first()
+            if job is None:
+                return False
+            claimed = (db.query(BackgroundJob)                # атомарно «забираем» задачу
+                       .filter(BackgroundJob.id == job.id, BackgroundJob.status == "queued")
+                       .update({"status": "running", "attempts": BackgroundJob.attempts + 1}))
+            db.commit()
+            if not claimed:
+                return job_id is None                         # конкретную задачу забрал другой воркер
+            db.refresh(job)
+            handler = JOB_HANDLERS.get(job.kind)
+            try:
+                if handler is None:
+                    raise RuntimeError(f"Unknown job kind: {job.kind}")
+                result = handler(db, {**json.loads(job.payload or "{}"), "_job_id": job.id})  # id — для сохранения прогресса
+                job.status, job.last_error = "done", None
+                job.result = json.dumps(result, ensure_ascii=False, default=str) if result is not None else None
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                job = db.get(BackgroundJob, job.id)
+                job.last_error = f"{type(e).__name__}: {e}"
+                if job.attempts >= JOB_MAX_ATTEMPTS:          # попытки кончились
+                    job.status = "failed"
+                else:                                         # повтор с экспоненциальной задержкой
+                    job.status = "queued"
+                    job.run_after = datetime.utcnow() + timedelta(seconds=30 * 2 ** (job.attempts - 1))
+                db.commit()
+                logger.warning("Задача %s (%s) упала: %s", job.id, job.kind, job.last_error,
+                               extra={"fields": {"job_id": job.id, "kind": job.kind, "attempts": job.attempts, "status": job.status}})
+            return True
+        finally:
+            db.close()
+
+job_runner = JobRunner(JOB_POLL_INTERVAL)                     # воркер процесса
+
+@app.on_event("startup")
+def _start_job_runner() -> None:                              # воркер стартует вместе с API
+    if JOBS_ENABLED:
+        job_runner.start()
+
+@app.on_event("shutdown")
+def _stop_job_runner() -> None:
+    job_runner.stop()
+
+class JobPublic(BaseModel):                                   # состояние фоновой задачи
+    id: int
+    kind: str
+    status: str
+    attempts: int
+    result: Optional[Any]
+    progress: Optional[Any]
+    last_error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+
+def job_public(job: BackgroundJob) -> JobPublic:
+    return JobPublic(id=job.id, kind=job.kind, status=job.status, attempts=job.attempts,
+                     result=json.loads(job.result) if job.result else None,
+                     progress=json.loads(job.progress) if job.progress else None, last_error=job.last_error,
+                     created_at=job.created_at, updated_at=job.updated_at)
+
+def load_job_progress(db: Session, job_id: Optional[int]) -> Dict[str, Any]:  # сохранённый прогресс задачи (или пусто)
+    job = db.get(BackgroundJob, job_id) if job_id else None
+    return json.loads(job.progress) if job is not None and job.progress else {}
+
+def save_job_progress(db: Session, job_id: Optional[int], progress: Dict[str, Any]) -> None:  # пишется в той же транзакции, что и результат шага
+    if job_id:
+        db.query(BackgroundJob).filter(BackgroundJob.id == job_id).update({"progress": json.dumps(progress, ensure_ascii=False)})
+
+@app.get("/admin/jobs/{job_id}", response_model=JobPublic)  # статус фоновой задачи
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(BackgroundJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_public(job)
+
 # ============================== Pydantic-СХЕМЫ (CRUD) ==========================
 class SkillIn(BaseModel):                                    # входная схема «Навык»
     name: str = Field(..., description="Название навыка")    # название навыка (обязательно)
     level: Optional[str] = Field(None, description="Уровень владения")  # уровень (опционально)
+    class Config:                                            # конфигурация pydantic-модели
+        from_attributes = True                               # в UserPublic.skills строится из ORM-объектов Skill
 
 class ProjectIn(BaseModel):                                  # входная схема «Проект»
     title: str                                               # название проекта (обязательно)
@@ -292,6 +1611,8 @@ class UserPublic(BaseModel):                                 # публична
     experience_years: float                                  # стаж
     resume_text: Optional[str]                               # резюме
     profile_photo_url: Optional[str]                         # фото
+    skills: List[SkillIn] = []                               # навыки (каноническое написание)
+    version: int = 1                                         # версия профиля — то же, что ETag (для If-Match)
     class Config:                                            # конфигурация pydantic-модели
         from_attributes = True                               # разрешаем строить из ORM-объектов напрямую
 
@@ -302,19 +1623,70 @@ class AchievementPublic(BaseModel):                          # схема «Ач
     xp: int                                                  # очки XP
     obtained_at: datetime                                    # дата получения
 
-class DashboardResponse(BaseModel):                          # схема ответа «Личный кабинет»
-    user: UserPublic                                         # данные пользователя
-    progress_percent: float                                  # процент заполнения профиля
-    total_xp: int                                            # суммарный XP (включая стрик)
-    achievements: List[AchievementPublic]                    # список ачивок пользователя
-    recommended_achievements: List[str]                      # рекомендации по закрытию следующих ачивок
-    llm_tips: Optional[str]                                  # советы ИИ (если был вызов Scibox)
+class DashboardResponse(BaseModel):                          # схема ответа «Личный кабинет» (с ?fields= — только выбранные поля)
+    user: Optional[UserPublic] = None                        # данные пользователя
+    progress_percent: Optional[float] = None                 # процент заполнения профиля
+    total_xp: Optional[int] = None                           # суммарный XP (включая стрик)
+    achievements: Optional[List[AchievementPublic]] = None   # список ачивок пользователя
+    recent_achievements: Optional[List[AchievementPublic]] = None  # последние ачивки (только по запросу, см. limit)
+    recommended_achievements: Optional[List[str]] = None     # рекомендации по закрытию следующих ачивок
+    llm_tips: Optional[str] = None                           # советы ИИ (если был вызов Scibox)
+
+DASHBOARD_DEFAULT_FIELDS = ("user", "progress_percent", "total_xp", "achievements", "recommended_achievements", "llm_tips")  # ответ без ?fields=
+
+# ============================== БЫСТРАЯ СЕРИАЛИЗАЦИЯ (FAST_JSON) ===============
+# В режиме FAST_JSON горячие эндпоинты (/users/{id}, кабинет, каталог) собирают ответ словарями прямо из строк БД
+# и сериализуют одним вызовом (orjson, если установлен, иначе TypeAdapter pydantic-core) — без построения моделей.
+_any_json = TypeAdapter(Any)                                  # запасной сериализатор, если orjson не установлен
+USER_PUBLIC_COLUMNS = tuple(getattr(User, f) for f in UserPublic.model_fields if f != "skills")  # колонки проекции UserPublic
+
+def json_bytes(obj: Any) -> bytes:                            # dict/list/datetime -> JSON (формат дат как у pydantic)
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return _any_json.dump_json(obj)
+
+def json_response(obj: Any) -> Response:                     # уже сериализованный ответ: FastAPI не валидирует его повторно
+    return Response(content=json_bytes(obj), media_type="application/json")
+
+def user_public_row(db: Session, user_id: int) -> Optional[Dict[str, Any]]:  # UserPublic двумя узкими запросами, без ORM-объектов
+    row = db.query(*USER_PUBLIC_COLUMNS).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    out = dict(row._mapping)
+    out["skills"] = [{"name": n, "level": lvl} for n, lvl in db.query(Skill.name, Skill.level).filter(Skill.user_id == user_id).order_by(Skill.id)]
+    return out
+
+def user_public_dict(user: User) -> Dict[str, Any]:          # UserPublic из уже загруженного пользователя
+    out = {c.key: getattr(user, c.key) for c in USER_PUBLIC_COLUMNS}
+    out["skills"] = [{"name": sk.name, "level": sk.level} for sk in user.skills]
+    return out
+
+def achievement_dict(a: UserAchievement) -> Dict[str, Any]:  # AchievementPublic без модели
+    return {"code": a.code, "title": ACHIEVEMENTS_CATALOG.get(a.code, {}).get("title", a.code),
+            "level": a.level, "xp": a.xp, "obtained_at": a.obtained_at}
 
 # ============================== CRUD-ХЕЛПЕРЫ ДЛЯ СВЯЗАННЫХ ТАБЛИЦ =============
+def skill_levels(user: User) -> Dict[Any, str]:          # текущие уровни: skill_id (вне таксономии — ключ) -> уровень
+    return {sk.skill_id if sk.skill_id is not None else normalize_skill_key(sk.name): sk.level or "" for sk in user.skills}
+
 def upsert_skills(db: Session, user: User, skills_in: List[SkillIn]) -> None:  # перезапись набора навыков
+    levels = skill_levels(user)                           # level=None — уровень не передан (форма шлёт одни названия): оставляем прежний
     user.skills.clear()                                   # удаляем текущие навыки пользователя
+    signals = [sig for sig in map(parse_skill_marker, (s.name for s in skills_in)) if sig]  # 'lang:EN=B2', 'mentor_sessions:5', ... -> типизированные сигналы
+    if signals:                                           # сигналы перезаписываем, только если клиент прислал маркеры
+        user.signals.clear()                              # (форма резюме шлёт одни навыки и не должна стирать языки/менторство)
+        user.signals.extend(ProfileSignal(**sig) for sig in signals)
+    seen: set = set()                                     # 'python3' и 'Python' — один и тот же навык
     for s in skills_in:                                   # пробегаем входные навыки
-        user.skills.append(Skill(name=s.name.strip(), level=(s.level or "").strip()))  # добавляем ORM-объект Skill
+        if parse_skill_marker(s.name) or not normalize_skill_key(s.name):
+            continue
+        sid = skill_taxonomy.lookup(s.name)               # канонический id; неизвестный навык — без id, как ввели
+        ident = sid if sid is not None else normalize_skill_key(s.name)
+        if ident in seen:
+            continue
+        seen.add(ident)
+        user.skills.append(Skill(name=skill_taxonomy.name(sid) if sid is not None else s.name.strip(),  # добавляем ORM-объект Skill
+                                 skill_id=sid, level=s.level.strip() if s.level is not None else levels.get(ident, "")))
 
 def upsert_projects(db: Session, user: User, projects_in: List[ProjectIn]) -> None:  # перезапись проектов
     user.projects.clear()                                 # удаляем текущие проекты
@@ -335,80 +1707,165 @@ def upsert_certificates(db: Session, user: User, certs_in: List[CertificateIn])
             valid_until=c.valid_until                    # срок действия (дата или None)
         ))
 
+def record_endorsements(db: Session, from_team: str, items: List[tuple]) -> Dict[str, int]:  # [(user_id, навык)] -> сколько засчитано/отброшено
+    """Пишет эндорсменты и сразу обновляет счётчики (по skill_id: синонимы — один навык). Повтор того же
+    навыка от той же команды в пределах ENDORSEMENT_DEDUP_HOURS не засчитывается (и внутри одной пачки тоже).
+    Окно захватывается условным upsert'ом по уникальному ключу — параллельные запросы не проскочат оба"""
+    now = datetime.utcnow()
+    team = (from_team or "").strip()
+    stmt = sqlite_insert(EndorsementWindow)
+    claim = stmt.on_conflict_do_update(                       # новое окно или истёкшее старое; живое окно — 0 строк
+        index_elements=["user_id", "from_team", "skill_key"],
+        set_={"window_until": stmt.excluded.window_until}, where=EndorsementWindow.window_until <= now)
+    conn = db.connection()
+    increments: Dict[tuple, Dict[str, Any]] = {}
+    for uid, name in items:
+        name = name.strip()
+        sid, key, canon = endorsement_skill(name)
+        if not key or not conn.execute(claim, {"user_id": uid, "from_team": team, "skill_key": key,
+                                               "window_until": now + timedelta(hours=ENDORSEMENT_DEDUP_HOURS)}).rowcount:
+            continue
+        db.add(Endorsement(user_id=uid, skill_name=name, from_team=team, endorsed_at=now))
+        increments[(uid, key)] = {"user_id": uid, "skill_id": sid, "skill_key": key, "skill_name": canon, "count": 1,
+                                  "last_endorsed_at": now}
+    if increments:                                        # счётчики — одним upsert'ом на всю пачку
+        stmt = sqlite_insert(EndorsementCounter)
+        db.connection().execute(stmt.on_conflict_do_update(
+            index_elements=["user_id", "skill_key"],
+            set_={"count": EndorsementCounter.count + 1, "last_endorsed_at": stmt.excluded.last_endorsed_at},
+        ), list(increments.values()))
+    return {"added": len(increments), "duplicates": len(items) - len(increments)}
+
+# ============================== ПРАВИЛА АЧИВОК (ДЕКЛАРАТИВНО) =================
+# Каждое правило: метрика профиля (считается collect_profile_metrics) + вид порога.
+#   threshold — числовые пороги из "thresholds", метка уровня по шаблону label;
+#   fraction  — уровни ("имя", xp, порог доли) из "levels", requires — доп. булева метрика для уровня;
+#   set       — уровни ("метка", xp) из "levels", выдаются метки, присутствующие в множестве-метрике.
+ACHIEVEMENT_RULES: Dict[str, Dict[str, Any]] = {
+    "profile_master": {"metric": "profile_fill", "kind": "fraction", "requires": {"платина": "profile_complete"}},
+    "skill_map": {"metric": "skills", "kind": "threshold", "label": "{t}+"},
+    "endorsed_skills": {"metric": "endorsements", "kind": "threshold", "label": "{t}+"},
+    "certified": {"metric": "certificates", "kind": "threshold", "label": "{t}+"},
+    "project_impact": {"metric": "projects_with_kpi", "kind": "threshold", "label": "{t}+"},
+    "project_portfolio": {"metric": "projects", "kind": "threshold", "label": "{t}+"},
+    "soft_endorse": {"metric": "soft_endorsements", "kind": "threshold", "label": "{t}+"},
+    "language_readiness": {"metric": "language_levels", "kind": "set"},
+    "availability": {"metric": "availability_months", "kind": "threshold", "label": "{t}m+"},
+    "mentor": {"metric": "mentor_sessions", "kind": "threshold", "label": "{t}+"},
+    "compliance": {"metric": "compliance_steps", "kind": "threshold", "label": "step{t}"},
+}
+
+class CompiledRule:
+    """Правило ачивки, развёрнутое из каталога: отсортированные пороги для bisect и метки уровней"""
+
+    def __init__(self, code: str, meta: Dict[str, Any], rule: Dict[str, Any]):
+        self.code = code                                      # код ачивки
+        self.metric = rule["metric"]                          # имя метрики профиля
+        self.kind = rule["kind"]                              # вид порога
+        self.requires: Dict[str, str] = rule.get("requires", {})  # уровень -> булева метрика-условие
+        if self.kind == "threshold":                          # пороги по возрастанию + метки/XP в том же порядке
+            pairs = sorted((t, xp) for t, xp in meta["thresholds"])
+            self.thresholds = [t for t, _ in pairs]
+            self.levels = [(rule["label"].format(t=t), xp) for t, xp in pairs]
+        elif self.kind == "fraction":
+            triples = sorted(meta["levels"], key=lambda lv: lv[2])
+            self.thresholds = [lv[2] for lv in triples]
+            self.levels = [(lv[0], lv[1]) for lv in triples]
+        else:                                                 # set: порогов нет, только метки
+            self.thresholds = []
+            self.levels = [(lv[0], lv[1]) for lv in meta["levels"]]
+        self.xp_by_label = dict(self.levels)
+        absolute = meta.get("absolute")                       # «абсолютный» уровень — пока только для витрины
+        self.labels = self.levels + ([(absolute[0], absolute[1])] if absolute else [])
+
+    def evaluate(self, metrics: Dict[str, Any]) -> List[tuple]:  # [(метка, xp)] заработанных уровней
+        value = metrics.get(self.metric)
+        if self.kind == "set":
+            return [(lbl, self.xp_by_label[lbl]) for lbl in sorted(value or ()) if lbl in self.xp_by_label]
+        earned = self.levels[:bisect_right(self.thresholds, value or 0)]  # все пороги <= значения
+        if self.requires:
+            earned = [(lbl, xp) for lbl, xp in earned if lbl not in self.requires or metrics.get(self.requires[lbl])]
+        return earned
+
+def compile_achievement_rules(catalog: Dict[str, Dict[str, Any]], rules: Dict[str, Dict[str, Any]]) -> List[CompiledRule]:
+    return [CompiledRule(code, catalog[code], rules[code]) for code in catalog if code in rules]
+
+COMPILED_ACHIEVEMENTS = compile_achievement_rules(ACHIEVEMENTS_CATALOG, ACHIEVEMENT_RULES)  # компилируем один раз при импорте
+
+def evaluate_achievements(metrics: Dict[str, Any]) -> List[tuple]:  # [(code, метка, xp)] по готовым метрикам
+    return [(r.code, lbl, xp) for r in COMPILED_ACHIEVEMENTS for lbl, xp in r.evaluate(metrics)]
+
+def achievements_catalog_with_labels() -> Dict[str, Dict[str, Any]]:  # каталог + метки уровней для фронта
+    labels = {r.code: [[lbl, xp] for lbl, xp in r.labels] for r in COMPILED_ACHIEVEMENTS}
+    return {code: {**meta, "level_labels": labels.get(code, [])} for code, meta in ACHIEVEMENTS_CATALOG.items()}
+
+ACHIEVEMENTS_CATALOG_WITH_LABELS = achievements_catalog_with_labels()  # каталог статичен — собираем ответ один раз
+
 # ============================== ВЫДАЧА АЧИВОК И ПРОГРЕСС ======================
-def _issue(db: Session, user: User, code: str, level: str, xp: int) -> None:   # вспомогательная выдача ачивки
-    exists = db.query(UserAchievement).filter_by(user_id=user.id, code=code, level=level).first()  # ищем дубликат
-    if exists:                                              # если уже есть
-        return                                              # ничего не делаем
-    db.add(UserAchievement(user_id=user.id, code=code, level=level, xp=xp))  # создаём новую запись ачивки
+def certificate_active(valid_until: Optional[date], today: date) -> bool:  # без срока или срок ещё не истёк
+    return valid_until is None or valid_until >= today
+
+def active_certificate_filter(today: date):                   # то же условие для SQL
+    return or_(Certificate.valid_until.is_(None), Certificate.valid_until >= today)
+
+def active_certificates_count(user: User) -> int:
+    """Действующие сертификаты пользователя. Если коллекция уже загружена (например, только что перезаписана) —
+    считаем по ней, иначе COUNT по индексу (user_id, valid_until) без загрузки строк"""
+    today = date.today()
+    state = inspect(user)
+    if state.session is None or user.id is None or "certificates" not in state.unloaded:
+        return sum(1 for c in user.certificates if certificate_active(c.valid_until, today))
+    return state.session.query(func.count(Certificate.id)).filter(
+        Certificate.user_id == user.id, active_certificate_filter(today)).scalar() or 0
+
+def collect_profile_metrics(user: User) -> Dict[str, Any]:
+    """Все метрики правил за один проход по коллекциям пользователя"""
+    m: Dict[str, Any] = {
+        "profile_fill": mandatory_profile_fields_filled(user),
+        "profile_complete": bool(user.profile_photo_url) and bool(user.resume_text),  # фото и резюме (условие платины)
+        "skills": 0, "language_levels": set(), "availability_months": 0, "mentor_sessions": 0, "compliance_steps": 0,
+        "endorsements": 0, "soft_endorsements": 0, "projects": 0, "projects_with_kpi": 0, "certificates": 0,
+    }
+    m["skills"] = len(user.skills)                            # только настоящие навыки, без сигналов
+    for sig in user.signals:                                  # типизированные сигналы профиля
+        if sig.kind == "language":
+            m["language_levels"].add(sig.level)
+        elif sig.kind == "availability":
+            m["availability_months"] += 1
+        elif sig.kind == "mentor_sessions":
+            m["mentor_sessions"] += sig.value
+        elif sig.kind == "compliance_step":
+            m["compliance_steps"] += 1
+    for c in user.endorsement_counters:                       # эндорсменты и soft-эндорсменты — по счётчикам
+        m["endorsements"] += c.count
+        if c.skill_key.startswith("soft:"):
+            m["soft_endorsements"] += c.count
+    for p in user.projects:                                   # проекты и проекты с KPI
+        m["projects"] += 1
+        if p.result_kpi:
+            m["projects_with_kpi"] += 1
+    m["certificates"] = active_certificates_count(user)      # просроченные сертификаты не засчитываются
+    return m
+
+def issue_achievements(db: Session, user_id: int, earned: List[tuple]) -> List[tuple]:  # выдаём недостающие уровни одним запросом на проверку
+    have = {(c, lvl) for c, lvl in db.query(UserAchievement.code, UserAchievement.level).filter_by(user_id=user_id)}
+    new = [(c, lvl, xp) for c, lvl, xp in earned if (c, lvl) not in have]
+    now = datetime.utcnow()
+    for code, level, xp in new:
+        db.add(UserAchievement(user_id=user_id, code=code, level=level, xp=xp, obtained_at=now))  # создаём новую запись ачивки
+        emit_user_event(db, user_id, "achievement", code=code, title=ACHIEVEMENTS_CATALOG.get(code, {}).get("title", code),
+                        level=level, xp=xp, obtained_at=now.isoformat())
+    if new:
+        db.flush()                                            # чтобы новые уровни попали в сумму XP
+        emit_user_event(db, user_id, "xp", total_xp=total_xp_of(db, user_id))
+    return new
+
+def total_xp_of(db: Session, user_id: int) -> int:            # XP ачивок + XP стрика без загрузки коллекций
+    xp = db.query(func.coalesce(func.sum(UserAchievement.xp), 0)).filter(UserAchievement.user_id == user_id).scalar()
+    return int(xp) + streak_state(db, user_id)["xp"]
 
 def calculate_and_issue_achievements(db: Session, user: User) -> int:          # основной расчёт ачивок и XP
-    fill = mandatory_profile_fields_filled(user)            # доля заполненности ключевых полей
-    for level_name, xp, threshold in ACHIEVEMENTS_CATALOG["profile_master"]["levels"]:  # обходим уровни «Мастер профиля»
-        ok = fill >= threshold                              # выполняется ли порог по заполненности
-        if level_name == "платина":                         # для платины требуем фото и резюме
-            ok = ok and (bool(user.profile_photo_url) and bool(user.resume_text))  # оба поля должны быть заданы
-        if ok:                                              # если условие выполнено
-            _issue(db, user, "profile_master", level_name, xp)  # выдаём ачивку соответствующего уровня
-
-    sc = len(user.skills)                                   # количество навыков
-    for t, xp in ACHIEVEMENTS_CATALOG["skill_map"]["thresholds"]:  # пороги «Навыковой карты»
-        if sc >= t:                                         # если выполняем порог
-            _issue(db, user, "skill_map", f"{t}+", xp)      # выдаём уровень по порогу
-
-    ec = len(user.endorsements)                             # количество эндорсментов
-    for t, xp in ACHIEVEMENTS_CATALOG["endorsed_skills"]["thresholds"]:  # пороги «Подтверждённых навыков»
-        if ec >= t:                                         # проверяем порог
-            _issue(db, user, "endorsed_skills", f"{t}+", xp)  # выдаём ачивку
-
-    cc = len(user.certificates)                             # количество сертификатов
-    for t, xp in ACHIEVEMENTS_CATALOG["certified"]["thresholds"]:  # пороги «Сертифицированного специалиста»
-        if cc >= t:                                         # проверяем порог
-            _issue(db, user, "certified", f"{t}+", xp)      # выдаём ачивку
-
-    proj_with_kpi = sum(1 for p in user.projects if p.result_kpi)  # проекты с заполненным KPI
-    for t, xp in ACHIEVEMENTS_CATALOG["project_impact"]["thresholds"]:  # пороги «Проект с результатом»
-        if proj_with_kpi >= t:                               # проверяем порог
-            _issue(db, user, "project_impact", f"{t}+", xp)  # выдаём ачивку
-
-    proj_total = len(user.projects)                          # общее число проектов
-    for t, xp in ACHIEVEMENTS_CATALOG["project_portfolio"]["thresholds"]:  # пороги «Портфеля проектов»
-        if proj_total >= t:                                  # выполняем порог
-            _issue(db, user, "project_portfolio", f"{t}+", xp)  # выдаём ачивку
-
-    soft_count = sum(1 for e in user.endorsements if e.skill_name.lower().startswith("soft:"))  # soft-эндорсменты
-    for t, xp in ACHIEVEMENTS_CATALOG["soft_endorse"]["thresholds"]:  # пороги «Софт-скиллы подтверждены»
-        if soft_count >= t:                                   # проверка порога
-            _issue(db, user, "soft_endorse", f"{t}+", xp)     # выдача
-
-    for sk in user.skills:                                   # просмотр навыков
-        if sk.name.lower().startswith("lang:"):              # языковой маркер "lang:XX=Level"
-            lvl = sk.name.split(":", 1)[1].split("=")[-1].upper()  # извлекаем уровень справа от "="
-            x = language_level_to_xp(lvl)                    # переводим уровень в XP
-            if x > 0:                                        # если уровень распознан
-                _issue(db, user, "language_readiness", lvl, x)  # выдаём ачивку языка
-
-    avail_months = sum(1 for sk in user.skills if sk.name.lower().startswith("availability:"))  # месяцы доступности
-    for t, xp in ACHIEVEMENTS_CATALOG["availability"]["thresholds"]:  # пороги «Доступен для проектов»
-        if avail_months >= t:                               # проверка порога
-            _issue(db, user, "availability", f"{t}m+", xp) # выдача
-
-    mentor_sessions = 0                                     # счётчик менторских сессий
-    for sk in user.skills:                                  # проходим навыки
-        if sk.name.lower().startswith("mentor_sessions:"):  # формат "mentor_sessions:N"
-            try:                                            # пытаемся распарсить N
-                mentor_sessions += int(sk.name.split(":")[1])  # суммируем значение
-            except Exception:                                # если формат кривой
-                pass                                        # просто пропускаем
-    for t, xp in ACHIEVEMENTS_CATALOG["mentor"]["thresholds"]:  # пороги «Наставник»
-        if mentor_sessions >= t:                             # проверяем порог
-            _issue(db, user, "mentor", f"{t}+", xp)          # выдаём уровень
-
-    compliance_steps = sum(1 for sk in user.skills if sk.name.lower().startswith("compliance:step"))  # шаги комплаенса
-    for t, xp in ACHIEVEMENTS_CATALOG["compliance"]["thresholds"]:  # пороги «Комплаенс без сюрпризов»
-        if compliance_steps >= t:                             # проверяем порог
-            _issue(db, user, "compliance", f"step{t}", xp)    # выдаём ачивку
-
+    issue_achievements(db, user.id, evaluate_achievements(collect_profile_metrics(user)))  # метрики -> уровни -> выдача
     total_xp = sum(a.xp for a in user.achievements)          # суммируем XP из всех выданных ачивок
     streak = compute_weekly_streak([m.done_on for m in user.microsteps])  # считаем метрики стрика
     total_xp += xp_from_streak(streak)                        # добавляем XP за стрик
@@ -419,18 +1876,258 @@ def profile_progress_percent(u: User) -> float:              # функция п
     bonus = (0.05 if u.profile_photo_url else 0.0) + (0.10 if u.resume_text else 0.0)  # бонусы за фото/резюме
     return round(min(100.0, (fill * 100.0) + (bonus * 100.0)), 2)  # итоговый процент с ограничением 100% и округлением
 
-def recommend_achievements(u: User) -> List[str]:            # простые рекомендации по ачивкам
+def recommend_from_counts(fill: float, skills_count: int, kpi_projects: int, certificates_count: int) -> List[str]:  # рекомендации по готовым счётчикам
     recs: List[str] = []                                     # инициализируем список
-    if mandatory_profile_fields_filled(u) < 0.8:             # если заполненность <80%
+    if fill < 0.8:                                           # если заполненность <80%
         recs.append("profile_master")                        # совет закрыть «Мастер профиля»
-    if len(u.skills) < 10:                                   # мало навыков
+    if skills_count < 10:                                    # мало навыков
         recs.append("skill_map")                             # совет расширить «Навыковую карту»
-    if not any(p.result_kpi for p in u.projects):            # нет KPI в проектах
+    if kpi_projects == 0:                                    # нет KPI в проектах
         recs.append("project_impact")                        # совет оформить результаты
-    if len(u.certificates) == 0:                             # нет сертификатов
+    if certificates_count == 0:                              # нет сертификатов
         recs.append("certified")                             # совет получить сертификат
     return recs                                              # возвращаем список кодов
 
+def recommend_achievements(u: User) -> List[str]:            # простые рекомендации по ачивкам
+    return recommend_from_counts(                            # считаем счётчики по коллекциям пользователя
+        mandatory_profile_fields_filled(u), len(u.skills),
+        sum(1 for p in u.projects if p.result_kpi), active_certificates_count(u)
+    )
+
+# ============================== ПАКЕТНЫЙ ПЕРЕСЧЁТ АЧИВОК =======================
+def collect_metrics_bulk(db: Session, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Те же метрики, что collect_profile_metrics, но для пачки пользователей агрегатными запросами
+    (по одному на таблицу; сигналы — по индексу (user_id, kind))"""
+    metrics: Dict[int, Dict[str, Any]] = {}
+    for u in db.query(User).filter(User.id.in_(user_ids)):   # поля профиля — только колонки users
+        metrics[u.id] = {
+            "profile_fill": mandatory_profile_fields_filled(u),
+            "profile_complete": bool(u.profile_photo_url) and bool(u.resume_text),
+            "skills": 0, "language_levels": set(), "availability_months": 0, "mentor_sessions": 0, "compliance_steps": 0,
+            "endorsements": 0, "soft_endorsements": 0, "projects": 0, "projects_with_kpi": 0, "certificates": 0,
+        }
+    for uid, total in (db.query(Skill.user_id, func.count(Skill.id))
+                       .filter(Skill.user_id.in_(user_ids)).group_by(Skill.user_id)):
+        metrics[uid]["skills"] = total
+    of_kind = lambda kind, expr: func.sum(case((ProfileSignal.kind == kind, expr), else_=0))  # условная сумма по виду сигнала
+    for uid, avail, mentor, compl in (db.query(ProfileSignal.user_id, of_kind("availability", 1),
+                                               of_kind("mentor_sessions", ProfileSignal.value), of_kind("compliance_step", 1))
+                                      .filter(ProfileSignal.user_id.in_(user_ids)).group_by(ProfileSignal.user_id)):
+        metrics[uid].update(availability_months=int(avail or 0), mentor_sessions=int(mentor or 0), compliance_steps=int(compl or 0))
+    for uid, level in (db.query(ProfileSignal.user_id, ProfileSignal.level).distinct()
+                       .filter(ProfileSignal.user_id.in_(user_ids), ProfileSignal.kind == "language")):
+        metrics[uid]["language_levels"].add(level)
+    soft = case((EndorsementCounter.skill_key.like("soft:%"), EndorsementCounter.count), else_=0)
+    for uid, total, soft_cnt in (db.query(EndorsementCounter.user_id, func.sum(EndorsementCounter.count), func.sum(soft))
+                                 .filter(EndorsementCounter.user_id.in_(user_ids)).group_by(EndorsementCounter.user_id)):
+        metrics[uid].update(endorsements=int(total or 0), soft_endorsements=int(soft_cnt or 0))
+    kpi_filled = case((func.coalesce(Project.result_kpi, "") != "", 1), else_=0)
+    for uid, total, kpi in (db.query(Project.user_id, func.count(Project.id), func.sum(kpi_filled))
+                            .filter(Project.user_id.in_(user_ids)).group_by(Project.user_id)):
+        metrics[uid].update(projects=total, projects_with_kpi=int(kpi or 0))
+    for uid, total in (db.query(Certificate.user_id, func.count(Certificate.id))
+                       .filter(Certificate.user_id.in_(user_ids), active_certificate_filter(date.today()))
+                       .group_by(Certificate.user_id)):
+        metrics[uid]["certificates"] = total
+    return metrics
+
+def _evaluate_metrics_batch(batch: List[tuple]) -> List[tuple]:  # [(user_id, метрики)] -> [(user_id, code, level, xp)]
+    return [(uid, code, lvl, xp) for uid, m in batch for code, lvl, xp in evaluate_achievements(m)]
+
+@job_handler("achievements_recalc")
+def run_achievements_recalc_job(db: Session, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Пересчёт ачивок всех пользователей пачками по id. После каждой пачки новые уровни и курсор
+    фиксируются одним коммитом, поэтому прерванная задача продолжает с места остановки"""
+    job_id = payload.get("_job_id")
+    chunk_size = int(payload.get("chunk_size") or RECALC_CHUNK_SIZE)
+    progress = load_job_progress(db, job_id) or {"last_user_id": 0, "processed": 0, "issued": 0}
+    progress["total"] = db.query(func.count(User.id)).scalar() or 0
+    while True:
+        ids = [uid for (uid,) in db.query(User.id).filter(User.id > progress["last_user_id"])
+               .order_by(User.id).limit(chunk_size)]
+        if not ids:
+            break
+        earned = _evaluate_metrics_batch(list(collect_metrics_bulk(db, ids).items()))  # правила — пара bisect на пользователя, в процессе
+        if earned:                                            # уже выданные уровни отсекает уникальный индекс
+            res = db.connection().execute(sqlite_insert(UserAchievement).on_conflict_do_nothing(index_elements=["user_id", "code", "level"]),
+                             [{"user_id": uid, "code": code, "level": lvl, "xp": xp} for uid, code, lvl, xp in earned])
+            progress["issued"] += max(res.rowcount or 0, 0)
+        progress["last_user_id"] = ids[-1]
+        progress["processed"] += len(ids)
+        save_job_progress(db, job_id, progress)
+        db.commit()                                           # пачка и курсор — атомарно
+        logger.info("Пересчёт ачивок: %s/%s, новых уровней: %s", progress["processed"], progress["total"], progress["issued"],
+                    extra={"fields": {"job_id": job_id, **progress}})
+    return progress
+
+@app.post("/admin/achievements/recalculate", response_model=JobPublic)  # пересчитать ачивки всем (после правки каталога)
+def recalculate_achievements(chunk_size: int = Body(RECALC_CHUNK_SIZE, embed=True, ge=1, le=5000), db: Session = Depends(get_db)):
+    job = enqueue_job(db, "achievements_recalc", {"chunk_size": chunk_size}, dedup_key="achievements_recalc")  # повторный вызов вернёт активную задачу
+    db.commit()
+    return job_public(job)
+
+# ============================== РАЗБОР РЕЗЮМЕ ==================================
+# Форма резюме склеивает поля в один resume_text ('Навыки: ...', 'Период: ...', 'Сертификаты: ...').
+# После сохранения фоновая задача разбирает его правилами (регулярки + словарь таксономии) и переносит
+# в таблицы: навыки добавляются к введённым, сертификаты и периоды работы из резюме заменяются свежими
+RESUME_SKILL_MIN_HOLDERS = int(os.getenv("RESUME_SKILL_MIN_HOLDERS", "3"))  # навык из резюме — только известный (словарь или у N+ человек)
+_RESUME_LABELS = {"навыки": "skills", "ключевые навыки": "skills", "последнее место работы": "company", "место работы": "company",
+                  "период": "period", "обязанности": "responsibilities", "образование": "education",
+                  "специальность": "specialty", "сертификаты": "certificates", "о себе": "about"}
+_RESUME_LABEL_RE = re.compile(r"^[ \t]*(" + "|".join(sorted(map(re.escape, _RESUME_LABELS), key=len, reverse=True)) + r")[ \t]*:",
+                              re.I | re.M)
+_MONTHS = {"янв": 1, "фев": 2, "мар": 3, "апр": 4, "май": 5, "мая": 5, "июн": 6, "июл": 7, "авг": 8, "сен": 9, "окт": 10,
+           "ноя": 11, "дек": 12, "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6, "jul": 7, "aug": 8, "sep": 9,
+           "oct": 10, "nov": 11, "dec": 12}
+
+def _date_re(p: str) -> str:                                  # '2019', '03.2019', 'март 2019'
+    return rf"(?:(?P<{p}m>\d{{1,2}})[./]|(?P<{p}n>[^\W\d_]{{3,}})\.?\s+)?(?P<{p}y>(?:19|20)\d{{2}})"
+
+_PERIOD_RE = re.compile(_date_re("s") + r"\s*(?:-|–|—|по|to|до)\s*(?:" + _date_re("e")
+                        + r"|(?P<now>(?:по\s+)?(?:н\.?\s*в\.?|наст\w*|сей\s+день|сейчас|present|now)))", re.I)
+_CERT_UNTIL_RE = re.compile(r"\b(?:действителен\s+до|valid\s+until|until|expires?|до)\s*:?\s*"
+                            r"(?P<d>\d{4}-\d{2}-\d{2}|(?:\d{1,2}[./]){0,2}(?:19|20)\d{2})", re.I)
+_CERT_SPLIT_RE = re.compile(r"[;\n]|,(?![^()]*\))(?!\s*(?:действителен|valid|until|expires?|до)\b)", re.I)  # запятая перед «до ...» — часть сертификата
+
+def _resume_date(year: str, month: Optional[str], month_name: Optional[str], end: bool) -> Optional[date]:
+    """Дата границы периода: без месяца — начало/конец года, с месяцем — начало/конец месяца"""
+    m = int(month) if month else _MONTHS.get(month_name[:3].casefold()) if month_name else None
+    y = int(year)
+    if m is None:
+        return date(y, 12, 31) if end else date(y, 1, 1)
+    if not 1 <= m <= 12:
+        return None
+    return date(y + m // 12, m % 12 + 1, 1) - timedelta(days=1) if end else date(y, m, 1)
+
+def _parse_certificate(item: str) -> Optional[Dict[str, Any]]:  # 'AWS SAA (Amazon), до 05.2026' -> имя, кем выдан, срок
+    valid_until = None
+    m = _CERT_UNTIL_RE.search(item)
+    if m:
+        raw = m.group("d")
+        try:
+            parts = [int(x) for x in re.split(r"[./]", raw)] if "-" not in raw else None
+            valid_until = (date.fromisoformat(raw) if parts is None else date(parts[2], parts[1], parts[0]) if len(parts) == 3
+                           else _resume_date(str(parts[-1]), str(parts[0]) if len(parts) == 2 else None, None, end=True))
+        except ValueError:
+            valid_until = None
+        item = item[:m.start()] + item[m.end():]
+    issued_by = ""
+    paren = re.search(r"\(([^()]*)\)", item)
+    if paren and paren.group(1).strip() and not re.fullmatch(r"[\d\s./-]*", paren.group(1)):  # '(2023)' — год выдачи, не организация
+        issued_by = paren.group(1).strip()
+    item = re.sub(r"\([^()]*\)", " ", item)
+    if not issued_by:                                         # 'Scrum Master — Scrum.org', 'PMP от PMI'
+        parts = re.split(r"\s+(?:[—–-]|от)\s+", item, maxsplit=1)
+        if len(parts) == 2:
+            item, issued_by = parts[0], parts[1].strip(" ,.;")
+    name = re.sub(r"\s+", " ", item).strip(" ,.;:—–-")
+    return {"name": name, "issued_by": issued_by, "valid_until": valid_until} if name else None
+
+def parse_resume_text(content: str) -> Dict[str, Any]:
+    """Разбор резюме правилами: секции по меткам формы, затем навыки, сертификаты и периоды работы.
+    Текст без меток целиком считается свободным — в нём ищутся известные навыки и периоды"""
+    marks = list(_RESUME_LABEL_RE.finditer(content))
+    sections: Dict[str, str] = {}
+    for m, nxt in zip(marks, marks[1:] + [None]):
+        body = content[m.end():nxt.start() if nxt else len(content)].strip()
+        if body and body.casefold() not in ("none", "-"):      # пустое поле формы приходит как 'None'
+            key = _RESUME_LABELS[m.group(1).casefold()]
+            sections[key] = (sections.get(key, "") + "\n" + body).strip()
+    head = content[:marks[0].start()] if marks else content
+    free_text = "\n".join([head] + [sections.get(k, "") for k in ("responsibilities", "specialty", "education", "about")])
+    skills = [s.strip() for s in re.split(r"[,;\n]", sections.get("skills", "")) if s.strip()]
+    certificates = [c for c in map(_parse_certificate, re.split(_CERT_SPLIT_RE, sections.get("certificates", ""))) if c]
+    periods = []
+    company = sections.get("company", "")
+    for m in _PERIOD_RE.finditer(sections.get("period") or company or (content if not marks else "")):
+        start = _resume_date(m.group("sy"), m.group("sm"), m.group("sn"), end=False)
+        end = None if m.group("now") else _resume_date(m.group("ey"), m.group("em"), m.group("en"), end=True)
+        if start and start <= date.today() and (end is None or start <= end):
+            periods.append({"company": "", "started_on": start, "ended_on": end, "description": ""})
+    if company and not periods:                               # место работы без дат — тоже период
+        periods.append({"company": "", "started_on": None, "ended_on": None, "description": ""})
+    if periods:                                               # первый период — последнее место работы из формы
+        periods[0].update(company=company.splitlines()[0][:200] if company else "", description=sections.get("responsibilities", ""))
+    return {"skills": skills, "free_text": free_text, "certificates": certificates, "periods": periods}
+
+def experience_from_periods(periods: List[Dict[str, Any]]) -> float:  # стаж в годах по объединению периодов
+    total, cur_start, cur_end = 0, None, None
+    for start, end in sorted((p["started_on"], p["ended_on"] or date.today()) for p in periods if p["started_on"]):
+        if cur_end is not None and start <= cur_end:
+            cur_end = max(cur_end, end)
+            continue
+        if cur_end is not None:
+            total += (cur_end - cur_start).days
+        cur_start, cur_end = start, end
+    if cur_end is not None:
+        total += (cur_end - cur_start).days
+    return round(total / 365.25, 1)
+
+def apply_parsed_resume(db: Session, user: User, parsed: Dict[str, Any]) -> Dict[str, int]:
+    """Переносит разбор в таблицы. Навыки только добавляются и только известные (синонимы или есть у
+    RESUME_SKILL_MIN_HOLDERS сотрудников) — и из раздела «Навыки:», и из текста; сертификаты из резюме (source='resume')
+    сверяются с разбором, введённые вручную не трогаем; периоды работы целиком принадлежат разбору"""
+    stats = {"skills": 0, "certificates": 0, "work_periods": 0, "experience": 0}
+    have = {s.skill_id for s in user.skills}
+    known = {skill_taxonomy.lookup(canon) for canon in SKILL_SYNONYMS} | {
+        sid for (sid,) in db.query(Skill.skill_id).filter(Skill.skill_id.isnot(None)).group_by(Skill.skill_id)
+        .having(func.count(Skill.id) >= RESUME_SKILL_MIN_HOLDERS)}
+    candidates = [sid for sid in itertools.chain((skill_taxonomy.lookup(name) for name in parsed["skills"] if not parse_skill_marker(name)),
+                                                 skill_taxonomy.find_in_text(parsed["free_text"])) if sid in known]
+    for sid in candidates:
+        if sid is None or sid in have:
+            continue
+        have.add(sid)
+        user.skills.append(Skill(name=skill_taxonomy.name(sid), skill_id=sid, level=""))
+        stats["skills"] += 1
+    manual = {normalize_skill_key(c.name) for c in user.certificates if c.source != "resume"}
+    old = {(normalize_skill_key(c.name), c.issued_by or "", c.valid_until): c for c in user.certificates if c.source == "resume"}
+    seen: set = set()
+    for c in parsed["certificates"]:
+        key = (normalize_skill_key(c["name"]), c["issued_by"], c["valid_until"])
+        if key[0] in manual or key in seen:
+            continue
+        seen.add(key)
+        if old.pop(key, None) is None:
+            user.certificates.append(Certificate(source="resume", **c))
+            stats["certificates"] += 1
+    for c in old.values():                                    # из текста резюме сертификат убрали
+        user.certificates.remove(c)
+        stats["certificates"] += 1
+    current = [(p.company, p.started_on, p.ended_on, p.description or "") for p in user.work_periods]
+    if current != [(p["company"], p["started_on"], p["ended_on"], p["description"]) for p in parsed["periods"]]:
+        user.work_periods.clear()
+        user.work_periods.extend(WorkPeriod(**p) for p in parsed["periods"])
+        stats["work_periods"] = len(parsed["periods"])
+    years = experience_from_periods(parsed["periods"])
+    if not user.experience_years and years:                   # стаж, введённый вручную, не перетираем
+        user.experience_years = years
+        stats["experience"] = 1
+    return stats
+
+def schedule_resume_parse(db: Session, user: User) -> None:   # разбор резюме — в фоне, PUT его не ждёт
+    if (user.resume_text or "").strip():
+        enqueue_job(db, "resume_parse", {"user_id": user.id}, dedup_key=f"resume_parse:{user.id}")
+
+@job_handler("resume_parse")
+def run_resume_parse_job(db: Session, payload: Dict[str, Any]) -> Dict[str, Any]:  # resume_text -> навыки, сертификаты, периоды, ачивки
+    """Разбор меняет профиль так же, как запись без If-Match: блокировка записи до чтения, версия +1 при изменениях —
+    иначе GET со старым If-None-Match получил бы 304 на навыки и стаж до разбора"""
+    db.execute(update(User).where(User.id == payload["user_id"])
+               .values(version=User.version, updated_at=User.updated_at)  # updated_at явно: иначе сработает onupdate
+               .execution_options(synchronize_session=False))
+    user = db.get(User, payload["user_id"])
+    if user is None or not (user.resume_text or "").strip():
+        return {"skipped": True}
+    stats: Dict[str, Any] = apply_parsed_resume(db, user, parse_resume_text(user.resume_text))
+    if any(stats.values()):
+        user.updated_at = datetime.utcnow()                   # профиль изменился (кеш PDF, выгрузка)
+        db.flush()
+        db.execute(update(User).where(User.id == user.id).values(version=User.version + 1)
+                   .execution_options(synchronize_session=False))  # новый ETag: клиенты с формой до разбора получат 412
+        stats["issued"] = len(issue_achievements(db, user.id, evaluate_achievements(collect_profile_metrics(user))))
+    return stats
+
 # ============================== CRUD ENDPOINTS ДЛЯ ПОЛЬЗОВАТЕЛЕЙ ===============
 @app.post("/users", response_model=UserPublic)               # создание пользователя
 def create_user(payload: UserCreate, db: Session = Depends(get_db)):  # зависимость на сессию БД
@@ -448,38 +2145,123 @@ def create_user(payload: UserCreate, db: Session = Depends(get_db)):  # зави
     upsert_skills(db, user, payload.skills)                   # сохраняем навыки
     upsert_projects(db, user, payload.projects)               # сохраняем проекты
     upsert_certificates(db, user, payload.certificates)       # сохраняем сертификаты
+    schedule_resume_parse(db, user)                           # навыки/сертификаты/периоды из текста резюме — в фоне
     db.commit()                                               # фиксируем транзакцию
     db.refresh(user)                                          # обновляем объект из БД
     return user                                               # отдаём публичную модель
 
-@app.get("/users/{user_id}", response_model=UserPublic)      # получить пользователя по id
-def get_user(user_id: int, db: Session = Depends(get_db)):   # зависимость на сессию БД
-    user = db.get(User, user_id)                             # ищем по первичному ключу
-    if not user:                                             # если не найден
-        raise HTTPException(status_code=404, detail="User not found")  # бросаем 404
+def user_etag(version: int) -> str:                         # ETag профиля — его версия
+    return f'"v{version}"'
+
+def etag_matches(header: str, version: int) -> bool:         # If-Match / If-None-Match: '*', список, слабые W/"..."
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return "*" in tags or user_etag(version) in tags
+
+def profile_conflict(db: Session, user_id: int) -> Response:  # 412 с актуальным профилем: клиент сольёт правки или обновит форму
+    current = user_public_row(db, user_id)
+    return Response(content=json_bytes({"detail": "Profile was modified by another request", "current": current}),
+                    status_code=412, media_type="application/json", headers={"ETag": user_etag(current["version"])})
+
+@app.get("/users/{user_id}", response_model=UserPublic)      # получить пользователя по id (ETag = версия; If-None-Match -> 304)
+def get_user(user_id: int, request: Request, response: Response, db: Session = Depends(get_db)):  # зависимость на сессию БД
+    if FAST_JSON:                                            # проекция колонок вместо ORM-объекта и модели
+        row = user_public_row(db, user_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        version = row["version"]
+    else:
+        user = db.get(User, user_id)                         # ищем по первичному ключу
+        if not user:                                         # если не найден
+            raise HTTPException(status_code=404, detail="User not found")  # бросаем 404
+        version = user.version
+    if etag_matches(request.headers.get("if-none-match") or "", version):
+        return Response(status_code=304, headers={"ETag": user_etag(version)})
+    if FAST_JSON:
+        out = json_response(row)
+        out.headers["ETag"] = user_etag(version)
+        return out
+    response.headers["ETag"] = user_etag(version)
     return user                                              # возвращаем пользователя
 
-@app.put("/users/{user_id}", response_model=UserPublic)      # обновить пользователя
-def update_user(user_id: int, payload: UserPatch, db: Session = Depends(get_db)):  # зависимость на БД
-    user = db.get(User, user_id)                             # ищем пользователя
-    if not user:                                             # если нет такого
-        raise HTTPException(status_code=404, detail="User not found")  # 404
-    if payload.email and payload.email != user.email:        # если меняем email
+USER_SCALAR_FIELDS = ("full_name", "phone", "department", "position", "grade", "experience_years", "resume_text", "profile_photo_url")
+
+def _skills_unchanged(user: User, skills_in: List[SkillIn]) -> bool:  # тот же набор (после сведения к таксономии) в том же порядке
+    if any(parse_skill_marker(s.name) for s in skills_in):    # маркеры сигналов всегда перезаписываем
+        return False
+    levels = skill_levels(user)
+    desired, seen = [], set()
+    for s in skills_in:
+        if not normalize_skill_key(s.name):
+            continue
+        sid = skill_taxonomy.lookup(s.name)
+        ident = sid if sid is not None else normalize_skill_key(s.name)  # навык вне таксономии сравниваем по ключу
+        if ident not in seen:
+            seen.add(ident)
+            desired.append((ident, s.level.strip() if s.level is not None else levels.get(ident, "")))  # без уровня — как в upsert_skills
+    return desired == [(sk.skill_id if sk.skill_id is not None else normalize_skill_key(sk.name), sk.level or "")
+                       for sk in user.skills]
+
+def apply_user_changes(db: Session, user: User, payload: UserPatch) -> List[str]:
+    """Применяет переданные поля (None — не передано) и возвращает имена реально изменившихся.
+    Пустой список — писать, коммитить и пересчитывать ачивки нечего"""
+    changed: List[str] = []
+    if payload.email and str(payload.email) != user.email:   # если меняем email
         if db.query(User).filter_by(email=str(payload.email)).first():  # проверяем уникальность нового email
             raise HTTPException(status_code=409, detail="User with this email exists")  # конфликт
         user.email = str(payload.email)                      # применяем новый email
-    for attr in ["full_name", "phone", "department", "position", "grade", "experience_years", "resume_text", "profile_photo_url"]:  # перечисляем обновляемые поля
+        changed.append("email")
+    for attr in USER_SCALAR_FIELDS:                          # перечисляем обновляемые поля
         val = getattr(payload, attr)                         # достаём значение из payload
-        if val is not None:                                  # если значение передано
+        if val is not None and val != getattr(user, attr):   # передано и отличается от текущего
             setattr(user, attr, val)                         # присваиваем пользователю
-    if payload.skills is not None:                           # если передан список навыков
+            changed.append(attr)
+    if payload.skills is not None and not _skills_unchanged(user, payload.skills):
         upsert_skills(db, user, payload.skills)              # перезаписываем навыки
-    if payload.projects is not None:                         # если передан список проектов
+        changed.append("skills")
+    if payload.projects is not None and ([(p.title.strip(), (p.role or "").strip(), (p.description or "").strip(), (p.result_kpi or "").strip())
+                                          for p in payload.projects]
+                                         != [(p.title, p.role or "", p.description or "", p.result_kpi or "") for p in user.projects]):
         upsert_projects(db, user, payload.projects)          # перезаписываем проекты
-    if payload.certificates is not None:                     # если передан список сертификатов
-        upsert_certificates(db, user, payload.certificates)  # перезаписываем сертификаты
-    db.commit()                                              # сохраняем изменения
-    db.refresh(user)                                         # обновляем объект
+        changed.append("projects")
+    if payload.certificates is not None and ([(c.name.strip(), (c.issued_by or "").strip(), c.valid_until) for c in payload.certificates]
+                                             != [(c.name, c.issued_by or "", c.valid_until) for c in user.certificates if c.source != "resume"]):
+        upsert_certificates(db, user, payload.certificates)  # перезаписываем сертификаты (извлечённые из резюме — сравниваем без них)
+        changed.append("certificates")
+    if {"skills", "projects", "certificates"} & set(changed):
+        user.updated_at = datetime.utcnow()                  # профиль изменился, даже если поменялись только списки (кеш PDF, выгрузка)
+    if {"resume_text", "certificates"} & set(changed):     # сертификаты из резюме upsert_certificates стёр — вернёт разбор
+        schedule_resume_parse(db, user)                      # правка одних навыков разбор не запускает: иначе удалённый навык
+                                                             # возвращался бы, а каждое сохранение формы давало бы новую версию
+    if changed:
+        schedule_achievements_refresh(db, [user.id])         # новые ачивки придут в сайдбар событием
+    return changed
+
+@app.patch("/users/{user_id}", response_model=UserPublic)    # частичное обновление: только изменённые поля (автосохранение формы)
+@app.put("/users/{user_id}", response_model=UserPublic)      # обновить пользователя (те же правила: None — поле не трогаем)
+def update_user(user_id: int, payload: UserPatch, request: Request, response: Response, db: Session = Depends(get_db)):  # зависимость на БД
+    """С If-Match запись проходит, только если профиль не менялся с версии клиента, иначе 412 с актуальным состоянием.
+    Без заголовка — последняя запись побеждает, но целиком: блокировку записи берём до чтения профиля"""
+    if_match = request.headers.get("if-match")               # версия, которую видел клиент (ETag из GET/PATCH)
+    if if_match is None:                                     # пустой UPDATE первым оператором: у SQLite это блокировка записи
+        db.execute(update(User).where(User.id == user_id)
+                   .values(version=User.version, updated_at=User.updated_at)  # ничего не меняет: onupdate не сдвинет updated_at
+                   .execution_options(synchronize_session=False))
+    user = db.get(User, user_id)                             # ищем пользователя
+    if not user:                                             # если нет такого
+        raise HTTPException(status_code=404, detail="User not found")  # 404
+    if if_match is not None and not etag_matches(if_match, user.version):
+        return profile_conflict(db, user_id)                 # клиент правил устаревшую версию — чужие изменения не затираем
+    changed = apply_user_changes(db, user, payload)
+    response.headers["X-Changed-Fields"] = ",".join(changed)  # пусто — запрос ничего не изменил
+    if changed:                                              # без изменений — ни коммита, ни пересчёта ачивок
+        bumped = db.execute(update(User).where(User.id == user_id, User.version == user.version)
+                            .values(version=User.version + 1)).rowcount  # сравнить-и-записать: с момента чтения версию никто не поднял
+        if not bumped:                                       # параллельная запись успела между чтением и записью
+            db.rollback()
+            return profile_conflict(db, user_id)
+        db.commit()                                          # сохраняем изменения
+        db.refresh(user)                                     # обновляем объект
+    response.headers["ETag"] = user_etag(user.version)
     return user                                              # отдаём пользователя
 
 @app.post("/users/{user_id}/endorse", response_model=dict)   # добавить эндорсмент навыка
@@ -487,61 +2269,577 @@ def endorse_skill(user_id: int, skill_name: str = Body(..., embed=True), from_te
     user = db.get(User, user_id)                             # проверяем, что пользователь существует
     if not user:                                             # если нет
         raise HTTPException(status_code=404, detail="User not found")  # 404
-    db.add(Endorsement(user_id=user.id, skill_name=skill_name.strip(), from_team=(from_team or "").strip()))  # добавляем запись эндорсмента
+    res = record_endorsements(db, from_team, [(user.id, skill_name)])  # эндорсмент + счётчик (повтор в окне не засчитывается)
+    if res["added"]:
+        schedule_achievements_refresh(db, [user.id])
     db.commit()                                              # фиксируем транзакцию
-    return {"status": "ok"}                                  # отдаём короткий ответ
+    return {"status": "ok" if res["added"] else "duplicate"} # отдаём короткий ответ
+
+class BulkEndorseItem(BaseModel):                            # один эндорсмент в пачке
+    user_id: int                                             # кого подтверждаем
+    skill_name: str                                          # какой навык
+
+class BulkEndorseRequest(BaseModel):                         # пачка эндорсментов от одной команды
+    from_team: str = ""                                      # от какой команды
+    items: List[BulkEndorseItem] = Field(..., max_length=5000)  # кого и за что
+
+@app.post("/endorsements:bulk", response_model=dict)         # кампания эндорсментов на всю команду одним запросом
+def endorse_bulk(payload: BulkEndorseRequest, db: Session = Depends(get_db)):
+    requested = sorted({it.user_id for it in payload.items})
+    known = {uid for i in range(0, len(requested), BATCH_CHUNK_SIZE)  # несуществующих пропускаем; IN (...) — пачками
+             for (uid,) in db.query(User.id).filter(User.id.in_(requested[i:i + BATCH_CHUNK_SIZE]))}
+    res = record_endorsements(db, payload.from_team, [(it.user_id, it.skill_name) for it in payload.items if it.user_id in known])
+    if res["added"]:                                         # одна задача пересчёта на всю кампанию
+        schedule_achievements_refresh(db, sorted({it.user_id for it in payload.items if it.user_id in known}))
+    db.commit()                                              # одна транзакция на всю пачку
+    return {**res, "unknown_users": [uid for uid in requested if uid not in known]}
+
+MICROSTEP_INSERT_CHUNK = 999 // 2                            # строк в одном INSERT: 2 параметра на строку, SQLite < 3.32 — не больше 999
+
+def record_microsteps(db: Session, user_id: int, days: List[date]) -> int:  # вставка дней без дублей; возвращает число новых
+    rows = [{"user_id": user_id, "done_on": d} for d in sorted(set(days))]
+    added = 0
+    for i in range(0, len(rows), MICROSTEP_INSERT_CHUNK):     # INSERT ... VALUES (...), (...) ON CONFLICT DO NOTHING
+        stmt = sqlite_insert(Microstep).values(rows[i:i + MICROSTEP_INSERT_CHUNK])
+        added += db.connection().execute(stmt.on_conflict_do_nothing(index_elements=["user_id", "done_on"])).rowcount
+    return added
+
+def streak_state(db: Session, user_id: int) -> Dict[str, Any]:  # стрик и XP за него — одним запросом по датам
+    streak = compute_weekly_streak([d for (d,) in db.query(Microstep.done_on).filter_by(user_id=user_id)])
+    return {**streak, "xp": xp_from_streak(streak)}
 
 @app.post("/users/{user_id}/microstep", response_model=dict) # добавить микрошаг (для стрика)
 def add_microstep(user_id: int, done_on: Optional[date] = Body(None, embed=True), db: Session = Depends(get_db)):  # дата опциональна
-    user = db.get(User, user_id)                             # ищем пользователя
-    if not user:                                             # если не найден
+    if not db.get(User, user_id):                            # ищем пользователя
         raise HTTPException(status_code=404, detail="User not found")  # 404
-    d = done_on or date.today()                              # по умолчанию — сегодняшняя дата
-    try:                                                     # пробуем сохранить
-        db.add(Microstep(user_id=user.id, done_on=d))        # создаём запись микрошагa
-        db.commit()                                          # коммитим
-    except Exception:                                        # если нарушение уникальности (дубликат дня)
-        db.rollback()                                        # откатываем
-        raise HTTPException(status_code=409, detail="Microstep already exists for this day")  # возвращаем 409
-    return {"status": "ok"}                                  # успешный ответ
+    added = record_microsteps(db, user_id, [done_on or date.today()])  # по умолчанию — сегодня; повтор дня не ошибка
+    if added:                                                # стрик мог вырасти — сообщаем сайдбару новый XP
+        emit_user_event(db, user_id, "xp", total_xp=total_xp_of(db, user_id))
+    db.commit()                                              # коммитим
+    return {"status": "ok", "added": added}                  # идемпотентно: added=0, если день уже был
+
+class MicrostepBatchIn(BaseModel):                           # пачка дней (импорт из внешнего трекера)
+    days: List[date] = Field(..., max_length=3660)           # даты выполнения микрошагов (до 10 лет по дню за запрос)
+
+@app.post("/users/{user_id}/microsteps:batch", response_model=dict)  # добавить сразу много дней
+def add_microsteps_batch(user_id: int, payload: MicrostepBatchIn, db: Session = Depends(get_db)):
+    if not db.get(User, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    added = record_microsteps(db, user_id, payload.days)     # уже существующие дни пропускаются базой
+    streak = streak_state(db, user_id)                       # стрик пересчитываем один раз на пачку
+    if added:
+        emit_user_event(db, user_id, "xp", total_xp=total_xp_of(db, user_id))
+    db.commit()                                              # одна транзакция на пачку
+    return {"status": "ok", "added": added, "streak": streak}
+
+# ============================== ЖИВЫЕ ОБНОВЛЕНИЯ САЙДБАРА =====================
+# Пересчёт ачивок после записи профиля идемпотентен, поэтому очередь — множество id в памяти процесса, а не
+# строка background_jobs на каждую правку: повторные правки схлопываются, потеря при падении безвредна
+_refresh_lock = threading.Lock()
+_refresh_pending: set = set()                                # пользователи, ждущие пересчёта ачивок
+
+def schedule_achievements_refresh(db: Session, user_ids: List[int]) -> None:  # после коммита db ачивки пересчитает воркер
+    db.info.setdefault("achievements_refresh", set()).update(user_ids)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _queue_achievements_refresh(session: Session) -> None:
+    if session.in_nested_transaction():
+        return
+    user_ids = session.info.pop("achievements_refresh", None)
+    if user_ids:
+        with _refresh_lock:
+            _refresh_pending.update(user_ids)
+        job_runner.wake()
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_achievements_refresh(session: Session) -> None:    # откат: профиль не менялся
+    if not session.in_nested_transaction():
+        session.info.pop("achievements_refresh", None)
+
+def refresh_achievements(db: Session, user_ids: List[int]) -> int:  # выдача ачивок по текущему профилю; новые уровни уйдут в SSE
+    issued = 0
+    for uid in user_ids:
+        user = db.get(User, uid)
+        if user is not None:
+            issued += len(issue_achievements(db, uid, evaluate_achievements(collect_profile_metrics(user))))
+    return issued
+
+@scheduled(every_seconds=0)                                  # на каждом проходе воркера (его будит коммит с правкой)
+def _run_pending_achievements_refresh(db: Session) -> None:
+    with _refresh_lock:
+        user_ids = sorted(_refresh_pending)
+        _refresh_pending.clear()
+    refresh_achievements(db, user_ids)                       # события уйдут подписчикам при коммите воркера; ошибку залогирует воркер
+
+@job_handler("achievements_refresh")
+def run_achievements_refresh_job(db: Session, payload: Dict[str, Any]) -> Dict[str, Any]:  # задачи, поставленные до очереди в памяти
+    return {"users": len(payload.get("user_ids", [])), "issued": refresh_achievements(db, payload.get("user_ids", []))}
+
+def sidebar_snapshot(user_id: int) -> Dict[str, Any]:        # стартовое состояние сайдбара для нового подписчика
+    db = SessionLocal()
+    try:
+        recent = (db.query(UserAchievement).filter(UserAchievement.user_id == user_id)
+                  .order_by(UserAchievement.obtained_at.desc()).limit(5).all())
+        return {"type": "snapshot", "total_xp": total_xp_of(db, user_id),
+                "recent": [{"code": a.code, "title": ACHIEVEMENTS_CATALOG.get(a.code, {}).get("title", a.code),
+                            "level": a.level, "xp": a.xp, "obtained_at": a.obtained_at.isoformat()} for a in recent]}
+    finally:
+        db.close()
+
+def _sse(ev: Dict[str, Any]) -> str:                         # одно событие в формате text/event-stream
+    return f"event: {ev['type']}\ndata: {json.dumps(ev, ensure_ascii=False, default=str)}\n\n"
+
+@app.get("/users/{user_id}/events")                         # SSE: снимок, затем дельты (ачивки, XP) по мере появления
+async def stream_user_events(user_id: int, request: Request):
+    async def gen():
+        q = user_events.subscribe(user_id)                   # подписываемся до снимка, чтобы не потерять события между ними
+        try:
+            yield "retry: 3000\n\n"                           # через сколько браузер/клиент переподключится
+            yield _sse(await run_in_threadpool(sidebar_snapshot, user_id))
+            while True:
+                try:
+                    ev = await asyncio.wait_for(q.get(), timeout=USER_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"                         # комментарий-пинг держит соединение
+                    continue
+                yield _sse(ev)
+        finally:
+            user_events.unsubscribe(user_id, q)
+    return StreamingResponse(gen(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # ============================== ЛИЧНЫЙ КАБИНЕТ ================================
-@app.get("/users/{user_id}/dashboard", response_model=DashboardResponse)  # собрать данные личного кабинета
-def get_dashboard(user_id: int, db: Session = Depends(get_db)):           # зависимость на БД
+@app.get("/users/{user_id}/dashboard", response_model=DashboardResponse, response_model_exclude_unset=True)  # собрать данные личного кабинета
+def get_dashboard(user_id: int, db: Session = Depends(get_db),            # зависимость на БД
+                  fields: Optional[str] = Query(None, description="Поля через запятую, например total_xp,recent_achievements"),
+                  limit: int = Query(5, ge=1, le=100, description="Сколько последних ачивок в recent_achievements")):
+    wanted = set(DASHBOARD_DEFAULT_FIELDS) if not fields else {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted - set(DashboardResponse.model_fields)
+    if unknown:                                              # опечатка в fields — явная ошибка, а не пустой ответ
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {sorted(unknown)}; allowed: {list(DashboardResponse.model_fields)}")
     user = db.get(User, user_id)                             # загружаем пользователя
     if not user:                                             # если нет
         raise HTTPException(status_code=404, detail="User not found")      # 404
-    total_xp = calculate_and_issue_achievements(db, user)    # пересчитываем ачивки/XP
+    total_xp = calculate_and_issue_achievements(db, user)    # пересчитываем ачивки/XP (выдача — при любом наборе полей)
     db.commit()                                              # фиксируем возможные новые ачивки
-    progress = profile_progress_percent(user)                # считаем процент заполнения профиля
-    recs = recommend_achievements(user)                      # формируем рекомендации по ачивкам
-    tips = None                                              # по умолчанию советов ИИ нет
-    client = scibox_client()                                 # берём клиента Scibox (если ключ задан)
-    if client:                                               # если клиент доступен
-        try:                                                 # пробуем получить короткие советы от LLM
-            tips = client.chat.completions.create(           # вызываем чат-комплишн
-                model="Qwen2.5-72B-Instruct-AWQ",            # модель Scibox
-                messages=[{"role": "user", "content":
-                    f"Краткие советы улучшения профиля. Роль={user.position}, отдел={user.department}, "
-                    f"навыков={len(user.skills)}, проектов={len(user.projects)}. Сфокусируйся на достижениях и шагах на 2 недели."
-                }],
-                temperature=0.5, top_p=0.9, max_tokens=300   # параметры генерации
-            ).choices[0].message.content                     # извлекаем текст ответа
-        except Exception:                                    # если вызов упал
-            tips = None                                      # просто скрываем советы
-    ach_public = [                                           # подготавливаем список ачивок в публичном виде
-        AchievementPublic(code=a.code, title=ACHIEVEMENTS_CATALOG.get(a.code, {}).get("title", a.code),
-                          level=a.level, xp=a.xp, obtained_at=a.obtained_at)
-        for a in user.achievements
-    ]
-    return DashboardResponse(                                 # собираем ответ кабинета
-        user=user, progress_percent=progress, total_xp=total_xp,
-        achievements=ach_public, recommended_achievements=recs, llm_tips=tips
-    )
+    public = achievement_dict if FAST_JSON else lambda a: AchievementPublic(**achievement_dict(a))  # ачивка в публичном виде
+    out: Dict[str, Any] = {}                                 # считаем только запрошенные поля
+    if "user" in wanted:
+        out["user"] = user_public_dict(user) if FAST_JSON else user
+    if "progress_percent" in wanted:
+        out["progress_percent"] = profile_progress_percent(user)  # считаем процент заполнения профиля
+    if "total_xp" in wanted:
+        out["total_xp"] = total_xp
+    if "achievements" in wanted:
+        out["achievements"] = [public(a) for a in user.achievements]
+    if "recent_achievements" in wanted:                      # сортирует БД по индексу (user_id, obtained_at)
+        out["recent_achievements"] = [public(a) for a in db.query(UserAchievement).filter(UserAchievement.user_id == user.id)
+                                      .order_by(UserAchievement.obtained_at.desc(), UserAchievement.id.desc()).limit(limit)]
+    if "recommended_achievements" in wanted:
+        out["recommended_achievements"] = recommend_achievements(user)  # формируем рекомендации по ачивкам
+    if "llm_tips" in wanted:
+        out["llm_tips"] = get_precomputed_tips(db, user)     # советы ИИ только из предрасчёта (или None, пока готовятся)
+    if FAST_JSON:                                            # словари уже в форме ответа — сериализуем как есть
+        return json_response(out)
+    body = DashboardResponse(**out).model_dump_json(exclude_unset=True)  # сериализация в Rust (pydantic-core), без jsonable_encoder
+    return Response(content=body, media_type="application/json")
+
+# ============================== ПРЕДРАСЧИТАННЫЕ СОВЕТЫ LLM ====================
+def tips_signature(position: Optional[str], department: Optional[str], skills_count: int, projects_count: int) -> Dict[str, Any]:
+    """Промпт советов зависит только от этих четырёх полей — у многих сотрудников он совпадает"""
+    parts = {"position": (position or "").strip(), "department": (department or "").strip(),
+             "skills": skills_count, "projects": projects_count}
+    parts["signature"] = hashlib.sha1(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return parts
+
+def tips_prompt(parts: Dict[str, Any]) -> str:               # текст промпта по сигнатуре (как раньше в get_dashboard)
+    return (f"Краткие советы улучшения профиля. Роль={parts['position'] or None}, отдел={parts['department'] or None}, "
+            f"навыков={parts['skills']}, проектов={parts['projects']}. Сфокусируйся на достижениях и шагах на 2 недели.")
+
+def get_precomputed_tips(db: Session, user: User) -> Optional[str]:  # читаем готовые советы; нет — заказываем генерацию
+    parts = tips_signature(user.position, user.department, len(user.skills), len(user.projects))
+    row = db.query(LlmTip).filter_by(signature=parts["signature"]).first()
+    if (row is None or row.tips is None) and llm_gateway.available():  # ещё не считали: ставим задачу (дубликаты схлопнутся)
+        enqueue_job(db, "llm_tips", parts, dedup_key=f"llm_tips:{parts['signature']}")
+        db.commit()
+        return None
+    return row.tips if row else None
+
+@job_handler("llm_tips")
+def run_llm_tips_job(db: Session, payload: Dict[str, Any]) -> Dict[str, Any]:  # генерация советов для одной сигнатуры
+    row = db.query(LlmTip).filter_by(signature=payload["signature"]).first()
+    prompt = tips_prompt(payload) if "position" in payload else (row.prompt if row else None)  # обновление — по сохранённому промпту
+    if prompt is None or not llm_gateway.available():        # без Scibox генерировать нечем
+        return {"signature": payload["signature"], "generated": False}
+    tips = llm_gateway.complete("dashboard_tips", priority=PRIORITY_BACKGROUND,  # фоновый приоритет: чат важнее
+                                messages=[{"role": "user", "content": prompt}],
+                                temperature=0.5, top_p=0.9, max_tokens=300)
+    if row is None:
+        row = LlmTip(signature=payload["signature"], prompt=prompt)
+        db.add(row)
+    row.prompt, row.tips, row.generated_at = prompt, tips, datetime.utcnow()
+    return {"signature": payload["signature"], "generated": True}
+
+@scheduled(every_seconds=600)
+def refresh_stale_tips(db: Session) -> None:                 # по расписанию переставляем в очередь устаревшие советы
+    border = datetime.utcnow() - timedelta(hours=LLM_TIPS_TTL_HOURS)
+    for (signature,) in db.query(LlmTip.signature).filter(LlmTip.generated_at < border):
+        enqueue_job(db, "llm_tips", {"signature": signature}, dedup_key=f"llm_tips:{signature}")
+
+# ============================== СРОКИ СЕРТИФИКАТОВ ============================
+CERT_EXPIRY_NOTICE_DAYS = int(os.getenv("CERT_EXPIRY_NOTICE_DAYS", "30"))       # за сколько дней до истечения сертификат попадает в список
+
+def expiring_certificates_query(db: Session, today: date, within_days: int, department: Optional[str] = None,
+                                include_expired: bool = False):
+    """Сертификаты со сроком не позже today + within_days — диапазон по индексу ix_cert_valid_until"""
+    q = (db.query(Certificate, User.full_name, User.department).join(User, User.id == Certificate.user_id)
+         .filter(Certificate.valid_until <= today + timedelta(days=within_days)))
+    q = q.filter(Certificate.valid_until.isnot(None) if include_expired else Certificate.valid_until >= today)
+    if department is not None:
+        q = q.filter(User.department == department)
+    return q.order_by(Certificate.valid_until, Certificate.id)
+
+def expiring_item(cert: Certificate, full_name: str, department: Optional[str], today: date) -> Dict[str, Any]:
+    return {"certificate_id": cert.id, "name": cert.name, "issued_by": cert.issued_by, "valid_until": cert.valid_until.isoformat(),
+            "days_left": (cert.valid_until - today).days, "user_id": cert.user_id, "full_name": full_name, "department": department}
+
+@app.get("/certificates/expiring", response_model=dict)      # истекающие сертификаты (индексный запрос по сроку)
+def list_expiring_certificates(within_days: int = Query(CERT_EXPIRY_NOTICE_DAYS, ge=0, le=3650),
+                               department: Optional[str] = Query(None, description="Только это подразделение"),
+                               include_expired: bool = Query(False, description="Добавить уже просроченные"),
+                               limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0),
+                               db: Session = Depends(get_db)):
+    today = date.today()
+    q = expiring_certificates_query(db, today, within_days, department, include_expired)
+    return {"as_of": today.isoformat(), "within_days": within_days, "total": q.count(),
+            "items": [expiring_item(c, name, dept, today) for c, name, dept in q.limit(limit).offset(offset)]}
+
+@job_handler("certificate_expiry_digest")
+def run_certificate_expiry_digest_job(db: Session, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Список «скоро истекают» на дату по каждому подразделению (одним запросом) + уведомление владельцам в сайдбар"""
+    as_of = date.fromisoformat(payload["as_of"])
+    within_days = int(payload.get("within_days", CERT_EXPIRY_NOTICE_DAYS))
+    label = lambda dept: (dept or "").strip() or ANALYTICS_NO_DEPARTMENT
+    by_dept: Dict[str, List[Dict[str, Any]]] = {label(d): [] for (d,) in db.query(User.department).distinct()}
+    by_user: Dict[int, List[Dict[str, Any]]] = {}
+    for cert, full_name, dept in expiring_certificates_query(db, as_of, within_days):
+        item = expiring_item(cert, full_name, dept, as_of)
+        by_dept.setdefault(label(dept), []).append(item)
+        by_user.setdefault(cert.user_id, []).append({k: item[k] for k in ("certificate_id", "name", "valid_until", "days_left")})
+    db.query(CertificateExpiryDigest).filter(CertificateExpiryDigest.as_of == as_of).delete()  # повторный запуск за дату перезаписывает
+    db.add_all(CertificateExpiryDigest(as_of=as_of, department=dept, within_days=within_days, count=len(items),
+                                       items=json.dumps(items, ensure_ascii=False)) for dept, items in by_dept.items())
+    for uid, certs in by_user.items():                       # уйдут подписчикам SSE при коммите задачи
+        emit_user_event(db, uid, "certificate_expiring", certificates=certs)
+    return {"as_of": as_of.isoformat(), "departments": len(by_dept), "certificates": sum(len(v) for v in by_dept.values())}
+
+@scheduled(every_seconds=3600)
+def schedule_certificate_expiry_digest(db: Session) -> None:  # раз в час проверяем, собран ли список на сегодня
+    today = date.today()
+    if db.query(CertificateExpiryDigest.id).filter(CertificateExpiryDigest.as_of == today).first() is None:
+        enqueue_job(db, "certificate_expiry_digest", {"as_of": today.isoformat(), "within_days": CERT_EXPIRY_NOTICE_DAYS},
+                    dedup_key=f"certificate_expiry_digest:{today.isoformat()}")
+
+@app.get("/certificates/expiring/digest", response_model=dict)  # материализованный список на день по подразделениям
+def get_certificate_expiry_digest(department: Optional[str] = Query(None), as_of: Optional[date] = Query(None, description="Дата (по умолчанию — последняя собранная)"),
+                                  db: Session = Depends(get_db)):
+    day = as_of or db.query(func.max(CertificateExpiryDigest.as_of)).scalar()
+    q = db.query(CertificateExpiryDigest).filter(CertificateExpiryDigest.as_of == day)
+    if department is not None:
+        q = q.filter(CertificateExpiryDigest.department == department)
+    rows = q.order_by(CertificateExpiryDigest.department).all() if day else []
+    if not rows:
+        raise HTTPException(status_code=404, detail="Digest not found")
+    return {"as_of": day.isoformat(), "departments": [{"department": r.department, "within_days": r.within_days, "count": r.count,
+                                                       "items": json.loads(r.items)} for r in rows]}
+
+# ============================== ПАКЕТНЫЙ КАБИНЕТ ДЛЯ HR =======================
+BATCH_CHUNK_SIZE = 500                                        # размер пачки id для IN (...) — ниже лимита параметров SQLite
+BATCH_MAX_USERS = 5000                                        # максимум пользователей в одном пакетном запросе
+
+class DashboardBatchRequest(BaseModel):                       # вход пакетного кабинета
+    user_ids: List[int] = Field(..., min_length=1, max_length=BATCH_MAX_USERS, description="Список id сотрудников")
+
+class DashboardBatchResponse(BaseModel):                      # колоночный ответ: i-й элемент каждого списка относится к user_id[i]
+    user_id: List[int]                                        # id найденных пользователей (в порядке запроса)
+    full_name: List[str]                                      # ФИО
+    department: List[Optional[str]]                           # подразделение
+    position: List[Optional[str]]                             # должность
+    progress_percent: List[float]                             # процент заполнения профиля
+    total_xp: List[int]                                       # XP за выданные ачивки + стрик
+    achievements_count: List[int]                             # число выданных уровней ачивок
+    streak_status: List[str]                                  # статус стрика («активен»/«пауза»)
+    recommended_achievements: List[List[str]]                 # рекомендации по ачивкам
+    missing_ids: List[int]                                    # запрошенные id, которых нет в БД
+
+def _grouped_counts(db: Session, key_col, aggregates: List[Any], ids: List[int]) -> Dict[int, Any]:  # агрегат GROUP BY user_id по пачке id
+    rows = db.query(key_col, *aggregates).filter(key_col.in_(ids)).group_by(key_col)  # один запрос на таблицу и пачку
+    return {row[0]: tuple(row[1:]) for row in rows}           # id -> кортеж агрегатов
+
+@app.post("/dashboards:batch", response_model=DashboardBatchResponse)  # кабинеты сразу для многих сотрудников
+def get_dashboards_batch(payload: DashboardBatchRequest, db: Session = Depends(get_db)):
+    """Пакетный кабинет: счётчики по всем дочерним таблицам берутся агрегатными запросами
+    (по одному на таблицу и пачку id), ачивки не перевыдаются, советы LLM не запрашиваются."""
+    ids = list(dict.fromkeys(payload.user_ids))               # убираем дубликаты, сохраняя порядок запроса
+    users: Dict[int, User] = {}                               # id -> пользователь (только колонки, без коллекций)
+    skills_cnt: Dict[int, Any] = {}                           # id -> (число навыков,)
+    projects_cnt: Dict[int, Any] = {}                         # id -> (число проектов, проектов с KPI)
+    certs_cnt: Dict[int, Any] = {}                            # id -> (число действующих сертификатов,)
+    ach_stats: Dict[int, Any] = {}                            # id -> (сумма XP, число ачивок)
+    steps: Dict[int, List[date]] = {}                         # id -> даты микрошагов
+    kpi_filled = case((func.coalesce(Project.result_kpi, "") != "", 1), else_=0)  # 1, если у проекта заполнен KPI
+    cert_active = case((active_certificate_filter(date.today()), 1), else_=0)  # 1, если сертификат не просрочен
+    for i in range(0, len(ids), BATCH_CHUNK_SIZE):            # обходим id пачками
+        chunk = ids[i:i + BATCH_CHUNK_SIZE]                   # текущая пачка
+        for u in db.query(User).filter(User.id.in_(chunk)):   # один запрос за пользователями пачки
+            users[u.id] = u
+        skills_cnt.update(_grouped_counts(db, Skill.user_id, [func.count(Skill.id)], chunk))
+        projects_cnt.update(_grouped_counts(db, Project.user_id, [func.count(Project.id), func.sum(kpi_filled)], chunk))
+        certs_cnt.update(_grouped_counts(db, Certificate.user_id, [func.sum(cert_active)], chunk))
+        ach_stats.update(_grouped_counts(db, UserAchievement.user_id, [func.sum(UserAchievement.xp), func.count(UserAchievement.id)], chunk))
+        for uid, d in db.query(Microstep.user_id, Microstep.done_on).filter(Microstep.user_id.in_(chunk)):  # даты микрошагов пачки
+            steps.setdefault(uid, []).append(d)
+
+    resp: Dict[str, List[Any]] = {name: [] for name in DashboardBatchResponse.model_fields}  # пустые колонки ответа
+    for uid in ids:                                           # собираем строки в исходном порядке
+        user = users.get(uid)
+        if user is None:                                      # неизвестный id
+            resp["missing_ids"].append(uid)
+            continue
+        fill = mandatory_profile_fields_filled(user)          # заполненность профиля
+        n_projects, n_kpi = projects_cnt.get(uid, (0, 0))     # проекты и проекты с KPI
+        xp_sum, n_ach = ach_stats.get(uid, (0, 0))            # XP и число ачивок
+        streak = compute_weekly_streak(steps.get(uid, []))    # стрик по микрошагам
+        resp["user_id"].append(uid)
+        resp["full_name"].append(user.full_name)
+        resp["department"].append(user.department)
+        resp["position"].append(user.position)
+        resp["progress_percent"].append(profile_progress_percent(user))
+        resp["total_xp"].append(int(xp_sum or 0) + xp_from_streak(streak))
+        resp["achievements_count"].append(int(n_ach or 0))
+        resp["streak_status"].append(streak["status"])
+        resp["recommended_achievements"].append(recommend_from_counts(
+            fill, skills_cnt.get(uid, (0,))[0], int(n_kpi or 0), certs_cnt.get(uid, (0,))[0]
+        ))
+    return resp                                               # FastAPI провалидирует по DashboardBatchResponse
+
+class SkillRef(BaseModel):                                     # схема «Навык таксономии»
+    id: int                                                  # канонический id
+    name: str                                                # каноническое написание
+
+@app.get("/skills/search", response_model=List[SkillRef])    # подсказки навыков по началу слова (для форм)
+def search_skills(q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50)):
+    return [SkillRef(id=sid, name=name) for sid, name in skill_taxonomy.search(q, limit)]
+
+@app.get("/skills/normalize", response_model=SkillRef)       # во что превратится навык при сохранении
+def normalize_skill(name: str = Query(..., min_length=1)):
+    sid = skill_taxonomy.lookup(name)                        # только поиск: таксономию не пополняем
+    if sid is None:
+        raise HTTPException(status_code=404, detail="Skill not in taxonomy")
+    return SkillRef(id=sid, name=skill_taxonomy.name(sid))
+
+class TaxonomySkillIn(BaseModel):                             # канонический навык для таксономии (админка)
+    name: str = Field(..., min_length=1)                      # каноническое написание
+    aliases: List[str] = Field(default_factory=list)         # синонимы, которые будут сводиться к нему
+
+class UnresolvedSkill(BaseModel):                             # навык вне таксономии
+    name: str                                                 # как его ввели (первое встреченное написание)
+    users: int                                                # у скольких сотрудников
+
+@app.get("/admin/skills/unresolved", response_model=List[UnresolvedSkill])  # кандидаты в канон: навыки без skill_id
+def unresolved_skills(limit: int = Query(50, ge=1, le=500), db: Session = Depends(get_db)):
+    groups: Dict[str, Tuple[str, set]] = {}                  # ключ -> (написание, сотрудники)
+    for name, uid in db.query(Skill.name, Skill.user_id).filter(Skill.skill_id.is_(None)).order_by(Skill.id):
+        groups.setdefault(normalize_skill_key(name), (name, set()))[1].add(uid)
+    top = sorted(groups.values(), key=lambda g: (-len(g[1]), g[0]))[:limit]
+    return [UnresolvedSkill(name=name, users=len(uids)) for name, uids in top]
+
+@app.post("/admin/skills/taxonomy", response_model=SkillRef)  # завести канон/синонимы и привязать к нему ожидающие навыки
+def add_taxonomy_skill(payload: TaxonomySkillIn, db: Session = Depends(get_db)):
+    try:
+        sid = skill_taxonomy.add(db, payload.name, payload.aliases)
+    except (ValueError, IntegrityError) as e:                # синоним уже ведёт на другой навык
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e.orig if isinstance(e, IntegrityError) else e))
+    canon = skill_taxonomy.name(sid, db)
+    keys = {normalize_skill_key(n) for n in (payload.name, *payload.aliases)}
+    has = {uid for (uid,) in db.query(Skill.user_id).filter(Skill.skill_id == sid)}
+    touched: set = set()
+    for sk in db.query(Skill).filter(Skill.skill_id.is_(None)).order_by(Skill.id).all():
+        if normalize_skill_key(sk.name) not in keys:
+            continue
+        if sk.user_id in has:                                 # у сотрудника этот навык уже есть под каноном
+            db.delete(sk)
+        else:
+            sk.skill_id, sk.name = sid, canon
+            has.add(sk.user_id)
+        touched.add(sk.user_id)
+    if touched:                                               # навыки в профилях поменялись: новая версия для ETag
+        db.query(User).filter(User.id.in_(touched)).update({"version": User.version + 1}, synchronize_session=False)
+    db.commit()
+    link_endorsement_counters(db)                             # канон уже в кэше: счётчики эндорсментов — на его id
+    db.commit()
+    return SkillRef(id=sid, name=canon)
+
+@app.get("/skills/{skill_id}/users", response_model=List[int])  # сотрудники с навыком (поиск людей под задачу)
+def users_with_skill(skill_id: int, db: Session = Depends(get_db)):
+    rows = db.query(Skill.user_id).filter(Skill.skill_id == skill_id).distinct().order_by(Skill.user_id).all()  # индекс по skill_id
+    return [uid for (uid,) in rows]
 
 @app.get("/achievements/catalog", response_model=Dict[str, Dict[str, Any]])  # отдать каталог ачивок фронту
 def get_achievements_catalog() -> Dict[str, Dict[str, Any]]:  # сигнатура с типами
-    return ACHIEVEMENTS_CATALOG                               # просто возвращаем словарь
+    if FAST_JSON:                                            # каталог статичен — байты ответа готовы заранее
+        return Response(content=ACHIEVEMENTS_CATALOG_JSON, media_type="application/json")
+    return ACHIEVEMENTS_CATALOG_WITH_LABELS                   # каталог с метками уровней из скомпилированных правил
+
+ACHIEVEMENTS_CATALOG_JSON = json_bytes(ACHIEVEMENTS_CATALOG_WITH_LABELS)  # сериализуем один раз при импорте
+
+# ============================== PDF-РЕЗЮМЕ =====================================
+# Резюме в PDF рендерит fpdf2 (чистый Python), кириллицу даёт TTF-шрифт (PDF_FONT_PATH или DejaVuSans из системы).
+# Готовые файлы лежат в PDF_CACHE_DIR/<user_id>/<ключ>.pdf; ключ — updated_at профиля, ачивки и версия шаблона,
+# поэтому повторная выгрузка неизменного профиля — чтение файла. Подразделение целиком рендерится пулом процессов (spawn,
+# рендер — в resume_pdf.py) в zip, который копится в SpooledTemporaryFile и отдаётся потоком
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(os.path.dirname(DB_PATH) or ".", "pdf_cache"))  # кеш готовых PDF
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))  # процессов для пакетного рендера (0 — в текущем процессе)
+RESUME_ZIP_SPOOL_BYTES = int(os.getenv("RESUME_ZIP_SPOOL_BYTES", str(16 * 1024 * 1024)))  # до стольких байт zip держим в памяти, дальше — во временном файле
+
+def resume_profile(user: User) -> Dict[str, Any]:
+    """Всё, что попадает в PDF, простыми типами: профиль можно передать в другой процесс"""
+    return {
+        "id": user.id, "full_name": user.full_name, "email": user.email, "phone": user.phone or "",
+        "position": user.position or "", "department": user.department or "", "grade": user.grade or "",
+        "experience_years": user.experience_years or 0.0, "resume_text": user.resume_text or "",
+        "skills": [(s.name, s.level or "") for s in user.skills],
+        "projects": [(p.title, p.role or "", p.description or "", p.result_kpi or "") for p in user.projects],
+        "certificates": [(c.name, c.issued_by or "", c.valid_until.isoformat() if c.valid_until else "") for c in user.certificates],
+        "achievements": [(ACHIEVEMENTS_CATALOG.get(a.code, {}).get("title", a.code), a.level, a.xp)
+                         for a in sorted(user.achievements, key=lambda a: a.obtained_at or datetime.min)],
+    }
+
+def resume_cache_keys(db: Session, user_ids: List[int]) -> Dict[int, str]:
+    """Ключи кеша PDF двумя агрегатами на пачку. Ачивки выдаются без изменения users.updated_at — учитываем их отдельно"""
+    ach = {uid: (cnt, last) for uid, cnt, last in
+           db.query(UserAchievement.user_id, func.count(UserAchievement.id), func.max(UserAchievement.obtained_at))
+           .filter(UserAchievement.user_id.in_(user_ids)).group_by(UserAchievement.user_id)}
+    return {uid: hashlib.sha1(f"{PDF_TEMPLATE_VERSION}|{updated_at}|{ach.get(uid)}".encode()).hexdigest()[:16]
+            for uid, updated_at in db.query(User.id, User.updated_at).filter(User.id.in_(user_ids))}
+
+def _resume_cache_get(user_id: int, key: str) -> Optional[bytes]:
+    try:
+        with open(os.path.join(PDF_CACHE_DIR, str(user_id), f"{key}.pdf"), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _resume_cache_put(user_id: int, key: str, data: bytes) -> None:  # атомарная запись; прежние версии резюме удаляем
+    folder = os.path.join(PDF_CACHE_DIR, str(user_id))
+    os.makedirs(folder, exist_ok=True)
+    tmp = os.path.join(folder, f"{key}.pdf.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, os.path.join(folder, f"{key}.pdf"))
+    for name in os.listdir(folder):
+        if name.endswith(".pdf") and name != f"{key}.pdf":
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(folder, name))
+
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+_pdf_executor_lock = threading.Lock()
+
+def _pdf_pool() -> Optional[ProcessPoolExecutor]:
+    """Общий пул рендера. spawn, а не fork: форк из потока запроса копировал бы чужие блокировки и соединения с БД.
+    Процессы поднимаются при первой пачке и живут до остановки API — цену запуска интерпретатора платим один раз"""
+    global _pdf_executor
+    if PDF_WORKERS <= 0:
+        return None
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            _pdf_executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=init_worker, initargs=(pdf_font_path(),))
+        return _pdf_executor
+
+def _drop_pdf_pool() -> None:                                 # остановка API или сломанный пул
+    global _pdf_executor
+    with _pdf_executor_lock:
+        pool, _pdf_executor = _pdf_executor, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+@app.on_event("shutdown")
+def _stop_pdf_pool() -> None:
+    _drop_pdf_pool()
+
+def iter_resumes(db: Session, user_ids: List[int]) -> Iterable[Tuple[int, bytes]]:
+    """(user_id, PDF) пачками по BATCH_CHUNK_SIZE: попадания — из кеша, промахи рендерит пул процессов.
+    В памяти одновременно не больше одной пачки — вызывающий сразу пишет результат дальше"""
+    for i in range(0, len(user_ids), BATCH_CHUNK_SIZE):
+        keys = resume_cache_keys(db, user_ids[i:i + BATCH_CHUNK_SIZE])
+        misses = []
+        for uid, key in keys.items():
+            data = _resume_cache_get(uid, key)
+            if data is None:
+                misses.append(uid)
+            else:
+                yield uid, data
+        if not misses:
+            continue
+        error = pdf_renderer_error()
+        if error:
+            raise HTTPException(status_code=503, detail=error)
+        users = (db.query(User).options(selectinload(User.skills), selectinload(User.projects),
+                                        selectinload(User.certificates), selectinload(User.achievements))
+                 .filter(User.id.in_(misses)).all())
+        profiles = [resume_profile(u) for u in users]
+        db.expunge_all()                                      # пачка уже в простых типах — ORM-объекты не копим
+        pool = _pdf_pool() if len(profiles) > 1 else None     # одно резюме быстрее отрендерить на месте
+        try:
+            rendered = (list(pool.map(render_resume_pdf, profiles, chunksize=max(1, len(profiles) // (4 * PDF_WORKERS))))
+                        if pool is not None else map(render_resume_pdf, profiles))
+        except BrokenProcessPool:                             # процесс пула убит (OOM и т.п.) — следующий запрос получит новый пул
+            _drop_pdf_pool()
+            raise
+        for profile, data in zip(profiles, rendered):
+            _resume_cache_put(profile["id"], keys[profile["id"]], data)
+            yield profile["id"], data
+
+@app.get("/users/{user_id}/resume.pdf")                       # резюме в PDF (повторно — из кеша; If-None-Match -> 304)
+def export_resume_pdf(user_id: int, request: Request, db: Session = Depends(get_db)):
+    key = resume_cache_keys(db, [user_id]).get(user_id)
+    if key is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    headers = {"ETag": f'"{key}"', "Cache-Control": "private, no-cache",
+               "Content-Disposition": f'attachment; filename="resume-{user_id}.pdf"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(dict(iter_resumes(db, [user_id]))[user_id], media_type="application/pdf", headers=headers)
+
+@app.get("/departments/{department}/resumes.zip")             # резюме всего подразделения архивом
+def export_department_resumes(department: str, db: Session = Depends(get_db)):
+    names = dict(db.query(User.id, User.full_name).filter(User.department == department).order_by(User.id))
+    if not names:
+        raise HTTPException(status_code=404, detail="Department not found")
+    spool = tempfile.SpooledTemporaryFile(max_size=RESUME_ZIP_SPOOL_BYTES)
+    try:
+        with zipfile.ZipFile(spool, "w", zipfile.ZIP_STORED) as zf:  # PDF уже сжат — повторно не жмём
+            for uid, data in iter_resumes(db, list(names)):
+                safe_name = re.sub(r"[^\w.-]+", "_", names[uid])
+                zf.writestr(f"{uid}-{safe_name}.pdf", data)
+        size = spool.tell()
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+
+    def chunks() -> Generator[bytes, None, None]:             # отдаём архив кусками и удаляем временный файл
+        with spool:
+            while chunk := spool.read(256 * 1024):
+                yield chunk
+
+    return StreamingResponse(chunks(), media_type="application/zip",
+                             headers={"Content-Length": str(size),
+                                      "Content-Disposition": f"attachment; filename*=UTF-8''{quote(department)}-resumes.zip"})
 
 # ============================== ИИ-КОНСУЛЬТАНТ: КУРСЫ ==========================
 COURSE_CATALOG = [                                           # простой внутренний каталог курсов (пример)
@@ -553,6 +2851,100 @@ COURSE_CATALOG = [                                           # простой в
     {"id": "soft-com", "title": "Коммуникации и командная работа", "skills": ["Коммуникации", "Soft Skills"], "provider": "PROMIS.Academy"},        # курс 6
 ]
 
+# ============================== ИСТОРИЯ ДИАЛОГА И СКОЛЬЗЯЩАЯ СВОДКА ============
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1200"))  # сколько токенов истории кладём в промпт
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "20"))    # потолок числа последних реплик
+CHAT_SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "2000"))        # потолок длины сводки (символы)
+
+def load_chat_context(db: Session, user_id: int) -> Dict[str, Any]:  # сводка + свежие реплики, не вошедшие в неё
+    summary_row = db.query(ChatSummary).filter_by(user_id=user_id).first()  # скользящая сводка пользователя
+    last_id = summary_row.last_message_id if summary_row else 0  # всё до этого id уже учтено в сводке
+    rows = (db.query(ChatMessage)                             # последние реплики после сводки (индекс user_id, id)
+            .filter(ChatMessage.user_id == user_id, ChatMessage.id > last_id)
+            .order_by(ChatMessage.id.desc()).limit(CHAT_HISTORY_MAX_MESSAGES).all())
+    history: List[Dict[str, str]] = []                        # реплики от новых к старым, пока влезают в бюджет
+    used = 0
+    for m in rows:
+        cost = estimate_tokens(m.content)
+        if history and used + cost > CHAT_HISTORY_TOKEN_BUDGET:  # самую свежую реплику берём всегда
+            break
+        history.append({"role": m.role, "content": m.content})
+        used += cost
+    history.reverse()                                         # в промпт — в хронологическом порядке
+    return {"summary": summary_row.summary if summary_row else "", "history": history}
+
+def _fold_into_summary(summary: str, messages: List[ChatMessage]) -> str:  # добавляем выпавшие реплики в сводку
+    dialog = "\n".join(f"{m.role}: {m.content}" for m in messages)
+    if llm_gateway.available():                               # пробуем сжать силами LLM
+        try:
+            reply = llm_gateway.complete("chat_summary",
+                messages=[{"role": "user", "content":
+                    "Обнови краткую сводку карьерной консультации. Сохрани цели, факты о сотруднике и договорённости, "
+                    f"не длиннее {CHAT_SUMMARY_MAX_CHARS // 2} символов.\n\nТекущая сводка:\n{summary or '—'}\n\nНовые реплики:\n{dialog}"
+                }],
+                temperature=0.2, max_tokens=400
+            )
+            return reply[-CHAT_SUMMARY_MAX_CHARS:]            # жёстко держим потолок длины
+        except Exception as e:
+            logger.warning("Не удалось обновить сводку через LLM: %s: %s", type(e).__name__, e)
+    # Запасной вариант без LLM: по строке на реплику, старое отрезаем с начала
+    lines = [f"{m.role}: {' '.join(m.content.split())[:160]}" for m in messages]
+    merged = "\n".join(([summary] if summary else []) + lines)
+    return merged[-CHAT_SUMMARY_MAX_CHARS:]
+
+def update_chat_summary(db: Session, user_id: int) -> None:  # инкрементально сворачиваем хвост, не влезающий в бюджет
+    summary_row = db.query(ChatSummary).filter_by(user_id=user_id).first()
+    seen = summary_row.last_message_id if summary_row else 0  # до вызова LLM ничего не пишем: блокировка записи не держится
+    pending = (db.query(ChatMessage)                          # реплики, ещё не вошедшие в сводку
+               .filter(ChatMessage.user_id == user_id, ChatMessage.id > seen)
+               .order_by(ChatMessage.id.desc()).all())
+    keep, used = 0, 0                                         # сколько свежих реплик остаётся «как есть»
+    for m in pending:
+        cost = estimate_tokens(m.content)
+        if keep >= CHAT_HISTORY_MAX_MESSAGES or (keep and used + cost > CHAT_HISTORY_TOKEN_BUDGET):
+            break
+        keep += 1
+        used += cost
+    overflow = list(reversed(pending[keep:]))                 # старые реплики, которые уже не попадут в промпт
+    if not overflow:                                          # всё влезает — сводку не трогаем
+        return
+    summary = _fold_into_summary(summary_row.summary if summary_row else "", overflow)
+    if summary_row is None:                                   # первая сводка пользователя
+        summary_row = ChatSummary(user_id=user_id)
+        db.add(summary_row)
+    summary_row.summary = summary
+    summary_row.last_message_id = overflow[-1].id             # дальше сворачиваем только более новые сообщения
+
+@job_handler("chat_summary")
+def run_chat_summary_job(db: Session, payload: Dict[str, Any]) -> None:  # сводка сворачивается вне запроса к консультанту
+    update_chat_summary(db, payload["user_id"])
+
+class ChatHistoryItem(BaseModel):                             # реплика для восстановления чата
+    id: int                                                   # id сообщения (курсор пагинации)
+    role: str                                                 # 'user' или 'assistant'
+    content: str                                              # текст
+    created_at: datetime                                      # время создания
+
+class ChatHistoryPage(BaseModel):                             # страница истории
+    messages: List[ChatHistoryItem]                           # реплики в хронологическом порядке
+    next_before_id: Optional[int]                             # курсор для следующей (более старой) страницы; None — дальше пусто
+
+@app.get("/users/{user_id}/chat/history", response_model=ChatHistoryPage)  # постраничная история чата
+def get_chat_history(user_id: int, before_id: Optional[int] = Query(None, description="Вернуть сообщения старше этого id"),
+                     limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_db)):
+    if db.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    q = db.query(ChatMessage).filter(ChatMessage.user_id == user_id)  # keyset-пагинация по индексу (user_id, id)
+    if before_id is not None:
+        q = q.filter(ChatMessage.id < before_id)
+    rows = q.order_by(ChatMessage.id.desc()).limit(limit + 1).all()  # +1 строка, чтобы понять, есть ли ещё
+    has_more = len(rows) > limit
+    rows = list(reversed(rows[:limit]))                      # отдаём от старых к новым
+    return ChatHistoryPage(
+        messages=[ChatHistoryItem(id=m.id, role=m.role, content=m.content, created_at=m.created_at) for m in rows],
+        next_before_id=rows[0].id if (has_more and rows) else None
+    )
+
 # ============================== LANGGRAPH: СОСТОЯНИЕ И УЗЛЫ ====================
 class ChatState(TypedDict):                                   # типизированное состояние для графа
     user_id: int                                              # идентификатор пользователя
@@ -560,65 +2952,99 @@ class ChatState(TypedDict):                                   # типизиро
     profile: Dict[str, Any]                                   # агрегированный профиль (роль/отдел/навыки/проекты/резюме)
     rec_courses: List[Dict[str, Any]]                         # персональные курсы (топ-3)
     llm_reply: str                                            # финальный ответ ассистента
+    history: List[Dict[str, str]]                             # последние реплики диалога (в пределах бюджета токенов)
+    summary: str                                              # скользящая сводка более старой части диалога
 
 def node_load_profile(state: ChatState, db: Session) -> Dict[str, Any]:  # узел 1: загрузка профиля
     user = db.get(User, state["user_id"])                     # читаем пользователя из БД
     if not user:                                              # если не найден
         raise HTTPException(status_code=404, detail="User not found")  # возвращаем 404
     skills = [s.name for s in user.skills]                    # собираем названия навыков
+    skill_ids = [s.skill_id for s in user.skills if s.skill_id is not None]  # те же навыки как id таксономии
     projects = [{"title": p.title, "role": p.role, "kpi": p.result_kpi} for p in user.projects]  # собираем проекты
     profile = {                                               # агрегируем профиль для LLM
         "full_name": user.full_name,                          # ФИО
         "role": user.position,                                # должность
         "department": user.department,                        # подразделение
         "skills": skills,                                     # список навыков
+        "skill_ids": skill_ids,                               # id навыков для сопоставления с курсами
         "resume": (user.resume_text or ""),                   # резюме (строка; защита от None)
         "projects": projects                                  # список проектов
     }
-    return {"profile": profile}                               # возвращаем часть стейта для следующего узла
+    context = load_chat_context(db, user.id)                  # сводка и свежая история диалога
+    trace_attrs(skills=len(skills), projects=len(projects), resume_chars=len(profile["resume"]),
+                history_messages=len(context["history"]), summary_chars=len(context["summary"]))
+    return {"profile": profile, **context}
+
+_course_skill_ids: Dict[str, Tuple[int, ...]] = {}            # id курса -> id навыков (заполняется при первом подборе)
 
-def _score_course(profile_skills: List[str], course_skills: List[str]) -> int:  # вспомогательный скоринг курса
-    overlap = len(set(s.lower() for s in profile_skills) & set(cs.lower() for cs in course_skills))  # пересечение навыков
-    return len(course_skills) - overlap                        # чем больше недостаёт навыков, тем выше приоритет
+def course_skill_ids(course: Dict[str, Any]) -> Tuple[int, ...]:  # навыки курса как id таксономии
+    ids = _course_skill_ids.get(course["id"])
+    if ids is None:
+        ids = _course_skill_ids[course["id"]] = tuple(sorted({sid for sid in map(skill_taxonomy.lookup, course["skills"]) if sid is not None}))
+    return ids
+
+def _score_course(profile_skill_ids: "set[int] | frozenset[int]", course_ids: Tuple[int, ...]) -> int:  # вспомогательный скоринг курса
+    overlap = sum(1 for sid in course_ids if sid in profile_skill_ids)  # пересечение навыков по id
+    return len(course_ids) - overlap                           # чем больше недостаёт навыков, тем выше приоритет
 
 def node_personalize_courses(state: ChatState) -> Dict[str, Any]:  # узел 2: персонализация курсов
     prof = state["profile"]                                    # берём профиль из состояния
-    skills = prof.get("skills", [])                            # получаем список навыков
+    skill_ids = frozenset(prof.get("skill_ids", []))           # навыки профиля как множество id
     scored = []                                                # список (скор, курс)
     for c in COURSE_CATALOG:                                   # проходим весь каталог
-        scored.append((_score_course(skills, c["skills"]), c)) # считаем скоринг и добавляем пару
+        scored.append((_score_course(skill_ids, course_skill_ids(c)), c))  # считаем скоринг и добавляем пару
     scored.sort(key=lambda x: x[0], reverse=True)              # сортируем по убыванию (больше gap — выше)
     rec = [x[1] for x in scored[:3]]                           # берём топ-3 курса
+    trace_attrs(catalog_size=len(COURSE_CATALOG), courses=len(rec))
     return {"rec_courses": rec}                                # возвращаем персональные курсы
 
 
 def node_llm_reply(state: ChatState) -> Dict[str, Any]:
     """Узел 3: генерация ответа LLM с улучшенным обработчиком ошибок"""
-    client = scibox_client()  # создаём клиента Scibox (или None)
     prof = state["profile"]  # профиль
     courses = state["rec_courses"]  # подобранные курсы
 
     # Формируем человекочитаемый список курсов
-    course_lines = "\n".join([
-        f"- {c['title']} ({c['provider']}) — фокус: {', '.join(c['skills'])}" for c in courses
-    ])
-
-    # Формируем промпт для модели
-    base_prompt = (
-        "Ты — корпоративный ИИ-карьерный консультант. Дай персональные рекомендации, "
-        "выяви пробелы компетенций и предложи 2-недельный план (микрошаги по 30–60 минут). Пиши кратко, пунктами.\n\n"
-        f"Профиль: роль={prof.get('role')}, отдел={prof.get('department')}, навыки={', '.join(prof.get('skills', []))}.\n"
-        f"Проекты: {', '.join(p['title'] for p in prof.get('projects', [])) or '—'}.\n"
-        f"Резюме (кратко): {(prof.get('resume') or '')[:300]}.\n\n"
-        f"Персональные курсы (под возможные пробелы):\n{course_lines}\n\n"
-        f"Вопрос пользователя: {state['message']}\n\n"
-        "Ответь: 1) Роли/возможности внутри компании; 2) Топ-курсы из списка и почему; "
-        "3) Отсутствующие компетенции; 4) Пошаговый план на 2 недели с метриками прогресса."
+    course_lines = [f"- {c['title']} ({c['provider']}) — фокус: {', '.join(c['skills'])}" for c in courses]
+
+    # Ранжируем элементы секций: навыки из подобранных курсов и проекты с KPI — вперёд (сортировка устойчивая)
+    course_ids = {sid for c in courses for sid in course_skill_ids(c)}
+    skills = sorted(prof.get("skills", []), key=lambda sk: skill_taxonomy.lookup(sk) not in course_ids)
+    projects = [p["title"] for p in sorted(prof.get("projects", []), key=lambda p: not p.get("kpi"))]
+
+    # Формируем промпт для модели в пределах LLM_PROMPT_TOKEN_BUDGET
+    builder = (
+        PromptBuilder(LLM_PROMPT_TOKEN_BUDGET)
+        .fixed("Ты — корпоративный ИИ-карьерный консультант. Дай персональные рекомендации, "
+               "выяви пробелы компетенций и предложи 2-недельный план (микрошаги по 30–60 минут). Пиши кратко, пунктами.\n\n"
+               f"Профиль: роль={prof.get('role')}, отдел={prof.get('department')}, ")
+        .items("skills", "навыки={}.\n", skills, priority=2)
+        .items("projects", "Проекты: {}.\n", projects, priority=3)
+        .text("resume", "Резюме (кратко): {}.\n\n", (prof.get("resume") or "")[:300], priority=4)
+        .items("courses", "Персональные курсы (под возможные пробелы):\n{}\n\n", course_lines, priority=1, sep="\n")
+        .fixed(f"Вопрос пользователя: {state['message']}\n\n"
+               "Ответь: 1) Роли/возможности внутри компании; 2) Топ-курсы из списка и почему; "
+               "3) Отсутствующие компетенции; 4) Пошаговый план на 2 недели с метриками прогресса.")
     )
+    base_prompt = builder.build()
+    if builder.dropped:                                        # промпт не влез целиком — фиксируем, что урезали
+        logger.info("Промпт урезан до ~%d токенов: %s", builder.used_tokens, builder.dropped,
+                    extra={"fields": {"used_tokens": builder.used_tokens, "dropped": builder.dropped}})
+
+    # Контекст диалога: сводка старой части + последние реплики как отдельные сообщения
+    messages: List[Dict[str, str]] = []
+    if state.get("summary"):
+        messages.append({"role": "system", "content": f"Сводка предыдущей консультации:\n{state['summary']}"})
+    messages.extend(state.get("history", []))
+    messages.append({"role": "user", "content": base_prompt})
+    trace_attrs(prompt_chars=len(base_prompt), prompt_tokens=builder.used_tokens, messages=len(messages),
+                prompt_dropped=",".join(builder.dropped))
 
     # Если клиент не создан (нет API ключа)
-    if not client:
-        print("Scibox клиент не инициализирован. Проверьте API ключ и URL.")
+    if not llm_gateway.available():
+        logger.warning("Scibox клиент не инициализирован. Проверьте API ключ и URL.")
+        trace_attrs(llm="fallback")
         return {
             "llm_reply": "Курсы подобраны. Начните с №1, затем №2. Пробелы: KPI, риски, коммуникации. "
                          "План на 2 недели: выполнить вводные модули, описать 3 KPI, оформить risk-log, "
@@ -627,30 +3053,29 @@ def node_llm_reply(state: ChatState) -> Dict[str, Any]:
 
     try:
         # Пробуем вызвать модель
-        print(f"Отправка запроса к Scibox API с промптом длиной {len(base_prompt)} символов")
+        logger.debug("Отправка запроса к Scibox API с промптом длиной %d символов (~%d токенов)", len(base_prompt), builder.used_tokens)
 
-        resp = client.chat.completions.create(
-            model="Qwen2.5-72B-Instruct-AWQ",
-            messages=[{"role": "user", "content": base_prompt}],
+        reply = llm_gateway.complete(
+            "consultant_chat",
+            priority=PRIORITY_INTERACTIVE,
+            messages=messages,
             temperature=0.3,
             top_p=0.9,
             max_tokens=700
         )
 
-        print("Успешно получен ответ от Scibox API")
-        return {"llm_reply": resp.choices[0].message.content}
+        logger.debug("Успешно получен ответ от Scibox API")
+        trace_attrs(llm="ok", reply_chars=len(reply))
+        return {"llm_reply": reply}
 
     except Exception as e:
         # Детальное логирование ошибки
-        error_msg = f"Ошибка при обращении к Scibox API: {type(e).__name__}: {str(e)}"
-        print(error_msg)
-
-        # Логируем первые 200 символов промпта для отладки
-        print(f"Промпт (первые 200 символов): {base_prompt[:200]}...")
+        logger.error("Ошибка при обращении к Scibox API: %s: %s", type(e).__name__, e,
+                     extra={"fields": {"base_url": SCIBOX_BASE_URL, "api_key_set": bool(SCIBOX_API_KEY)}})
 
-        # Логируем информацию о клиенте (без ключа)
-        print(f"Scibox base URL: {SCIBOX_BASE_URL}")
-        print(f"Scibox API key: {'установлен' if SCIBOX_API_KEY else 'не установлен'}")
+        # Первые 200 символов промпта — только на уровне DEBUG (в промпте персональные данные)
+        logger.debug("Промпт (первые 200 символов): %s...", base_prompt[:200])
+        trace_attrs(llm="error", error=f"{type(e).__name__}: {e}")
 
         return {
             "llm_reply": "Не удалось получить ответ от LLM. Используйте предложенную подборку курсов и начните с самого релевантного."
@@ -659,19 +3084,27 @@ def node_llm_reply(state: ChatState) -> Dict[str, Any]:
 def node_save_history(state: ChatState, db: Session) -> Dict[str, Any]:  # узел 4: логируем диалог
     db.add(ChatMessage(user_id=state["user_id"], role="user", content=state["message"]))      # сохраняем реплику пользователя
     db.add(ChatMessage(user_id=state["user_id"], role="assistant", content=state["llm_reply"]))  # сохраняем ответ ассистента
+    enqueue_job(db, "chat_summary", {"user_id": state["user_id"]},  # выпавшее из бюджета истории свернёт воркер
+                dedup_key=f"chat_summary:{state['user_id']}")
     db.commit()                                                # коммитим транзакцию
     return {}                                                  # узел не меняет состояние
 
+def traced_node(name: str, fn: Callable[[ChatState], Dict[str, Any]]) -> Callable[[ChatState], Dict[str, Any]]:
+    def run(state: ChatState) -> Dict[str, Any]:               # каждый узел — отдельный спан consultant.<name>
+        with trace_span(f"consultant.{name}"):
+            return fn(state)
+    return run
+
 def build_graph(db: Session) -> StateGraph:                    # сборка графа для конкретной сессии БД
     graph = StateGraph(ChatState)                              # создаём граф с типизированным состоянием
     def _load_profile(state: ChatState) -> Dict[str, Any]:     # обёртка для доступа к db внутри узла
         return node_load_profile(state, db)                    # вызываем узел загрузки профиля
     def _save(state: ChatState) -> Dict[str, Any]:             # обёртка для сохранения истории
         return node_save_history(state, db)                    # вызываем узел записи истории
-    graph.add_node("load_profile", _load_profile)              # регистрируем узел загрузки профиля
-    graph.add_node("personalize", node_personalize_courses)    # регистрируем узел персонализации курсов
-    graph.add_node("llm", node_llm_reply)                      # регистрируем узел вызова LLM
-    graph.add_node("save", _save)                              # регистрируем узел сохранения истории
+    graph.add_node("load_profile", traced_node("load_profile", _load_profile))  # регистрируем узел загрузки профиля
+    graph.add_node("personalize", traced_node("personalize", node_personalize_courses))  # регистрируем узел персонализации курсов
+    graph.add_node("llm", traced_node("llm", node_llm_reply))  # регистрируем узел вызова LLM
+    graph.add_node("save", traced_node("save", _save))         # регистрируем узел сохранения истории
     graph.set_entry_point("load_profile")                      # входная точка графа — загрузка профиля
     graph.add_edge("load_profile", "personalize")              # ребро: профиль -> персонализация
     graph.add_edge("personalize", "llm")                       # ребро: персонализация -> LLM
@@ -689,17 +3122,561 @@ class ChatResponse(BaseModel):                                 # выход дл
     courses: List[Dict[str, Any]]                              # список рекомендованных курсов
 
 @app.post("/ai/consultant/chat", response_model=ChatResponse)  # endpoint чата
-def ai_consultant_chat(payload: ChatRequest, db: Session = Depends(get_db)):  # зависимость на БД
-    init_state: ChatState = {"user_id": payload.user_id, "message": payload.message, "profile": {}, "rec_courses": [], "llm_reply": ""}  # стартовое состояние
-    graph = build_graph(db)                                    # строим граф
-    app_graph = graph.compile()                                # компилируем в исполняемую машину
-    final_state: Dict[str, Any] = app_graph.invoke(init_state) # запускаем граф синхронно и получаем финальное состояние
+def ai_consultant_chat(payload: ChatRequest, request: Request, response: Response, db: Session = Depends(get_db)):  # зависимость на БД
+    init_state: ChatState = {"user_id": payload.user_id, "message": payload.message, "profile": {}, "rec_courses": [], "llm_reply": "", "history": [], "summary": ""}  # стартовое состояние
+    with trace_span("consultant.chat", user_id=payload.user_id, message_chars=len(payload.message)) as span:  # корневой спан запроса
+        graph = build_graph(db)                                # строим граф
+        app_graph = graph.compile()                            # компилируем в исполняемую машину
+        final_state: Dict[str, Any] = app_graph.invoke(init_state)  # запускаем граф синхронно и получаем финальное состояние
+    if DEBUG_TIMING or request.headers.get("x-debug-timing") == "1":  # разбивка по этапам для отладки
+        response.headers["Server-Timing"] = server_timing(span)
     return ChatResponse(reply=final_state["llm_reply"], courses=final_state["rec_courses"])  # формируем ответ фронту
 
+# ============================== HR-АНАЛИТИКА ===================================
+# Отчёты для HR по подразделениям: матрица «подразделение × навык», пробелы относительно спроса ролей и курсов,
+# горизонты истечения сертификатов, распределение ачивок. Данные выгружаются одним запросом на таблицу в колонки
+# (списки индексов), агрегаты считаются таблицами сопряжённости (numpy, если установлен). Результаты кешируются
+# до изменения исходных таблиц: коммит, затронувший их, увеличивает поколение данных
+ANALYTICS_TABLES = frozenset({"users", "skills", "skill_taxonomy", "projects", "certificates", "user_achievements"})
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "300"))          # потолок жизни кеша (сек): записи других процессов не видны событиям
+ANALYTICS_ROLE_DEMAND_SHARE = float(os.getenv("ANALYTICS_ROLE_DEMAND_SHARE", "0.3"))  # навык нужен роли, если он есть у такой доли её сотрудников
+ANALYTICS_ROLE_MIN_PEERS = int(os.getenv("ANALYTICS_ROLE_MIN_PEERS", "3"))    # меньше сотрудников в роли — спрос по ней не считаем
+ANALYTICS_NO_DEPARTMENT = "Без подразделения"                 # метка для пустого подразделения
+ANALYTICS_XP_BUCKETS = (0, 100, 250, 500, 1000, 2500, 5000)    # нижние границы корзин XP
+
+class DataGeneration:
+    """Поколение данных аналитики. Запись в отслеживаемую таблицу помечает соединение, коммит увеличивает счётчик.
+    Второй раз счётчик растёт в after_commit сессии — уже после фактического коммита, чтобы отчёт,
+    посчитанный по старым данным в промежутке, не закешировался под новым поколением"""
+    def __init__(self, tables: frozenset):
+        self.tables = tables
+        self.value = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()                       # коммит соединения -> after_commit сессии в том же потоке
+
+    def bump(self) -> None:
+        with self._lock:
+            self.value += 1
+
+data_generation = DataGeneration(ANALYTICS_TABLES)
+
+@event.listens_for(engine, "after_cursor_execute")
+def _track_analytics_writes(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is None or not (context.isinsert or context.isupdate or context.isdelete):
+        return
+    table = getattr(getattr(context.compiled, "statement", None), "table", None)
+    if getattr(table, "name", None) in data_generation.tables:
+        conn.info["analytics_dirty"] = True
+
+@event.listens_for(engine, "commit")
+def _analytics_commit(conn) -> None:
+    if conn.info.pop("analytics_dirty", False):
+        data_generation.bump()
+        data_generation._local.pending = True
+
+@event.listens_for(engine, "rollback")
+def _analytics_rollback(conn) -> None:
+    conn.info.pop("analytics_dirty", None)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _analytics_after_commit(session: Session) -> None:
+    if getattr(data_generation._local, "pending", False):
+        data_generation._local.pending = False
+        data_generation.bump()
+
+class AnalyticsCache:
+    """Кеш отчётов по ключу: запись годна, пока не сменилось поколение данных и не истёк TTL"""
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[Any, Tuple[int, float, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any, compute: Callable[[], Any]) -> Any:
+        gen = data_generation.value                           # поколение до расчёта: запись во время расчёта его устарит
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == gen and time.monotonic() - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[2]
+        value = compute()
+        with self._lock:
+            self.misses += 1
+            self._entries = {k: e for k, e in self._entries.items() if e[0] == gen}  # записи прошлых поколений не нужны
+            self._entries[key] = (gen, time.monotonic(), value)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"generation": data_generation.value, "entries": len(self._entries), "hits": self.hits,
+                    "misses": self.misses, "ttl_sec": self.ttl, "numpy": np is not None}
+
+analytics_cache = AnalyticsCache(ANALYTICS_CACHE_TTL)
+
+def _crosstab(row_idx: List[int], col_idx: List[int], n_rows: int, n_cols: int) -> List[List[int]]:
+    """Таблица сопряжённости: сколько раз встретилась пара (строка, столбец)"""
+    if np is not None and row_idx:
+        flat = np.asarray(row_idx, dtype=np.int64) * n_cols + np.asarray(col_idx, dtype=np.int64)
+        return np.bincount(flat, minlength=n_rows * n_cols).reshape(n_rows, n_cols).tolist()
+    mat = [[0] * n_cols for _ in range(n_rows)]
+    for r, c in zip(row_idx, col_idx):
+        mat[r][c] += 1
+    return mat
+
+class _Index:                                                 # значение -> порядковый номер (коды для колонок)
+    def __init__(self):
+        self.values: List[Any] = []
+        self._pos: Dict[Any, int] = {}
+
+    def __call__(self, value: Any) -> int:
+        pos = self._pos.get(value)
+        if pos is None:
+            pos = self._pos[value] = len(self.values)
+            self.values.append(value)
+        return pos
+
+class HrSnapshot:
+    """Колоночная выгрузка для аналитики: по одному запросу на таблицу, строки — индексы сотрудников/навыков"""
+    def __init__(self, db: Session):
+        depts, positions = _Index(), _Index()
+        self.user_row: Dict[int, int] = {}                   # id пользователя -> номер строки
+        self.user_dept: List[int] = []                        # номер подразделения по строке
+        self.user_pos: List[int] = []                         # номер должности по строке
+        for uid, dept, pos in db.query(User.id, User.department, User.position).order_by(User.id):
+            self.user_row[uid] = len(self.user_dept)
+            self.user_dept.append(depts((dept or "").strip() or ANALYTICS_NO_DEPARTMENT))
+            self.user_pos.append(positions((pos or "").strip().casefold()))
+        self.departments: List[str] = depts.values
+        self.positions: List[str] = positions.values
+
+        skills = _Index()
+        self.skill_names: Dict[int, str] = {}
+        pairs = set()                                         # (строка сотрудника, номер навыка) без повторов
+        for uid, sid, name in (db.query(Skill.user_id, Skill.skill_id, TaxonomySkill.name)
+                               .join(TaxonomySkill, TaxonomySkill.id == Skill.skill_id)):
+            if uid in self.user_row:
+                pairs.add((self.user_row[uid], skills(sid)))
+                self.skill_names[sid] = name
+        self.skill_ids: List[int] = skills.values
+        self.skill_col: Dict[int, int] = {sid: i for i, sid in enumerate(self.skill_ids)}
+        self.us_user = [u for u, _ in pairs]
+        self.us_skill = [s for _, s in pairs]
+
+        self.project_user: List[int] = []
+        self.project_kpi: List[int] = []
+        for uid, kpi in db.query(Project.user_id, Project.result_kpi):
+            if uid in self.user_row:
+                self.project_user.append(self.user_row[uid])
+                self.project_kpi.append(1 if (kpi or "").strip() else 0)
+
+        self.cert_user: List[int] = []
+        self.cert_valid_until: List[Optional[date]] = []
+        for uid, valid_until in db.query(Certificate.user_id, Certificate.valid_until):
+            if uid in self.user_row:
+                self.cert_user.append(self.user_row[uid])
+                self.cert_valid_until.append(valid_until)
+
+        self.ach_user: List[int] = []
+        self.ach_code: List[str] = []
+        self.ach_level: List[str] = []
+        self.ach_xp: List[int] = []
+        for uid, code, level, xp in db.query(UserAchievement.user_id, UserAchievement.code, UserAchievement.level, UserAchievement.xp):
+            if uid in self.user_row:
+                self.ach_user.append(self.user_row[uid])
+                self.ach_code.append(code)
+                self.ach_level.append(level)
+                self.ach_xp.append(xp or 0)
+
+    def headcount(self) -> List[int]:                         # сотрудников по подразделениям
+        counts = [0] * len(self.departments)
+        for d in self.user_dept:
+            counts[d] += 1
+        return counts
+
+def hr_snapshot(db: Session) -> HrSnapshot:
+    return analytics_cache.get("snapshot", lambda: HrSnapshot(db))
+
+def department_skill_matrix(db: Session) -> Dict[str, Any]:
+    """Подразделение × навык: число сотрудников с навыком; плюс численность и проекты по подразделениям"""
+    def compute() -> Dict[str, Any]:
+        snap = hr_snapshot(db)
+        matrix = _crosstab([snap.user_dept[u] for u in snap.us_user], snap.us_skill, len(snap.departments), len(snap.skill_ids))
+        projects = _crosstab([snap.user_dept[u] for u in snap.project_user], snap.project_kpi, len(snap.departments), 2)
+        totals = [sum(col) for col in zip(*matrix)] if matrix else []
+        return {
+            "departments": [{"name": name, "headcount": hc, "projects": p[0] + p[1], "projects_with_kpi": p[1]}
+                            for name, hc, p in zip(snap.departments, snap.headcount(), projects)],
+            "skills": [{"id": sid, "name": snap.skill_names[sid], "users": totals[i]} for i, sid in enumerate(snap.skill_ids)],
+            "matrix": matrix,
+        }
+    return analytics_cache.get("skill_matrix", compute)
+
+def role_skill_demand(db: Session) -> Dict[int, List[int]]:
+    """Спрос ролей: должность -> навыки, которые есть у ANALYTICS_ROLE_DEMAND_SHARE её сотрудников по всей компании"""
+    def compute() -> Dict[int, List[int]]:
+        snap = hr_snapshot(db)
+        by_pos = _crosstab([snap.user_pos[u] for u in snap.us_user], snap.us_skill, len(snap.positions), len(snap.skill_ids))
+        peers = [0] * len(snap.positions)
+        for p in snap.user_pos:
+            peers[p] += 1
+        return {p: [s for s, cnt in enumerate(row) if cnt >= ANALYTICS_ROLE_DEMAND_SHARE * peers[p]]
+                for p, row in enumerate(by_pos) if snap.positions[p] and peers[p] >= ANALYTICS_ROLE_MIN_PEERS}
+    return analytics_cache.get("role_demand", compute)
+
+def department_skill_gaps(db: Session, department: str) -> Optional[Dict[str, Any]]:
+    """Каких навыков не хватает подразделению: относительно спроса ролей его сотрудников и навыков из каталога курсов"""
+    def compute() -> Optional[Dict[str, Any]]:
+        snap = hr_snapshot(db)
+        if department not in snap.departments:
+            return None
+        d = snap.departments.index(department)
+        rows = [u for u, ud in enumerate(snap.user_dept) if ud == d]
+        has = set(zip(snap.us_user, snap.us_skill))
+        demand = role_skill_demand(db)
+        required: Dict[int, List[int]] = {}                   # навык -> [нужен стольким, есть у стольких из них]
+        for u in rows:
+            for s in demand.get(snap.user_pos[u], ()):
+                acc = required.setdefault(s, [0, 0])
+                acc[0] += 1
+                acc[1] += (u, s) in has
+        role_gaps = sorted(({"skill_id": snap.skill_ids[s], "skill": snap.skill_names[snap.skill_ids[s]], "required": need,
+                             "have": got, "missing": need - got, "coverage": round(got / need, 3)}
+                            for s, (need, got) in required.items() if need > got),
+                           key=lambda g: (-g["missing"], g["skill"]))
+        have_in_dept: Dict[int, int] = {}
+        for u, s in has:
+            if snap.user_dept[u] == d:
+                have_in_dept[s] = have_in_dept.get(s, 0) + 1
+        course_skills: Dict[int, List[str]] = {}
+        for course in COURSE_CATALOG:
+            for sid in course_skill_ids(course):
+                course_skills.setdefault(sid, []).append(course["id"])
+        course_coverage = sorted(({"skill_id": sid, "skill": skill_taxonomy.name(sid, db) or str(sid), "courses": courses,
+                                   "have": have_in_dept.get(snap.skill_col.get(sid, -1), 0),
+                                   "coverage": round(have_in_dept.get(snap.skill_col.get(sid, -1), 0) / len(rows), 3) if rows else 0.0}
+                                  for sid, courses in course_skills.items()),
+                                 key=lambda c: (c["coverage"], c["skill"]))
+        return {"department": department, "headcount": len(rows), "role_gaps": role_gaps, "course_coverage": course_coverage}
+    return analytics_cache.get(("skill_gaps", department), compute)
+
+def certificate_expiry_horizons(db: Session, horizons: Tuple[int, ...]) -> Dict[str, Any]:
+    """Сертификаты по подразделениям: просроченные, истекающие между соседними горизонтами (дней; корзины не пересекаются:
+    0_30d, 31_90d, ...), позже последнего горизонта и бессрочные"""
+    today = date.today()
+    def compute() -> Dict[str, Any]:
+        snap = hr_snapshot(db)
+        starts = (0,) + tuple(h + 1 for h in horizons[:-1])
+        labels = ["expired"] + [f"{lo}_{h}d" for lo, h in zip(starts, horizons)] + [f"after_{horizons[-1]}d", "no_expiry"]
+        buckets = []
+        for vu in snap.cert_valid_until:                      # номер корзины: 0 — просрочен, далее по горизонтам
+            if vu is None:
+                buckets.append(len(labels) - 1)
+            elif vu < today:
+                buckets.append(0)
+            else:
+                buckets.append(1 + bisect_left(horizons, (vu - today).days))
+        table = _crosstab([snap.user_dept[u] for u in snap.cert_user], buckets, len(snap.departments), len(labels))
+        return {"as_of": today.isoformat(), "horizons_days": list(horizons), "buckets": labels,
+                "departments": [{"name": name, **dict(zip(labels, row))} for name, row in zip(snap.departments, table)],
+                "total": dict(zip(labels, (sum(col) for col in zip(*table)))) if table else dict.fromkeys(labels, 0)}
+    return analytics_cache.get(("cert_expiry", horizons, today), compute)
+
+def achievement_distribution(db: Session) -> Dict[str, Any]:
+    """Распределение ачивок: сотрудники по уровням каждой ачивки, охват ачивками по подразделениям, гистограмма XP"""
+    def compute() -> Dict[str, Any]:
+        snap = hr_snapshot(db)
+        levels: Dict[Tuple[str, str], set] = {}
+        for u, code, level in zip(snap.ach_user, snap.ach_code, snap.ach_level):
+            levels.setdefault((code, level), set()).add(u)
+        codes = _Index()
+        pairs = {(u, codes(code)) for u, code in zip(snap.ach_user, snap.ach_code)}
+        by_dept = _crosstab([snap.user_dept[u] for u, _ in pairs], [c for _, c in pairs], len(snap.departments), len(codes.values))
+        xp = [0] * len(snap.user_dept)
+        for u, value in zip(snap.ach_user, snap.ach_xp):
+            xp[u] += value
+        hist = [0] * len(ANALYTICS_XP_BUCKETS)
+        for value in xp:
+            hist[bisect_right(ANALYTICS_XP_BUCKETS, value) - 1] += 1
+        xp_sorted = sorted(xp)
+        return {
+            "levels": sorted(({"code": code, "level": level, "users": len(us)} for (code, level), us in levels.items()),
+                             key=lambda r: (r["code"], -r["users"], r["level"])),
+            "codes": codes.values,
+            "departments": [{"name": name, "headcount": hc, "users_by_code": dict(zip(codes.values, row))}
+                            for name, hc, row in zip(snap.departments, snap.headcount(), by_dept)],
+            "xp_histogram": [{"from": lo, "to": hi, "users": n} for lo, hi, n in
+                             zip(ANALYTICS_XP_BUCKETS, ANALYTICS_XP_BUCKETS[1:] + (None,), hist)],
+            "xp_percentiles": {f"p{q}": _percentile(xp_sorted, q / 100) for q in (50, 90, 99)},
+            "users_without_achievements": sum(1 for value in xp if value == 0),
+        }
+    return analytics_cache.get("achievement_distribution", compute)
+
+@app.get("/analytics/skill-matrix", response_model=dict)      # подразделение × навык
+def analytics_skill_matrix(department: Optional[str] = Query(None, description="Только это подразделение"),
+                           limit: int = Query(50, ge=1, le=1000, description="Сколько самых распространённых навыков"),
+                           min_users: int = Query(1, ge=1, description="Не показывать навыки реже этого"),
+                           db: Session = Depends(get_db)):
+    full = department_skill_matrix(db)
+    cols = sorted((i for i, s in enumerate(full["skills"]) if s["users"] >= min_users),
+                  key=lambda i: (-full["skills"][i]["users"], full["skills"][i]["name"]))[:limit]
+    rows = [i for i, d in enumerate(full["departments"]) if department is None or d["name"] == department]
+    if department is not None and not rows:
+        raise HTTPException(status_code=404, detail="Department not found")
+    return {"departments": [full["departments"][i] for i in rows], "skills": [full["skills"][i] for i in cols],
+            "matrix": [[full["matrix"][r][c] for c in cols] for r in rows]}
+
+@app.get("/analytics/departments/{department}/skill-gaps", response_model=dict)  # недостающие навыки подразделения
+def analytics_skill_gaps(department: str, limit: int = Query(20, ge=1, le=500), db: Session = Depends(get_db)):
+    report = department_skill_gaps(db, department)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Department not found")
+    return {**report, "role_gaps": report["role_gaps"][:limit]}
+
+@app.get("/analytics/certificates/expiry", response_model=dict)  # горизонты истечения сертификатов
+def analytics_certificate_expiry(horizons: str = Query("30,90,180", description="Горизонты в днях через запятую"),
+                                 db: Session = Depends(get_db)):
+    try:
+        parsed = tuple(sorted({int(h) for h in horizons.split(",") if h.strip()}))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="horizons: integers separated by commas")
+    if not parsed or parsed[0] < 0:
+        raise HTTPException(status_code=422, detail="horizons: at least one non-negative value")
+    return certificate_expiry_horizons(db, parsed)
+
+@app.get("/analytics/achievements/distribution", response_model=dict)  # распределение ачивок и XP
+def analytics_achievement_distribution(db: Session = Depends(get_db)):
+    return achievement_distribution(db)
+
+@app.get("/analytics/cache", response_model=dict)             # состояние кеша аналитики
+def analytics_cache_stats():
+    return analytics_cache.stats()
+
+# ============================== ЭКСПОРТ ДЛЯ АНАЛИТИКИ =========================
+# Выгрузка таблиц для ноутбуков в Parquet / Arrow IPC (pyarrow) пачками по id: в памяти не больше EXPORT_CHUNK_SIZE строк.
+# Схема колонок фиксирована в EXPORT_TABLES. Инкремент по водяным знакам: по времени (updated_at / obtained_at / created_at) —
+# полуинтервал [прошлый знак, старт - EXPORT_SAFETY_LAG_SEC), по id — для таблиц без времени изменения.
+# Водяные знаки и список файлов каждого запуска — в _export_state.json каталога выгрузки
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(os.path.dirname(DB_PATH) or ".", "exports"))  # куда выгружать
+EXPORT_FORMAT = os.getenv("EXPORT_FORMAT", "parquet")          # parquet | arrow (pyarrow) | jsonl.gz — только если задан явно
+EXPORT_FORMATS = ("parquet", "arrow", "jsonl.gz")
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "50000"))  # строк в пачке (= row group в Parquet)
+EXPORT_SAFETY_LAG_SEC = float(os.getenv("EXPORT_SAFETY_LAG_SEC", "60"))  # самые свежие строки — следующему запуску: их транзакции могли не завершиться
+EXPORT_NIGHTLY_HOUR = os.getenv("EXPORT_NIGHTLY_HOUR", "")     # час (UTC) ночной дельты; пусто — только по запросу
+EXPORT_SCHEMA_VERSION = 1                                      # меняется вместе с колонками EXPORT_TABLES (тогда — полная выгрузка)
+
+EXPORT_TABLES: Dict[str, Dict[str, Any]] = {                   # порядок важен: users раньше skills (изменённые профили)
+    "users": {"model": User, "watermark": ("time", "updated_at"), "mode": "upsert",
+              "columns": [("id", "int64"), ("email", "string"), ("full_name", "string"), ("phone", "string"),
+                          ("department", "string"), ("position", "string"), ("grade", "string"),
+                          ("experience_years", "float64"), ("created_at", "timestamp"), ("updated_at", "timestamp")]},
+    "skills": {"model": Skill, "watermark": ("id", "id"), "mode": "replace_by_user",  # навыки перезаписываются целиком: новые id = изменённый набор
+               "columns": [("id", "int64"), ("user_id", "int64"), ("skill_id", "int64"), ("name", "string"), ("level", "string")]},
+    "user_achievements": {"model": UserAchievement, "watermark": ("time", "obtained_at"), "mode": "append",
+                          "columns": [("id", "int64"), ("user_id", "int64"), ("code", "string"), ("level", "string"),
+                                      ("xp", "int64"), ("obtained_at", "timestamp")]},
+    "microsteps": {"model": Microstep, "watermark": ("id", "id"), "mode": "append",  # done_on вводит пользователь — не годится как знак
+                   "columns": [("id", "int64"), ("user_id", "int64"), ("done_on", "date")]},
+    "chat_messages": {"model": ChatMessage, "watermark": ("time", "created_at"), "mode": "append",
+                      "columns": [("id", "int64"), ("user_id", "int64"), ("role", "string"), ("content", "string"),
+                                  ("created_at", "timestamp")]},
+}
+
+def export_format_error(fmt: str) -> Optional[str]:         # почему выгрузка в этом формате невозможна (None — всё готово)
+    if fmt not in EXPORT_FORMATS:
+        return f"Unknown export format {fmt!r}, expected one of: {', '.join(EXPORT_FORMATS)}"
+    if fmt != "jsonl.gz" and pa is None:                      # молча сменить формат нельзя: ноутбуки читают Parquet/Arrow
+        return f"Export format {fmt} requires pyarrow (pip install pyarrow); for JSON lines set EXPORT_FORMAT=jsonl.gz"
+    return None
+
+class _ExportWriter:
+    """Файл одной таблицы за запуск: пишется во временный файл, появляется под своим именем только после close()"""
+    def __init__(self, path_base: str, columns: List[Tuple[str, str]], fmt: str):
+        self.fmt = fmt
+        self.path = f"{path_base}.{self.fmt}"
+        self.columns = columns
+        self.rows = 0
+        self._w = None
+        if fmt != "jsonl.gz":
+            types = {"int64": pa.int64(), "float64": pa.float64(), "string": pa.string(), "timestamp": pa.timestamp("us"), "date": pa.date32()}
+            self.schema = pa.schema([(name, types[t]) for name, t in columns])
+
+    def write(self, rows: List[Any]) -> None:
+        if self._w is None:                                   # файл создаём с первой пачкой: пустая дельта файлов не плодит
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if self.fmt == "parquet":
+                self._w = pq.ParquetWriter(self.path + ".tmp", self.schema, compression="zstd")
+            elif self.fmt == "arrow":
+                self._sink = pa.OSFile(self.path + ".tmp", "wb")
+                self._w = pa.ipc.new_file(self._sink, self.schema)
+            else:
+                self._w = gzip.open(self.path + ".tmp", "wt", encoding="utf-8")
+        if self.fmt != "jsonl.gz":
+            batch = pa.RecordBatch.from_arrays([pa.array([r[i] for r in rows], type=self.schema.field(i).type)
+                                                for i in range(len(self.columns))], schema=self.schema)
+            if self.fmt == "parquet":
+                self._w.write_table(pa.Table.from_batches([batch]))  # пачка = row group
+            else:
+                self._w.write_batch(batch)
+        else:
+            names = [name for name, _ in self.columns]
+            for r in rows:
+                self._w.write(json.dumps(dict(zip(names, r)), ensure_ascii=False, default=str) + "\n")
+        self.rows += len(rows)
+
+    def close(self, ok: bool = True) -> None:
+        if self._w is None:
+            return
+        self._w.close()
+        if self.fmt == "arrow":
+            self._sink.close()
+        if ok:
+            os.replace(self.path + ".tmp", self.path)
+        else:
+            os.remove(self.path + ".tmp")
+
+def _export_chunks(db: Session, spec: Dict[str, Any], where: List[Any]) -> Generator[List[Any], None, None]:
+    """Строки таблицы пачками по возрастанию id (keyset); после пачки транзакция чтения закрывается — запись в БД не ждёт выгрузку"""
+    model = spec["model"]
+    cols = [getattr(model, name) for name, _ in spec["columns"]]  # первая колонка — id
+    last_id = 0
+    while True:
+        rows = db.query(*cols).filter(*where, model.id > last_id).order_by(model.id).limit(EXPORT_CHUNK_SIZE).all()
+        db.rollback()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+def _load_export_state(out_dir: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(out_dir, "_export_state.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"schema_version": EXPORT_SCHEMA_VERSION, "tables": {}, "runs": []}
+
+def export_analytics(out_dir: str = EXPORT_DIR, full: bool = False, fmt: str = EXPORT_FORMAT) -> Dict[str, Any]:
+    """Выгружает EXPORT_TABLES в out_dir/<таблица>/<запуск>.<формат>. Без full — только изменения после прошлого запуска;
+    водяные знаки сохраняются, только если выгрузились все таблицы"""
+    error = export_format_error(fmt)
+    if error:                                                 # задача падает с понятной ошибкой, знаки не двигаются
+        raise RuntimeError(error)
+    state = _load_export_state(out_dir)
+    full = full or state.get("schema_version") != EXPORT_SCHEMA_VERSION or not state.get("tables")
+    started = datetime.utcnow()
+    upper_time = started - timedelta(seconds=EXPORT_SAFETY_LAG_SEC)
+    run_id = f"{started:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}-{'full' if full else 'delta'}"  # два запуска в одну секунду не затрут файлы друг друга
+    files: Dict[str, Any] = {}
+    tables_state: Dict[str, Any] = {}
+    changed_users: set = set()                                # профили из дельты users: их навыки выгружаем заново
+    db = SessionLocal()
+    try:
+        for name, spec in EXPORT_TABLES.items():
+            model, (kind, col_name) = spec["model"], spec["watermark"]
+            col = getattr(model, col_name)
+            prev = None if full else state["tables"].get(name, {}).get("watermark")
+            if kind == "time":
+                where = [col < upper_time] if prev is not None else [or_(col < upper_time, col.is_(None))]
+                if prev is not None:
+                    where.append(col >= datetime.fromisoformat(prev))
+                watermark: Any = upper_time.isoformat()
+            else:
+                upper_id = db.query(func.max(col)).scalar() or 0
+                where = [col > int(prev or 0), col <= upper_id]
+                watermark = max(upper_id, int(prev or 0))
+            writer = _ExportWriter(os.path.join(out_dir, name, run_id), spec["columns"], fmt)
+            try:
+                if spec["mode"] == "replace_by_user" and prev is not None:  # текущий набор навыков каждого затронутого профиля
+                    affected = sorted(changed_users | {uid for (uid,) in db.query(model.user_id).filter(*where).distinct()})
+                    for i in range(0, len(affected), BATCH_CHUNK_SIZE):
+                        for rows in _export_chunks(db, spec, [model.user_id.in_(affected[i:i + BATCH_CHUNK_SIZE])]):
+                            writer.write(rows)
+                else:
+                    for rows in _export_chunks(db, spec, where):
+                        writer.write(rows)
+                        if name == "users":
+                            changed_users.update(r[0] for r in rows)
+            except BaseException:
+                writer.close(ok=False)
+                raise
+            writer.close()
+            tables_state[name] = {"watermark": watermark, "watermark_column": col_name, "mode": spec["mode"],
+                                  "columns": [list(c) for c in spec["columns"]]}
+            files[name] = {"path": os.path.relpath(writer.path, out_dir) if writer.rows else None, "rows": writer.rows}
+    finally:
+        db.close()
+    run = {"run_id": run_id, "started_at": started.isoformat(), "full": full, "format": fmt, "files": files}
+    state = {"schema_version": EXPORT_SCHEMA_VERSION, "tables": tables_state, "runs": (state.get("runs", []) + [run])[-100:]}
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = os.path.join(out_dir, "_export_state.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(out_dir, "_export_state.json"))  # знаки сдвигаются атомарно и только после всех файлов
+    logger.info("Выгрузка %s: %s", run_id, {k: v["rows"] for k, v in files.items()}, extra={"fields": {"out_dir": out_dir}})
+    return run
+
+@job_handler("analytics_export")
+def run_analytics_export_job(db: Session, payload: Dict[str, Any]) -> Dict[str, Any]:  # выгрузка читает своей сессией пачками
+    return export_analytics(payload.get("out_dir") or EXPORT_DIR, full=bool(payload.get("full")), fmt=payload.get("format") or EXPORT_FORMAT)
+
+@scheduled(every_seconds=600)
+def schedule_nightly_export(db: Session) -> None:             # ночная дельта: раз в сутки после EXPORT_NIGHTLY_HOUR (UTC)
+    if not EXPORT_NIGHTLY_HOUR:
+        return
+    now = datetime.utcnow()
+    runs = _load_export_state(EXPORT_DIR).get("runs", [])
+    if now.hour >= int(EXPORT_NIGHTLY_HOUR) and (not runs or runs[-1]["started_at"][:10] < now.date().isoformat()):
+        enqueue_job(db, "analytics_export", {"out_dir": EXPORT_DIR}, dedup_key=analytics_export_dedup_key(False, None))
+
+def analytics_export_dedup_key(full: bool, fmt: Optional[str]) -> str:  # схлопываем только одинаковые запросы: full не теряется за дельтой
+    return f"analytics_export:{'full' if full else 'delta'}:{fmt or EXPORT_FORMAT}"
+
+class AnalyticsExportRequest(BaseModel):                      # ручной запуск выгрузки
+    full: bool = False                                        # True — всё заново, иначе дельта от прошлого запуска
+    format: Optional[str] = Field(None, pattern="^(parquet|arrow)$")  # по умолчанию EXPORT_FORMAT
+
+@app.post("/admin/exports/analytics", response_model=JobPublic)  # выгрузка для ноутбуков (в фоне; статус — /admin/jobs/{id})
+def start_analytics_export(payload: AnalyticsExportRequest = Body(AnalyticsExportRequest()), db: Session = Depends(get_db)):
+    error = export_format_error(payload.format or EXPORT_FORMAT)
+    if error:                                                 # не ставим задачу, которая заведомо упадёт
+        raise HTTPException(status_code=503, detail=error)
+    job = enqueue_job(db, "analytics_export", {"out_dir": EXPORT_DIR, "full": payload.full, "format": payload.format},
+                      dedup_key=analytics_export_dedup_key(payload.full, payload.format))
+    db.commit()
+    return job_public(job)
+
+# ============================== МЕТРИКИ =========================================
+@app.get("/metrics", include_in_schema=False)                 # для Prometheus scrape
+def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # ============================== ХЭЛСЧЕК ========================================
 @app.get("/health", response_model=dict)                       # простой health endpoint
 def health():                                                  # обработчик health
     return {"status": "ok", "time": datetime.utcnow().isoformat()}  # отдаём статус и текущий UTC
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["recalc-achievements"]:               # python backend.py recalc-achievements — пересчёт без API
+        _db = SessionLocal()
+        try:
+            _job = enqueue_job(_db, "achievements_recalc", {"chunk_size": RECALC_CHUNK_SIZE}, dedup_key="achievements_recalc")
+            _db.commit()
+            _job_id, _status = _job.id, _job.status
+        finally:
+            _db.close()
+        if _status == "running":                              # её уже выполняет сервер (после падения — продолжит при старте)
+            print(f"Задача пересчёта #{_job_id} уже выполняется")
+            sys.exit(0)
+        print(f"Задача пересчёта #{_job_id}")
+        job_runner.run_job(_job_id)                           # только свою задачу: чужая очередь остаётся воркеру сервера
+        sys.exit(0)
+    if sys.argv[1:2] == ["export-analytics"]:                  # python backend.py export-analytics [--full] [--out DIR] [--format arrow]
+        import argparse
+        _parser = argparse.ArgumentParser(prog="backend.py export-analytics")
+        _parser.add_argument("--full", action="store_true", help="выгрузить всё, а не дельту")
+        _parser.add_argument("--out", default=EXPORT_DIR)
+        _parser.add_argument("--format", choices=EXPORT_FORMATS, default=EXPORT_FORMAT)
+        _args = _parser.parse_args(sys.argv[2:])
+        print(json.dumps(export_analytics(_args.out, full=_args.full, fmt=_args.format), ensure_ascii=False, indent=1))
+        sys.exit(0)
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
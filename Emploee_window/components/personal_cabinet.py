@@ -1,11 +1,27 @@
 import gradio as gr
 import re
-from components.api_client import get_user_data, update_user_data
+import time
+from components.api_client import get_user_data, patch_user_data, export_resume_pdf
+
+AUTOSAVE_IDLE_SEC = 2.0  # пауза ввода, после которой изменения формы уходят на бэкенд
+RESUME_LABELS = ("Навыки", "Последнее место работы", "Период", "Обязанности",
+                 "Образование", "Специальность", "Сертификаты", "О себе")  # разделы resume_text в порядке формы
+
+
+def split_resume_text(text):
+    # resume_text -> {раздел: значение}, чтобы заполнить поля формы сохранённым резюме
+    parts = {}
+    marks = list(re.finditer(r"^(" + "|".join(RESUME_LABELS) + r"): ?", text or "", re.M))
+    for m, nxt in zip(marks, marks[1:] + [None]):
+        value = text[m.end():nxt.start() if nxt else len(text)].strip()
+        parts[m.group(1)] = "" if value == "None" else value
+    return parts
 
 
 def resume_component(user_id: int):
     # Получаем данные пользователя с бэкенда
     user_data = get_user_data(user_id) or {}
+    resume_parts = split_resume_text(user_data.get('resume_text') or '')
 
     # Функция для валидации телефона
     def validate_phone(phone):
@@ -22,25 +38,92 @@ def resume_component(user_id: int):
                 return digits  # Возвращаем только цифры
         return phone
 
-    # Функция для сохранения данных
-    def save_resume(full_name, position, email, phone, experience, english_level, location,
-                    skills, last_job, work_period, responsibilities, education, specialty,
-                    certificates, about):
-        # Подготавливаем данные для отправки
-        user_data = {
-            "full_name": full_name,
-            "position": position,
-            "email": email,
-            "phone": phone,
+    # Поля формы -> поля профиля на бэкенде
+    def form_payload(full_name, position, email, phone, experience, english_level, location,
+                     skills, last_job, work_period, responsibilities, education, specialty,
+                     certificates, about):
+        return {
+            "full_name": full_name or "",
+            "position": position or "",
+            "email": email or "",
+            "phone": phone or "",
             "experience_years": float(experience) if experience else 0.0,
-            "grade": english_level,  # Используем поле grade для уровня английского
-            "department": location,  # Используем поле department для локации
+            "grade": english_level or "",  # Используем поле grade для уровня английского
+            "department": location or "",  # Используем поле department для локации
+            "skills": [{"name": s.strip()} for s in re.split(r"[,;\n]", skills or "") if s.strip()],  # бэкенд сведёт синонимы к таксономии
             "resume_text": f"Навыки: {skills}\n\nПоследнее место работы: {last_job}\nПериод: {work_period}\nОбязанности: {responsibilities}\n\nОбразование: {education}\nСпециальность: {specialty}\n\nСертификаты: {certificates}\n\nО себе: {about}"
         }
 
-        # Отправляем на бэкенд
-        success = update_user_data(user_id, user_data)
-        return "✅ Данные сохранены!" if success else "❌ Ошибка при сохранении"
+    # Профиль с бэкенда -> значения полей формы (в порядке form_inputs)
+    def profile_values(user):
+        parts = split_resume_text(user.get('resume_text') or '')
+        return normalized([user.get('full_name'), user.get('position'), user.get('email'), user.get('phone'),
+                           user.get('experience_years'), user.get('grade'), user.get('department'),
+                           ", ".join(s["name"] for s in user.get('skills', []))]
+                          + [parts.get(label, '') for label in RESUME_LABELS[1:]])
+
+    # None -> "", стаж -> число: значения полей сравниваем без оглядки на тип
+    def normalized(values):
+        return [float(v or 0) if i == 4 else (v or "") for i, v in enumerate(values)]
+
+    # PATCH с отличиями от последней синхронизации и If-Match её версии. На 412 (профиль изменили в другом окне
+    # или HR) чужие правки подтягиваем в форму, свои по остальным полям отправляем поверх свежей версии;
+    # поле, изменённое и там и тут, берём с сервера и предупреждаем
+    def push_changes(sync, values):
+        values = normalized(values)
+        refreshed = [gr.update() for _ in values]
+        for _ in range(2):
+            base = form_payload(*sync["values"])
+            changes = {k: v for k, v in form_payload(*values).items() if base[k] != v}
+            if not changes:
+                return sync, "✅ Все изменения сохранены", True, refreshed
+            status, body = patch_user_data(user_id, changes, sync["version"])
+            if status == 200:
+                return ({"version": body.get("version"), "values": values},
+                        f"✅ Сохранено в {time.strftime('%H:%M:%S')}", True, refreshed)
+            if status != 412:
+                return sync, "❌ Ошибка при сохранении", False, refreshed
+            current = profile_values(body["current"])
+            overwritten = []
+            for i, (mine, theirs, old) in enumerate(zip(values, current, sync["values"])):
+                if theirs == old:
+                    continue  # в другом окне поле не меняли — оставляем своё
+                if mine != old and mine != theirs:
+                    overwritten.append(form_inputs[i].label)
+                values[i] = refreshed[i] = theirs
+            sync = {"version": body["current"].get("version"), "values": current}
+            if overwritten:
+                gr.Warning("Профиль изменили в другом окне, загружены актуальные значения: " + ", ".join(overwritten))
+        return sync, "⚠️ Профиль одновременно меняют в другом окне — повторим после паузы", False, refreshed
+
+    # Кнопка «Сохранить»: сразу, не дожидаясь паузы
+    def save_resume(sync, *values):
+        sync, status, done, refreshed = push_changes(sync, values)
+        return (sync, status, 0.0 if done else time.monotonic(),  # не сохранилось — повторим после следующей паузы
+                gr.Timer(active=not done), *refreshed)
+
+    # Тик таймера: сохраняем, только когда пользователь перестал печатать
+    def autosave(last_edit, sync, *values):
+        if not last_edit:
+            return (sync, gr.update(), 0.0, gr.Timer(active=False), *[gr.update() for _ in values])
+        if time.monotonic() - last_edit < AUTOSAVE_IDLE_SEC:
+            return (sync, gr.update(), last_edit, gr.update(), *[gr.update() for _ in values])
+        return save_resume(sync, *values)
+
+    # Любой ввод откладывает автосохранение и включает таймер
+    def mark_edited():
+        return time.monotonic(), gr.Timer(active=True)
+
+    # Телефон форматируем при уходе с поля, а не на каждое нажатие
+    def format_phone(phone):
+        return validate_phone(phone), time.monotonic(), gr.Timer(active=True)
+
+    # Функция для выгрузки сохранённого резюме в PDF
+    def export_pdf():
+        path = export_resume_pdf(user_id)
+        if path is None:
+            gr.Warning("Не удалось сформировать PDF")
+        return gr.update(value=path, visible=path is not None)
 
     with gr.Column(elem_classes="t1-card"):
         gr.Markdown("## 📄 Резюме")
@@ -76,11 +159,6 @@ def resume_component(user_id: int):
                         interactive=True,
                         max_lines=1
                     )
-                    phone_input.change(
-                        fn=validate_phone,
-                        inputs=phone_input,
-                        outputs=phone_input
-                    )
 
             with gr.Column(scale=1):
                 gr.Markdown("### Профессиональная информация")
@@ -107,6 +185,7 @@ def resume_component(user_id: int):
         with gr.Group():
             skills_input = gr.Textbox(
                 label="Ключевые навыки",
+                value=", ".join(s["name"] for s in user_data.get('skills', [])),
                 placeholder="Перечислите ваши основные навыки через запятую",
                 interactive=True,
                 lines=2
@@ -117,16 +196,19 @@ def resume_component(user_id: int):
             last_job_input = gr.Textbox(
                 label="Последнее место работы",
                 placeholder="Название компании",
+                value=resume_parts.get("Последнее место работы", ""),
                 interactive=True
             )
             work_period_input = gr.Textbox(
                 label="Период работы",
                 placeholder="Например: 2020-2023",
+                value=resume_parts.get("Период", ""),
                 interactive=True
             )
             responsibilities_input = gr.Textbox(
                 label="Обязанности",
                 placeholder="Опишите ваши основные обязанности",
+                value=resume_parts.get("Обязанности", ""),
                 interactive=True,
                 lines=3
             )
@@ -136,11 +218,13 @@ def resume_component(user_id: int):
             education_input = gr.Textbox(
                 label="ВУЗ",
                 placeholder="Название учебного заведения",
+                value=resume_parts.get("Образование", ""),
                 interactive=True
             )
             specialty_input = gr.Textbox(
                 label="Специальность",
                 placeholder="Ваша специальность",
+                value=resume_parts.get("Специальность", ""),
                 interactive=True
             )
 
@@ -149,6 +233,7 @@ def resume_component(user_id: int):
             certificates_input = gr.Textbox(
                 label="Профессиональные сертификаты",
                 placeholder="Перечислите ваши сертификаты",
+                value=resume_parts.get("Сертификаты", ""),
                 interactive=True,
                 lines=2
             )
@@ -158,23 +243,35 @@ def resume_component(user_id: int):
             about_input = gr.Textbox(
                 label="Дополнительная информация",
                 placeholder="Расскажите о себе",
+                value=resume_parts.get("О себе", ""),
                 interactive=True,
                 lines=3
             )
 
         # Кнопки сохранения
-        save_status = gr.Textbox(visible=False)
+        save_status = gr.Markdown("")
         with gr.Row():
             save_btn = gr.Button("💾 Сохранить резюме", elem_classes="t1-button")
             export_btn = gr.Button("📤 Экспорт в PDF", elem_classes="t1-button-secondary")
+        pdf_file = gr.File(label="Резюме в PDF", visible=False)
+
+        form_inputs = [
+            full_name, position_input, email_input, phone_input, experience_input,
+            english_input, location_input, skills_input, last_job_input,
+            work_period_input, responsibilities_input, education_input,
+            specialty_input, certificates_input, about_input
+        ]
+        sync_state = gr.State({"version": user_data.get('version'),  # версия профиля для If-Match
+                               "values": normalized([c.value for c in form_inputs])})  # что уже лежит на бэкенде
+        last_edit = gr.State(0.0)  # время последнего ввода; 0 — несохранённых правок нет
+        autosave_timer = gr.Timer(1.0, active=False)  # тикает, только пока есть несохранённые правки
+
+        gr.on(triggers=[c.input for c in form_inputs], fn=mark_edited, inputs=None,
+              outputs=[last_edit, autosave_timer])
+        phone_input.blur(fn=format_phone, inputs=phone_input, outputs=[phone_input, last_edit, autosave_timer])
+        autosave_timer.tick(fn=autosave, inputs=[last_edit, sync_state, *form_inputs],
+                            outputs=[sync_state, save_status, last_edit, autosave_timer, *form_inputs])
+        save_btn.click(fn=save_resume, inputs=[sync_state, *form_inputs],
+                       outputs=[sync_state, save_status, last_edit, autosave_timer, *form_inputs])
 
-        save_btn.click(
-            fn=save_resume,
-            inputs=[
-                full_name, position_input, email_input, phone_input, experience_input,
-                english_input, location_input, skills_input, last_job_input,
-                work_period_input, responsibilities_input, education_input,
-                specialty_input, certificates_input, about_input
-            ],
-            outputs=save_status
-        )
\ No newline at end of file
+        export_btn.click(fn=export_pdf, inputs=None, outputs=pdf_file)
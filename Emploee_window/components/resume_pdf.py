@@ -0,0 +1,84 @@
+# resume_pdf.py — рендер резюме в PDF (fpdf2) без БД и без backend: этот модуль импортируют процессы пула рендера.
+# Пул запускается методом spawn — дочерний процесс поднимает чистый интерпретатор и берёт отсюда только рендер,
+# а не копию сервера с его потоками, блокировками и соединениями с БД
+import os
+import signal
+from typing import Any, Dict, Optional
+
+try:                                                         # fpdf2 — необязательная зависимость выгрузки резюме в PDF
+    from fpdf import FPDF
+except ImportError:
+    FPDF = None
+
+PDF_TEMPLATE_VERSION = 1                                      # меняется вместе с разметкой render_resume_pdf — старый кеш не используется
+PDF_FONT_PATH = os.getenv("PDF_FONT_PATH", "")                # TTF с кириллицей; пусто — ищем DejaVuSans среди системных шрифтов
+_PDF_FONT_CANDIDATES = ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+                        "/usr/local/share/fonts/DejaVuSans.ttf", "C:\\Windows\\Fonts\\DejaVuSans.ttf")
+_worker_font: Optional[str] = None                            # шрифт, выбранный родителем (задаёт init_worker)
+
+
+def pdf_font_path() -> Optional[str]:                         # первый существующий шрифт
+    if _worker_font:
+        return _worker_font
+    return next((p for p in ((PDF_FONT_PATH,) if PDF_FONT_PATH else _PDF_FONT_CANDIDATES) if os.path.exists(p)), None)
+
+
+def pdf_renderer_error() -> Optional[str]:                    # почему рендер недоступен (None — всё готово)
+    if FPDF is None:
+        return "PDF renderer is not installed (pip install fpdf2)"
+    if pdf_font_path() is None:
+        return "No Cyrillic TTF font found, set PDF_FONT_PATH"
+    return None
+
+
+def init_worker(font: Optional[str]) -> None:
+    """Инициализатор процесса пула: шрифт тот же, что нашёл сервер; Ctrl+C обрабатывает только родитель"""
+    global _worker_font
+    _worker_font = font
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def render_resume_pdf(profile: Dict[str, Any]) -> bytes:
+    """PDF из resume_profile() без обращений к БД — выполняется и в пуле процессов"""
+    font = pdf_font_path()
+    bold = font[:-4] + "-Bold.ttf"                            # DejaVuSans-Bold.ttf рядом с обычным; нет — жирный тем же шрифтом
+    pdf = FPDF(format="A4")
+    pdf.add_font("Body", "", font)
+    pdf.add_font("Body", "B", bold if os.path.exists(bold) else font)
+    pdf.set_title(profile["full_name"])
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+
+    def text(value: str, size: int = 10, style: str = "", height: float = 5) -> None:
+        pdf.set_font("Body", style, size)
+        pdf.multi_cell(0, height, value, new_x="LMARGIN", new_y="NEXT")
+
+    def heading(title: str) -> None:
+        pdf.ln(3)
+        text(title, 13, "B", 8)
+
+    text(profile["full_name"], 18, "B", 10)
+    text(" · ".join(x for x in (profile["position"], profile["department"], profile["grade"]) if x), 11)
+    text(" · ".join(x for x in (profile["email"], profile["phone"], f"стаж {profile['experience_years']:g} г.") if x), 10)
+    if profile["skills"]:
+        heading("Навыки")
+        text(", ".join(f"{name} ({level})" if level else name for name, level in profile["skills"]))
+    if profile["projects"]:
+        heading("Проекты")
+        for title, role, description, kpi in profile["projects"]:
+            text(f"{title} — {role}" if role else title, 11, "B")
+            for line in (description, f"Результат: {kpi}" if kpi else ""):
+                if line:
+                    text(line)
+    if profile["certificates"]:
+        heading("Сертификаты")
+        for name, issued_by, valid_until in profile["certificates"]:
+            text(name + (f", {issued_by}" if issued_by else "") + (f" (до {valid_until})" if valid_until else ""))
+    if profile["achievements"]:
+        heading("Достижения")
+        for title, level, xp in profile["achievements"]:
+            text(f"{title}: {level} (+{xp} XP)")
+    if profile["resume_text"].strip():
+        heading("О себе")
+        text(profile["resume_text"])
+    return bytes(pdf.output())
@@ -1,7 +1,7 @@
 import gradio as gr
 import os
 from components.personal_cabinet import resume_component
-from components.achievements import achievements_component, achievements_page
+from components.achievements import achievements_component, achievements_page, SIDEBAR_STREAM_TTL, SIDEBAR_STREAMS
 from components.ai_consultant import ai_consultant_component
 
 # Чистый бело-голубой стиль
@@ -544,7 +544,7 @@ with gr.Blocks(css=css, title="CareerAI") as demo:
 
         # Правая колонка - Достижения и ИИ-консультант
         with gr.Column(scale=1):
-            achievements_component(user_id=1)
+            sidebar_stream, sidebar_outputs = achievements_component(user_id=1)
             ai_consultant_component(user_id=1)
             # ---- Обработчики меню ----
             def _show_resume():
@@ -554,6 +554,12 @@ with gr.Blocks(css=css, title="CareerAI") as demo:
             btn_resume.click(_show_resume, inputs=[], outputs=[center_resume, center_achievements])
             btn_ach.click(_show_achievements, inputs=[], outputs=[center_resume, center_achievements])
 
+    # Сайдбар достижений получает дельты по SSE, пока открыта страница (у каждой вкладки — свой поток).
+    # Поток живёт SIDEBAR_STREAM_TTL; таймер тикает только в открытой вкладке и запускает следующий
+    sidebar_timer = gr.Timer(SIDEBAR_STREAM_TTL)
+    gr.on(triggers=[demo.load, sidebar_timer.tick], fn=sidebar_stream, inputs=None, outputs=sidebar_outputs,
+          concurrency_limit=SIDEBAR_STREAMS, concurrency_id="sidebar_stream", trigger_mode="always_last")
+
 
 
 